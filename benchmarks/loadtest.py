@@ -0,0 +1,263 @@
+"""
+End-to-end load test of the question pipeline against local stand-ins.
+
+N simulated users answer questions concurrently through pipeline.answer_question,
+the flow behind main.py, while every external service is replaced by a stand-in
+from benchmarks/standins.py. The report gives throughput, tail latency per
+question and per stage, and memory per module, so concurrency, caching and
+streaming changes can be compared by numbers, offline.
+
+Usage:
+    python -m benchmarks.loadtest --users 20 --questions 200
+    python -m benchmarks.loadtest --users 20 --distinct 50 --stream --json after.json --compare before.json
+    python -m benchmarks.loadtest --memory    # memory per module; tracing it slows the run down about tenfold
+    python -m benchmarks.loadtest --set gemini.median_ms=800 --set web.error_rate=0.2
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+from benchmarks import standins
+from modules import pipeline, ratelimit, tracing
+from modules.batch import parse_rate
+from modules.tracing import LatencyHistogram
+
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS
+    resource = None
+
+
+MODULES_DIR: str = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "modules")
+MEMORY_SAMPLE_SECONDS: float = 0.25
+TRACEBACK_FRAMES: int = 16
+
+
+class MemorySampler:
+    """
+    Samples traced memory while the load runs and keeps a snapshot near its peak.
+    Allocations are attributed to the innermost frame in modules/, so memory held
+    by a library call is counted against the pipeline module that made it.
+    """
+
+    def __init__(self, interval: float = MEMORY_SAMPLE_SECONDS):
+        self.interval = interval
+        self.snapshot: Optional[tracemalloc.Snapshot] = None
+        self._snapshot_size: int = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="loadtest-memory", daemon=True)
+
+    def start(self) -> None:
+        tracemalloc.start(TRACEBACK_FRAMES)
+        self._thread.start()
+
+    def stop(self) -> Dict[str, Any]:
+        self._stop.set()
+        self._thread.join()
+        if self.snapshot is None:  # a run shorter than one interval
+            self.snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {"peak_traced_mb": round(peak / 2 ** 20, 1), "by_module_mb": self.by_module()}
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            current, _ = tracemalloc.get_traced_memory()
+            # A new snapshot only when memory grew noticeably, since taking one is slow
+            if current > self._snapshot_size * 1.1:
+                self.snapshot = tracemalloc.take_snapshot()
+                self._snapshot_size = current
+
+    def by_module(self) -> Dict[str, float]:
+        if self.snapshot is None:
+            return {}
+        sizes: Dict[str, int] = {}
+        for statistic in self.snapshot.statistics("traceback"):
+            module: str = "other"
+            for frame in reversed(statistic.traceback):  # innermost frame last
+                if frame.filename.startswith(MODULES_DIR):
+                    module = os.path.splitext(os.path.basename(frame.filename))[0]
+                    break
+            sizes[module] = sizes.get(module, 0) + statistic.size
+        return {module: round(size / 2 ** 20, 2) for module, size in sorted(sizes.items(), key=lambda item: -item[1])}
+
+
+def make_questions(count: int, distinct: int, seed: int = 1) -> List[str]:
+    """
+    Returns:
+        count questions drawn from distinct different ones; repeats exercise the caches.
+    """
+    topics: List[str] = [f"topic {i}" for i in range(max(1, distinct))]
+    rng: random.Random = random.Random(seed)
+    return [f"How does {rng.choice(topics) if distinct < count else topics[i % len(topics)]} work?"
+            for i in range(count)]
+
+
+def run_load(users: int, questions: List[str], stand_ins: standins.StandIns, stream: bool = False,
+             measure_memory: bool = False, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Answers the questions with users concurrent simulated users.
+    Args:
+        users: The number of users, each answering one question at a time.
+        questions: The questions, taken in order by whichever user is free.
+        stand_ins: The stand-ins that answer for the external services.
+        stream: Whether answers are streamed, as in the app.
+        measure_memory: Whether to trace memory per module; it slows every allocation down.
+        options: Further keyword arguments for pipeline.answer_question.
+    Returns:
+        The report: throughput, question and stage latency, memory and stand-in calls.
+    """
+    pending: List[str] = list(reversed(questions))
+    pending_lock = threading.Lock()
+    latencies: Dict[str, LatencyHistogram] = {"total": LatencyHistogram(), "time_to_first_token": LatencyHistogram()}
+    outcomes: Dict[str, int] = {"ok": 0, "failed": 0}
+
+    def user() -> None:
+        while True:
+            with pending_lock:
+                if not pending:
+                    return
+                question: str = pending.pop()
+            try:
+                result: pipeline.PipelineResult = pipeline.answer_question(
+                    question, on_chunk=(lambda chunk: None) if stream else None, **(options or {}))
+                failed: bool = result.error is not None
+                latencies["total"].record(result.timings["total"])
+                latencies["time_to_first_token"].record(result.timings["gather"] + result.timings["time_to_first_token"])
+            except Exception:
+                failed = True
+            with pending_lock:
+                outcomes["failed" if failed else "ok"] += 1
+
+    sampler: Optional[MemorySampler] = MemorySampler() if measure_memory else None
+    with standins.installed(stand_ins):
+        tracing.reset_latency()
+        if sampler is not None:
+            sampler.start()
+        start: float = time.perf_counter()
+        threads: List[threading.Thread] = [threading.Thread(target=user, name=f"loadtest-user-{i}")
+                                           for i in range(users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed: float = time.perf_counter() - start
+        memory: Dict[str, Any] = sampler.stop() if sampler is not None else {}
+        stages: Dict[str, Dict[str, float]] = tracing.latency_summary()
+
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux
+        memory["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return {
+        "users": users,
+        "questions": len(questions),
+        "stream": stream,
+        "ok": outcomes["ok"],
+        "failed": outcomes["failed"],
+        "elapsed_s": round(elapsed, 2),
+        "throughput_qps": round(len(questions) / elapsed, 3) if elapsed else 0.0,
+        "latency": {name: histogram.summary() for name, histogram in latencies.items()},
+        "stages": stages,
+        "memory": memory,
+        "services": stand_ins.summary(),
+    }
+
+
+def format_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Renders a report as text, with the change against a baseline report if one is given.
+    """
+    def change(value: float, old: Optional[float]) -> str:
+        return f" ({value / old:.2f}x)" if old else ""
+
+    old: Dict[str, Any] = baseline or {}
+    lines: List[str] = [
+        f"{report['questions']} questions, {report['users']} users{', streamed' if report['stream'] else ''}: "
+        f"{report['ok']} ok, {report['failed']} failed in {report['elapsed_s']}s",
+        f"throughput: {report['throughput_qps']} questions/s"
+        f"{change(report['throughput_qps'], old.get('throughput_qps'))}",
+        "",
+        f"{'latency (ms)':<28}{'count':>7}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}",
+    ]
+    rows: Dict[str, Dict[str, float]] = dict({f"question {name}": summary for name, summary in report["latency"].items()},
+                                              **report["stages"])
+    old_rows: Dict[str, Dict[str, float]] = dict({f"question {name}": summary for name, summary in old.get("latency", {}).items()},
+                                                  **old.get("stages", {}))
+    for name, summary in rows.items():
+        lines.append(f"{name:<28}{summary['count']:>7}{summary['p50_ms']:>10}{summary['p95_ms']:>10}{summary['p99_ms']:>10}"
+                     f"{summary['max_ms']:>10}{change(summary['p95_ms'], old_rows.get(name, {}).get('p95_ms'))}")
+    memory: Dict[str, Any] = report["memory"]
+    if memory:
+        traced: str = f", peak traced {memory['peak_traced_mb']} MB" if "peak_traced_mb" in memory else ""
+        lines += ["", f"memory: peak RSS {memory.get('peak_rss_mb', '?')} MB{traced}"]
+        lines += [f"  {module:<26}{size:>8} MB" for module, size in memory.get("by_module_mb", {}).items()]
+    lines += ["", f"{'stand-in':<28}{'calls':>7}{'errors':>10}"]
+    lines += [f"{name:<28}{service['calls']:>7}{service['errors']:>10}" for name, service in report["services"].items()]
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10, help="Concurrent simulated users")
+    parser.add_argument("--questions", type=int, default=50, help="Questions answered in total")
+    parser.add_argument("--distinct", type=int, default=None,
+                        help="Different questions among them (default: all different); repeats hit the caches")
+    parser.add_argument("--stream", action="store_true", help="Stream answers, as the app does")
+    parser.add_argument("--sources", choices=["both", "web", "youtube"], default="both")
+    parser.add_argument("--max-web-results", type=int, default=5)
+    parser.add_argument("--max-youtube-results", type=int, default=3)
+    parser.add_argument("--deadline", type=float, default=None,
+                        help="Seconds each question may spend searching and fetching before slow sources are dropped")
+    parser.add_argument("--set", dest="settings", action="append", default=[], metavar="SERVICE.FIELD=VALUE",
+                        help="Stand-in setting, e.g. gemini.median_ms=800 or web.error_rate=0.2; repeatable")
+    parser.add_argument("--rate", type=parse_rate, action="append", default=[], metavar="PROVIDER=RPS",
+                        help="Requests per second allowed to a backend, as in modules.batch; repeatable")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--memory", action="store_true",
+                        help="Trace memory per module; latencies are then much higher than without")
+    parser.add_argument("--json", help="Write the report to this file")
+    parser.add_argument("--compare", help="A report written earlier with --json to compare against")
+    args = parser.parse_args(argv)
+
+    profiles: Dict[str, standins.ServiceProfile] = {}
+    try:
+        for setting in args.settings:
+            profiles = standins.parse_profile_setting(setting, profiles)
+    except ValueError as e:
+        parser.error(str(e))
+    ratelimit.configure(dict(args.rate))
+
+    report: Dict[str, Any] = run_load(
+        args.users,
+        make_questions(args.questions, args.distinct or args.questions, args.seed),
+        standins.StandIns(profiles, seed=args.seed),
+        stream=args.stream,
+        measure_memory=args.memory,
+        options={
+            "include_web": args.sources in ("both", "web"),
+            "include_youtube": args.sources in ("both", "youtube"),
+            "max_web_results": args.max_web_results,
+            "max_youtube_results": args.max_youtube_results,
+            "deadline": args.deadline,
+        },
+    )
+    baseline: Optional[Dict[str, Any]] = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print(format_report(report, baseline))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
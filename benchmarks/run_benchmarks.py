@@ -0,0 +1,196 @@
+"""
+Offline microbenchmarks for the CPU-bound hot paths of the question pipeline.
+
+Every input is synthetic and fixed (seeded generators and the saved HTML in
+benchmarks/fixtures), so runs are comparable across commits on one machine.
+
+Usage:
+    python -m benchmarks.run_benchmarks                    # print timings
+    python -m benchmarks.run_benchmarks --update-baseline  # record benchmarks/baseline.json
+    python -m benchmarks.run_benchmarks --check            # fail if slower than the baseline
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from modules import citations, scraper
+from modules.transcripts import Transcript
+
+
+BENCHMARK_DIR: str = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR: str = os.path.join(BENCHMARK_DIR, "fixtures")
+BASELINE_PATH: str = os.path.join(BENCHMARK_DIR, "baseline.json")
+DEFAULT_THRESHOLD: float = 1.25
+
+WORDS: List[str] = (
+    "the energy of a cell is stored in molecules that the body uses to power movement growth and repair "
+    "researchers measured how quickly this process happens under different conditions"
+).split()
+
+
+def make_sources(n_web: int = 10, n_youtube: int = 5) -> Tuple[List[Dict[str, str]], List[Dict[str, str]]]:
+    web_sources = [{"title": f"Article {i}", "url": f"https://example.com/article/{i}"} for i in range(n_web)]
+    youtube_sources = [
+        {"id": f"video{i}", "title": f"Video {i}", "url": f"https://www.youtube.com/watch?v=video{i}"}
+        for i in range(n_youtube)
+    ]
+    return web_sources, youtube_sources
+
+
+def make_answer(n_citations: int, n_web: int, n_youtube: int, seed: int = 1) -> str:
+    """A long answer with one citation per sentence, half of them to timestamped videos."""
+    rng = random.Random(seed)
+    sentences: List[str] = []
+    for _ in range(n_citations):
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 20))).capitalize()
+        source = rng.randint(1, n_web + n_youtube)
+        if source > n_web:
+            citation = f"[{source}][{rng.randint(0, 179):02d}:{rng.randint(0, 59):02d}]"
+        else:
+            citation = f"[{source}]"
+        sentences.append(f"{text} {citation}.")
+    sources = "\n".join(f"{i}. Source {i}" for i in range(1, n_web + n_youtube + 1))
+    return " ".join(sentences) + "\n\nSOURCES:\n" + sources
+
+
+def make_transcript_segments(hours: float, seed: int = 2) -> List[Dict[str, Any]]:
+    """Caption segments every 2-4 seconds, as youtube-transcript-api returns them."""
+    rng = random.Random(seed)
+    segments: List[Dict[str, Any]] = []
+    start = 0.0
+    while start < hours * 3600:
+        duration = rng.uniform(2.0, 4.0)
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 12)))
+        segments.append({"text": text, "start": round(start, 2), "duration": round(duration, 2)})
+        start += duration
+    return segments
+
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURE_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def build_benchmarks() -> Dict[str, Callable[[], Any]]:
+    """
+    Returns:
+        Benchmark names mapped to zero-argument callables that run one iteration.
+    """
+    web_sources, youtube_sources = make_sources()
+    long_answer = make_answer(500, len(web_sources), len(youtube_sources))
+    _, _, earliest_timestamps = citations.process_citations(long_answer, web_sources, youtube_sources)
+
+    segments = make_transcript_segments(hours=3)
+    legacy_segments = [dict(segment, timestamp=f"{int(segment['start'] // 60):02d}:{int(segment['start'] % 60):02d}")
+                       for segment in segments]
+    transcript_bytes = Transcript.from_segments("bench", segments).to_bytes()
+
+    article_html = read_fixture("article.html")
+    table_html = read_fixture("reference_table.html")
+
+    return {
+        "process_citations_500": lambda: citations.process_citations(long_answer, web_sources, youtube_sources),
+        "create_sources_list_15": lambda: citations.create_sources_list(web_sources, youtube_sources, earliest_timestamps),
+        "format_transcript_text_3h_segments": lambda: scraper.format_transcript_text(legacy_segments),
+        "format_transcript_text_3h_transcript": lambda: scraper.format_transcript_text(
+            Transcript.from_bytes("bench", transcript_bytes)
+        ),
+        "transcript_from_segments_3h": lambda: Transcript.from_segments("bench", segments),
+        "extract_article_text_article": lambda: scraper.extract_article_text("https://example.com/article", article_html),
+        "extract_page_text_article": lambda: scraper.extract_page_text(article_html),
+        "extract_page_text_table": lambda: scraper.extract_page_text(table_html),
+    }
+
+
+def measure(fn: Callable[[], Any], repeat: int, min_time: float = 0.2) -> float:
+    """
+    Times a callable.
+    Args:
+        fn: One benchmark iteration.
+        repeat: The number of timed rounds.
+        min_time: Each round runs enough iterations to take at least this many seconds.
+    Returns:
+        The median seconds per iteration across rounds.
+    """
+    fn()  # warm up imports and caches
+    start = time.perf_counter()
+    fn()
+    single = max(time.perf_counter() - start, 1e-9)
+    number = max(1, int(min_time / single))
+    rounds: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        rounds.append((time.perf_counter() - start) / number)
+    return statistics.median(rounds)
+
+
+def run(selected: Optional[List[str]], repeat: int) -> Dict[str, float]:
+    benchmarks = build_benchmarks()
+    results: Dict[str, float] = {}
+    for name, fn in benchmarks.items():
+        if selected and not any(pattern in name for pattern in selected):
+            continue
+        results[name] = measure(fn, repeat)
+        print(f"{name:45s} {results[name] * 1000:10.3f} ms")
+    return results
+
+
+def check(results: Dict[str, float], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    Returns:
+        A description of every benchmark that is more than threshold times slower
+        than its baseline.
+    """
+    regressions: List[str] = []
+    for name, seconds in results.items():
+        reference = baseline.get("results", {}).get(name)
+        if reference and seconds > reference * threshold:
+            regressions.append(f"{name}: {seconds * 1000:.3f} ms vs baseline {reference * 1000:.3f} ms "
+                               f"({seconds / reference:.2f}x, threshold {threshold:.2f}x)")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmarks", nargs="*", help="Only run benchmarks whose name contains one of these")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed rounds per benchmark")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline JSON file")
+    parser.add_argument("--update-baseline", action="store_true", help="Write the results to the baseline file")
+    parser.add_argument("--check", action="store_true", help="Exit with status 1 if a benchmark regressed")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Allowed slowdown factor against the baseline in --check mode")
+    args = parser.parse_args(argv)
+
+    results = run(args.benchmarks, args.repeat)
+
+    if args.update_baseline:
+        baseline: Dict[str, Any] = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+        baseline.setdefault("results", {}).update(results)
+        baseline["machine"] = {"python": platform.python_version(), "platform": platform.platform()}
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+
+    if args.check:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = check(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
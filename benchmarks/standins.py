@@ -0,0 +1,364 @@
+"""
+Local stand-ins for every external service of the question pipeline, for load tests.
+
+Each stand-in answers like the real service, after a latency drawn from a
+log-normal distribution, failing at a configurable rate, with payloads of a
+configurable size. Content is generated from the query, URL or video ID, so
+repeated requests return the same data and different pages do not look like
+duplicates of each other.
+"""
+import hashlib
+import json
+import math
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from dataclasses import asdict, dataclass, replace
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional
+from unittest.mock import patch
+
+from modules import breaker, cache, llm, ratelimit, search, tracing, transcripts
+
+
+@dataclass(frozen=True)
+class ServiceProfile:
+    """
+    How one stand-in behaves.
+    median_ms and p99_ms define its log-normal latency. error_rate is the
+    fraction of calls that fail. size is the payload size: the number of results
+    for the search services, segments per transcript, bytes per web page and
+    characters per Gemini answer.
+    """
+    median_ms: float
+    p99_ms: float
+    error_rate: float = 0.0
+    size: int = 0
+
+    def sample_seconds(self, rng: random.Random) -> float:
+        if self.median_ms <= 0:
+            return 0.0
+        # z of the 99th percentile of the standard normal distribution
+        sigma: float = math.log(max(self.p99_ms, self.median_ms) / self.median_ms) / 2.326
+        return self.median_ms * math.exp(sigma * rng.gauss(0.0, 1.0)) / 1000
+
+
+# Rough latencies of the real services as seen from a cloud VM
+DEFAULT_PROFILES: Dict[str, ServiceProfile] = {
+    "duckduckgo": ServiceProfile(median_ms=600, p99_ms=3000, error_rate=0.02, size=10),
+    "serpapi": ServiceProfile(median_ms=1200, p99_ms=4000, error_rate=0.01, size=10),
+    "youtube": ServiceProfile(median_ms=250, p99_ms=1000, error_rate=0.01, size=10),
+    "transcript": ServiceProfile(median_ms=400, p99_ms=2000, error_rate=0.05, size=400),
+    "web": ServiceProfile(median_ms=500, p99_ms=5000, error_rate=0.05, size=120_000),
+    "gemini": ServiceProfile(median_ms=2500, p99_ms=9000, error_rate=0.01, size=1500),
+}
+
+WORDS: List[str] = (
+    "solar cells convert light into electricity when photons free electrons in a semiconductor "
+    "layer the current flows through a circuit and panels are rated by their peak output under "
+    "standard test conditions efficiency depends on temperature shading angle and the material used"
+).split()
+
+
+def _seed(*parts: Any) -> int:
+    return int.from_bytes(hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def _sentence(rng: random.Random, words: int = 14) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+class StandIns:
+    """
+    The stand-ins of one load test run, sharing a seeded random generator.
+    Args:
+        profiles: Overrides of DEFAULT_PROFILES, by service name.
+        seed: Seeds the latencies and failures, so runs are comparable.
+    """
+
+    def __init__(self, profiles: Optional[Dict[str, ServiceProfile]] = None, seed: int = 1):
+        self.profiles: Dict[str, ServiceProfile] = dict(DEFAULT_PROFILES, **(profiles or {}))
+        self.calls: Dict[str, int] = {name: 0 for name in self.profiles}
+        self.errors: Dict[str, int] = {name: 0 for name in self.profiles}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _wait(self, service: str, share: float = 1.0) -> bool:
+        """Sleeps for the service's latency; returns whether this call should fail."""
+        profile: ServiceProfile = self.profiles[service]
+        with self._lock:
+            self.calls[service] += 1
+            seconds: float = profile.sample_seconds(self._rng)
+            failed: bool = self._rng.random() < profile.error_rate
+            if failed:
+                self.errors[service] += 1
+        time.sleep(seconds * share)
+        return failed
+
+    # DuckDuckGo: duckduckgo_search.DDGS
+
+    def ddgs(self) -> "_FakeDDGS":
+        return _FakeDDGS(self)
+
+    def web_hits(self, query: str, count: int) -> List[Dict[str, str]]:
+        digest: str = hashlib.blake2b(search.normalize_query(query).encode("utf-8"), digest_size=4).hexdigest()
+        return [{"title": f"Result {i} for {query[:40]}", "url": f"https://site{i % 7}.example/{digest}/{i}",
+                 "snippet": _sentence(random.Random(_seed(query, i)))} for i in range(count)]
+
+    # SerpAPI and web pages: the shared requests session
+
+    def get(self, url: str, params: Optional[Dict[str, Any]] = None, headers: Optional[Dict[str, str]] = None,
+            timeout: Optional[float] = None, stream: bool = False) -> "FakeResponse":
+        if url.startswith("https://serpapi.com/"):
+            if self._wait("serpapi"):
+                return FakeResponse(503, b"Service Unavailable", "text/plain")
+            hits: List[Dict[str, str]] = self.web_hits(params["q"], min(params["num"], self.profiles["serpapi"].size))
+            data: Dict[str, Any] = {"organic_results": [
+                {"title": hit["title"], "link": hit["url"], "snippet": hit["snippet"]} for hit in hits
+            ]}
+            return FakeResponse(200, json.dumps(data).encode("utf-8"), "application/json")
+        if self._wait("web"):
+            return FakeResponse(503, b"Service Unavailable", "text/plain")
+        return FakeResponse(200, self.page(url).encode("utf-8"), "text/html; charset=utf-8")
+
+    def page(self, url: str) -> str:
+        rng: random.Random = random.Random(_seed(url))
+        paragraphs: List[str] = []
+        length: int = 0
+        while length < self.profiles["web"].size:
+            paragraph: str = "<p>" + " ".join(_sentence(rng) for _ in range(5)) + "</p>"
+            paragraphs.append(paragraph)
+            length += len(paragraph)
+        return (f"<html><head><title>{url}</title></head><body><nav>Home | About</nav>"
+                f"<article><h1>{url}</h1>{''.join(paragraphs)}</article><footer>Footer</footer></body></html>")
+
+    # YouTube Data API v3: the client returned by clients.youtube
+
+    def youtube(self, api_key: str) -> "_FakeYouTube":
+        return _FakeYouTube(self)
+
+    # youtube-transcript-api
+
+    def get_transcript(self, video_id: str, *args: Any, **kwargs: Any) -> List[Dict[str, Any]]:
+        if self._wait("transcript"):
+            raise RuntimeError(f"Could not retrieve a transcript for the video {video_id}")
+        rng: random.Random = random.Random(_seed(video_id))
+        return [{"text": _sentence(rng, 10), "start": 5.0 * i, "duration": 5.0}
+                for i in range(self.profiles["transcript"].size)]
+
+    def list_transcripts(self, video_id: str, *args: Any, **kwargs: Any) -> List[str]:
+        failed: bool = self._wait("transcript", share=0.5)
+        return [] if failed else ["en"]
+
+    # Gemini: the model returned by clients.gemini_model
+
+    def gemini_model(self, api_key: str, model_name: str = "") -> "_FakeGemini":
+        return _FakeGemini(self)
+
+    def answer(self, prompt: str) -> str:
+        cited: List[tuple] = re.findall(r"SOURCE (\d+) \((WEB|YOUTUBE)\): (\S+)", prompt)
+        if "Extract the facts" in prompt:
+            return "\n".join(f"- {_sentence(random.Random(_seed(url)))} [{number}]" for number, _, url in cited) or "NONE"
+        rng: random.Random = random.Random(_seed(prompt[:200]))
+        sentences: List[str] = []
+        length: int = 0
+        while length < self.profiles["gemini"].size:
+            number, kind, url = rng.choice(cited) if cited else ("1", "WEB", "")
+            citation: str = f"[{number}][{rng.randint(0, 30):02d}:{rng.randint(0, 59):02d}]" if kind == "YOUTUBE" else f"[{number}]"
+            sentence: str = f"{_sentence(rng)[:-1]} {citation}."
+            sentences.append(sentence)
+            length += len(sentence) + 1
+        listed: str = "\n".join(f"{number}. {url}" for number, _, url in cited)
+        return " ".join(sentences) + f"\n\nSOURCES:\n{listed}"
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns:
+            The profile, call count and error count of every stand-in.
+        """
+        return {name: dict(asdict(profile), calls=self.calls[name], errors=self.errors[name])
+                for name, profile in sorted(self.profiles.items())}
+
+
+class FakeResponse:
+    """A streamed requests.Response with a fixed body."""
+
+    def __init__(self, status_code: int, body: bytes, content_type: str):
+        self.status_code = status_code
+        self.content = body
+        self.headers: Dict[str, str] = {"Content-Type": content_type}
+
+    def __enter__(self) -> "FakeResponse":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        pass
+
+    def iter_content(self, chunk_size: int = 1) -> Iterator[bytes]:
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            import requests
+            raise requests.HTTPError(f"{self.status_code} Server Error", response=self)
+
+
+class _FakeDDGS:
+
+    def __init__(self, stand_ins: StandIns):
+        self.stand_ins = stand_ins
+
+    def __enter__(self) -> "_FakeDDGS":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        pass
+
+    def text(self, query: str, max_results: int = 10) -> Iterator[Dict[str, str]]:
+        if self.stand_ins._wait("duckduckgo"):
+            raise RuntimeError("DuckDuckGo returned 202 Ratelimit")
+        hits: List[Dict[str, str]] = self.stand_ins.web_hits(query, min(max_results, self.stand_ins.profiles["duckduckgo"].size))
+        for hit in hits:
+            yield {"title": hit["title"], "href": hit["url"], "body": hit["snippet"]}
+
+
+class _FakeYouTubeRequest:
+
+    def __init__(self, stand_ins: StandIns, resource: str, params: Dict[str, Any]):
+        self.stand_ins = stand_ins
+        self.resource = resource
+        self.params = params
+
+    def execute(self) -> Dict[str, Any]:
+        if self.stand_ins._wait("youtube"):
+            import httplib2
+            from googleapiclient.errors import HttpError
+            raise HttpError(httplib2.Response({"status": 503}), b"backendError")
+        if self.resource == "search":
+            digest: str = hashlib.blake2b(self.params["q"].encode("utf-8"), digest_size=4).hexdigest()
+            count: int = min(self.params.get("maxResults", 5), self.stand_ins.profiles["youtube"].size)
+            return {"items": [{"id": {"kind": "youtube#video", "videoId": f"{digest}{i:03d}"},
+                               "snippet": {"title": f"Video {i} about {self.params['q'][:40]}"}} for i in range(count)]}
+        return {"items": [{"id": video_id, "contentDetails": {"caption": "true"}}
+                          for video_id in self.params["id"].split(",")]}
+
+
+class _FakeYouTubeResource:
+
+    def __init__(self, stand_ins: StandIns, name: str):
+        self.stand_ins = stand_ins
+        self.name = name
+
+    def list(self, **params: Any) -> _FakeYouTubeRequest:
+        return _FakeYouTubeRequest(self.stand_ins, self.name, params)
+
+
+class _FakeYouTube:
+
+    def __init__(self, stand_ins: StandIns):
+        self.stand_ins = stand_ins
+
+    def search(self) -> _FakeYouTubeResource:
+        return _FakeYouTubeResource(self.stand_ins, "search")
+
+    def videos(self) -> _FakeYouTubeResource:
+        return _FakeYouTubeResource(self.stand_ins, "videos")
+
+
+class _FakeGemini:
+
+    def __init__(self, stand_ins: StandIns):
+        self.stand_ins = stand_ins
+
+    def generate_content(self, contents: List[Dict[str, Any]], generation_config: Any = None, stream: bool = False) -> Any:
+        prompt: str = contents[0]["parts"][0]["text"]
+        if not stream:
+            if self.stand_ins._wait("gemini"):
+                raise RuntimeError("503 The model is overloaded. Please try again later.")
+            return SimpleNamespace(text=self.stand_ins.answer(prompt))
+        return self._stream(prompt)
+
+    def _stream(self, prompt: str) -> Iterator[SimpleNamespace]:
+        # The first chunk comes after 30% of the latency, the rest spread over the remainder
+        profile: ServiceProfile = self.stand_ins.profiles["gemini"]
+        if self.stand_ins._wait("gemini", share=0.3):
+            raise RuntimeError("503 The model is overloaded. Please try again later.")
+        text: str = self.stand_ins.answer(prompt)
+        chunks: List[str] = [text[i:i + 200] for i in range(0, len(text), 200)]
+        remainder: float = profile.sample_seconds(random.Random(_seed(prompt[:200]))) * 0.7
+        for i, chunk in enumerate(chunks):
+            if i:
+                time.sleep(remainder / max(1, len(chunks) - 1))
+            yield SimpleNamespace(text=chunk)
+
+
+@contextmanager
+def installed(stand_ins: StandIns, cache_dir: Optional[str] = None) -> Iterator[StandIns]:
+    """
+    Routes every external call of the pipeline to the stand-ins, with empty caches.
+    Args:
+        stand_ins: The stand-ins to use.
+        cache_dir: Where the content cache and transcript store live. Defaults to
+                   a temporary directory that is removed afterwards.
+    Yields:
+        The stand-ins, whose call counters fill up as the pipeline runs.
+    """
+    import duckduckgo_search
+    import youtube_transcript_api
+
+    with ExitStack() as stack:
+        if cache_dir is None:
+            cache_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix="loadtest-"))
+        session: SimpleNamespace = SimpleNamespace(get=stand_ins.get)
+        stack.enter_context(patch.dict("os.environ", {"GEMINI_API_KEY": "loadtest", "YOUTUBE_API_KEY": "loadtest",
+                                                      "SerpAPI_KEY": "loadtest"}))
+        stack.enter_context(patch("modules.http.get_session", return_value=session))
+        stack.enter_context(patch.object(duckduckgo_search, "DDGS", stand_ins.ddgs))
+        stack.enter_context(patch("modules.clients.youtube", stand_ins.youtube))
+        stack.enter_context(patch("modules.clients.gemini_model", stand_ins.gemini_model))
+        stack.enter_context(patch.object(youtube_transcript_api.YouTubeTranscriptApi, "get_transcript",
+                                         stand_ins.get_transcript))
+        stack.enter_context(patch.object(youtube_transcript_api.YouTubeTranscriptApi, "list_transcripts",
+                                         stand_ins.list_transcripts))
+        stack.enter_context(patch.object(cache, "CACHE_DIR", cache_dir))
+        stack.enter_context(patch.object(cache, "_content_cache", None))
+        stack.enter_context(patch.object(transcripts, "_transcript_store", None))
+        stack.enter_context(patch.object(search, "_search_cache", cache.MemoryCache()))
+        stack.enter_context(patch.object(llm, "_answer_cache", cache.MemoryCache(max_entries=llm.ANSWER_CACHE_MAX_ENTRIES)))
+        stack.enter_context(patch.object(breaker, "_failures", cache.MemoryCache()))
+        stack.enter_context(patch.object(breaker, "_breakers", OrderedDict()))
+        # Stand-in calls cost nothing, so no daily quota applies
+        stack.enter_context(patch.object(ratelimit, "_ledger", ratelimit.QuotaLedger({})))
+        stack.enter_context(patch.object(tracing, "TRACE_LOG_PATH", ""))
+        yield stand_ins
+
+
+def parse_profile_setting(value: str, profiles: Dict[str, ServiceProfile]) -> Dict[str, ServiceProfile]:
+    """
+    Applies one SERVICE.FIELD=VALUE setting, e.g. "gemini.median_ms=800".
+    Args:
+        value: The setting.
+        profiles: The profiles so far.
+    Returns:
+        The profiles with the setting applied.
+    Raises:
+        ValueError: If the service or field is unknown.
+    """
+    name, _, number = value.partition("=")
+    service, _, field = name.partition(".")
+    if service not in DEFAULT_PROFILES or field not in ServiceProfile.__dataclass_fields__ or not number:
+        raise ValueError(f"expected SERVICE.FIELD=VALUE with SERVICE one of {', '.join(DEFAULT_PROFILES)} "
+                         f"and FIELD one of {', '.join(ServiceProfile.__dataclass_fields__)}")
+    converted: Any = int(number) if field == "size" else float(number)
+    return dict(profiles, **{service: replace(profiles.get(service, DEFAULT_PROFILES[service]), **{field: converted})})
@@ -2,8 +2,8 @@
 import streamlit as st
 import os
 from dotenv import load_dotenv
-from modules import citations, llm, scraper, search
-from typing import List, Dict
+from modules import cache, corpus, llm, pipeline, tracing
+from typing import List
 
 
 # Load environment variables
@@ -19,6 +19,10 @@ st.set_page_config(
 # App title
 st.title("Ask the Web & YouTube")
 
+# Pages and transcripts fetched for this session's questions, reused by follow-ups
+if "corpus" not in st.session_state:
+    st.session_state.corpus = corpus.SessionCorpus()
+
 # Sidebar configuration
 with st.sidebar:
     st.header("Search Settings")
@@ -27,6 +31,13 @@ with st.sidebar:
         options=["Both", "Web Only", "YouTube Only"],
         index=0
     )
+    # Past llm.MAP_REDUCE_MIN_SOURCES sources, facts are extracted per source before answering
+    max_web_results: int = st.slider("Web pages", min_value=1, max_value=30, value=5)
+    max_youtube_results: int = st.slider("YouTube videos", min_value=1, max_value=10, value=3)
+
+    st.caption(f"{len(st.session_state.corpus)} source(s) kept from earlier questions")
+    if st.button("New topic"):
+        st.session_state.corpus.clear()
 
     st.markdown("---")
     
@@ -45,76 +56,73 @@ ask_button: bool = st.button("Ask")
 
 # Process the question when the button is clicked
 if ask_button and question:
-    # Start the search process
-    with st.spinner("Searching for information..."):
-        # Initialize results containers
-        web_results: List[Dict[str, str]] = []
-        web_sources: List[Dict[str, str]] = []
-        youtube_results: List[Dict[str, str]] = []
-        youtube_sources: List[Dict[str, str]] = []
-        
-        # Search based on selected sources
-        if search_sources in ["Both", "Web Only"]:
-            web_results = search.search_web(question, max_results=5)
-            
-            # Extract content from web pages
-            for result in web_results:
-                content: str = scraper.extract_web_content(result["url"])
-                web_sources.append({
-                    "title": result["title"],
-                    "url": result["url"],
-                    "content": content
-                })
-        
-        if search_sources in ["Both", "YouTube Only"]:
-            youtube_results = search.search_youtube(question, max_results=3)
-            
-            # Get transcripts for YouTube videos
-            for video in youtube_results:
-                transcript: str = scraper.get_video_transcript(video["id"])
-                transcript_text: str = ""
-                
-                if isinstance(transcript, list):
-                    transcript_text = scraper.format_transcript_text(transcript)
-                else:
-                    transcript_text = transcript  # Error message
-                
-                youtube_sources.append({
-                    "id": video["id"],
-                    "title": video["title"],
-                    "url": video["url"],
-                    "transcript": transcript,
-                    "transcript_text": transcript_text
-                })
-        
-        # Collect all sources for debugging
-        all_results: Dict[str, List[Dict[str, str]]] = {
-            "web_results": web_results,
-            "youtube_results": youtube_results
-        }
-        
-        answer: str = llm.generate_answer(question, web_sources, youtube_sources)
-        processed_answer, sources_section, earliest_timestamps = citations.process_citations(answer, web_sources, youtube_sources)
-
-        sources_html: str = citations.create_sources_list(web_sources, youtube_sources, earliest_timestamps)
-    
-    # Display the answer
     st.markdown("<h3>Answer</h3>", unsafe_allow_html=True)
-    st.markdown(processed_answer, unsafe_allow_html=True)
+    answer_placeholder = st.empty()
+    streamed_parts: List[str] = []
+
+    def show_chunk(html: str) -> None:
+        if html:
+            streamed_parts.append(html)
+            answer_placeholder.markdown("".join(streamed_parts), unsafe_allow_html=True)
+
+    # Search, fetch and stream the answer, linking citations one complete sentence at a time
+    result: pipeline.PipelineResult = pipeline.answer_question(
+        question,
+        include_web=search_sources in ["Both", "Web Only"],
+        include_youtube=search_sources in ["Both", "YouTube Only"],
+        max_web_results=max_web_results,
+        max_youtube_results=max_youtube_results,
+        corpus=st.session_state.corpus,
+        on_chunk=show_chunk,
+        progress=st.spinner
+    )
+
+    # Replace the streamed rendering with the fully processed answer
+    answer_placeholder.markdown(result.processed_answer, unsafe_allow_html=True)
+    if result.generation_error and result.answer != result.generation_error:
+        st.error(f"The answer is incomplete. {result.generation_error}")
     
     # Display sources
-    st.markdown(sources_html, unsafe_allow_html=True)
+    st.markdown(result.sources_html, unsafe_allow_html=True)
+    if result.dropped_sources:
+        st.caption(f"{len(result.dropped_sources)} slow source(s) were left out to answer in time.")
+    if not result.search_reports.get("corpus", {}).get("searched", True):
+        st.caption("Answered from the sources of earlier questions; click \"New topic\" to search again.")
     
     # Debug panel
     if show_debug:
         with st.expander("Debug Information"):
-            st.json(all_results)
+            st.json({"web_results": result.web_results, "youtube_results": result.youtube_results})
             
-            st.write(f"Sources as Per LLM: {sources_section}")
+            st.write(f"Sources as Per LLM: {result.sources_section}")
             
             # Show number of sources
-            st.write(f"Web sources: {len(web_sources)}")
-            st.write(f"YouTube sources: {len(youtube_sources)}")
+            st.write(f"Web sources: {len(result.web_sources)}")
+            st.write(f"YouTube sources: {len(result.youtube_sources)}")
+            
+            # Show answer latency; time to first token is what the user waits for
+            st.write(f"Time to first token: {result.timings['time_to_first_token']:.2f}s")
+            st.write(f"Total generation time: {result.timings['generation']:.2f}s")
+            
+            # Show which provider answered each search and whether it was cached
+            st.markdown("### Search Providers")
+            st.json(result.search_reports)
+            
+            # Show sources left out because they missed the deadline
+            st.markdown("### Dropped Sources")
+            st.json(result.dropped_sources)
+            
+            # Show content cache effectiveness for this process
+            st.markdown("### Content Cache")
+            st.json(cache.get_content_cache().stats())
+            st.markdown("### Answer Cache")
+            st.json(llm.answer_cache_stats())
+            
+            # Show where this question spent its time, and stage percentiles across questions
+            st.markdown("### Trace")
+            st.markdown(tracing.render_waterfall(result.trace), unsafe_allow_html=True)
+            st.markdown("### Stage Latency")
+            st.json(tracing.latency_summary())
             
             
             # Show prompt used
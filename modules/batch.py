@@ -0,0 +1,185 @@
+"""
+Answers a JSONL file of questions without the Streamlit UI, for bulk research jobs.
+
+Each input line is a JSON object with a "question", or a "title" and "body" as in
+requests.jsonl, and optionally an "id" or "request_id". Results are appended to
+the output file as each question finishes, so an interrupted run picks up where
+it stopped when started again with the same output file.
+
+Usage:
+    python -m modules.batch questions.jsonl -o answers.jsonl --concurrency 4 \\
+        --rate gemini=0.25 --rate duckduckgo=1
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+
+from modules import pipeline, ratelimit
+
+
+def read_questions(path: str) -> Iterator[Tuple[str, str]]:
+    """
+    Reads the questions of a JSONL file.
+    Args:
+        path: The input file.
+    Yields:
+        A tuple (id, question) per non-empty line. Lines without an "id" or
+        "request_id" are identified by their line number, e.g. "line-3".
+    """
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record: Dict[str, Any] = json.loads(line)
+            question: str = record.get("question") or "\n\n".join(
+                part for part in (record.get("title"), record.get("body")) if part
+            )
+            if not question:
+                raise ValueError(f"{path}:{line_number}: no question, title or body")
+            question_id: str = str(record.get("id") or record.get("request_id") or f"line-{line_number}")
+            yield question_id, question
+
+
+def completed_ids(path: str, retry_errors: bool = True) -> Set[str]:
+    """
+    Args:
+        path: An output file of an earlier run.
+        retry_errors: Whether questions that failed should be answered again.
+    Returns:
+        The IDs of the questions already answered in the file. A truncated last
+        line, e.g. from a killed run, is ignored.
+    """
+    done: Set[str] = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record: Dict[str, Any] = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("status") == "ok" or not retry_errors:
+                done.add(record["id"])
+    return done
+
+
+def answer_one(question_id: str, question: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Answers one question and converts the outcome into an output record.
+    Args:
+        question_id: The ID of the question.
+        question: The question text.
+        options: Keyword arguments for pipeline.answer_question.
+    Returns:
+        The output record, with "status" "ok" or "error".
+    """
+    try:
+        # Batch questions queue behind interactive ones and leave them part of each daily quota
+        with ratelimit.prioritized(ratelimit.BATCH):
+            result: pipeline.PipelineResult = pipeline.answer_question(question, **options)
+        record: Dict[str, Any] = result.to_dict()
+        record["status"] = "error" if result.error else "ok"
+    except Exception as e:
+        record = {"question": question, "status": "error", "error": f"{type(e).__name__}: {str(e)}"}
+    return dict(id=question_id, **record)
+
+
+def run_batch(input_path: str, output_path: str, concurrency: int = 4, retry_errors: bool = True,
+              options: Optional[Dict[str, Any]] = None) -> Dict[str, int]:
+    """
+    Answers every question of an input file that is not yet in the output file.
+    Args:
+        input_path: The JSONL question file.
+        output_path: The JSONL result file, appended to.
+        concurrency: The number of questions answered at the same time.
+        retry_errors: Whether questions that failed in an earlier run are answered again.
+        options: Keyword arguments for pipeline.answer_question.
+    Returns:
+        The number of questions "skipped" as already done, answered "ok" and "failed".
+    """
+    done: Set[str] = completed_ids(output_path, retry_errors)
+    pending: List[Tuple[str, str]] = []
+    counts: Dict[str, int] = {"skipped": 0, "ok": 0, "failed": 0}
+    for question_id, question in read_questions(input_path):
+        if question_id in done:
+            counts["skipped"] += 1
+            continue
+        done.add(question_id)  # also skips duplicate IDs within the input
+        pending.append((question_id, question))
+    if os.path.dirname(output_path):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+    with open(output_path, "a", encoding="utf-8") as output, \
+            ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="batch") as pool:
+        # Start on a new line if a killed run left a truncated record behind
+        if os.path.getsize(output_path) and not _ends_with_newline(output_path):
+            output.write("\n")
+        futures = [pool.submit(answer_one, question_id, question, options or {}) for question_id, question in pending]
+        # Only this thread writes, one whole line per record, flushed so a crash loses at most the current line
+        for future in as_completed(futures):
+            record: Dict[str, Any] = future.result()
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+            counts["ok" if record["status"] == "ok" else "failed"] += 1
+            print(f"[{record['status']}] {record['id']} "
+                  f"({counts['ok'] + counts['failed']}/{len(pending)})", file=sys.stderr)
+    return counts
+
+
+def _ends_with_newline(path: str) -> bool:
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def parse_rate(value: str) -> Tuple[str, float]:
+    provider, _, rate = value.partition("=")
+    if provider not in ratelimit.PROVIDERS or not rate:
+        raise argparse.ArgumentTypeError(
+            f"expected PROVIDER=REQUESTS_PER_SECOND with PROVIDER one of {', '.join(ratelimit.PROVIDERS)}"
+        )
+    return provider, float(rate)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file of questions")
+    parser.add_argument("-o", "--output", required=True, help="JSONL file that results are appended to")
+    parser.add_argument("--concurrency", type=int, default=4, help="Questions answered at the same time")
+    parser.add_argument("--rate", type=parse_rate, action="append", default=[], metavar="PROVIDER=RPS",
+                        help="Requests per second allowed to a backend; repeatable")
+    parser.add_argument("--sources", choices=["both", "web", "youtube"], default="both")
+    parser.add_argument("--max-web-results", type=int, default=5)
+    parser.add_argument("--max-youtube-results", type=int, default=3)
+    parser.add_argument("--deadline", type=float, default=None,
+                        help="Seconds each question may spend searching and fetching before slow sources are dropped")
+    parser.add_argument("--no-retry-errors", action="store_true",
+                        help="Skip questions that failed in an earlier run instead of answering them again")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    ratelimit.configure(dict(args.rate))
+    counts: Dict[str, int] = run_batch(
+        args.input,
+        args.output,
+        concurrency=args.concurrency,
+        retry_errors=not args.no_retry_errors,
+        options={
+            "include_web": args.sources in ("both", "web"),
+            "include_youtube": args.sources in ("both", "youtube"),
+            "max_web_results": args.max_web_results,
+            "max_youtube_results": args.max_youtube_results,
+            "deadline": args.deadline,
+        },
+    )
+    print(f"{counts['ok']} answered, {counts['failed']} failed, {counts['skipped']} already done", file=sys.stderr)
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
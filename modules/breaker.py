@@ -0,0 +1,240 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Optional
+from urllib.parse import urlsplit
+
+from modules.cache import CachedValue, MemoryCache
+
+
+# How long a failed page or video is skipped before it is tried again
+PAGE_FAILURE_TTL_SECONDS: float = float(os.getenv("PAGE_FAILURE_TTL_SECONDS", "600"))
+TRANSCRIPT_FAILURE_TTL_SECONDS: float = float(os.getenv("TRANSCRIPT_FAILURE_TTL_SECONDS", "1800"))
+# Consecutive failures after which a domain's breaker opens
+BREAKER_FAILURE_THRESHOLD: int = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "3"))
+# Seconds an open breaker rejects calls before letting one probe through; doubles
+# after each failed probe up to BREAKER_MAX_COOLDOWN_SECONDS
+BREAKER_COOLDOWN_SECONDS: float = float(os.getenv("BREAKER_COOLDOWN_SECONDS", "30"))
+BREAKER_MAX_COOLDOWN_SECONDS: float = float(os.getenv("BREAKER_MAX_COOLDOWN_SECONDS", "600"))
+# Breakers kept, least recently used dropped first. Only breakers with failures are
+# kept at all: a domain without a breaker is closed
+BREAKER_MAX_ENTRIES: int = int(os.getenv("BREAKER_MAX_ENTRIES", "4096"))
+
+# Breaker of the transcript service as a whole, e.g. when YouTube blocks this host
+TRANSCRIPTS: str = "youtube transcripts"
+
+CLOSED: str = "closed"
+OPEN: str = "open"
+HALF_OPEN: str = "half-open"
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a failing backend after consecutive failures. Once a cooldown
+    has passed, a single probe call is let through (half-open): its success
+    closes the breaker, its failure opens it again for twice as long.
+    Args:
+        failure_threshold: Consecutive failures that open the breaker.
+        cooldown: Seconds the breaker stays open after it first opens.
+        max_cooldown: The longest cooldown after repeated failed probes.
+        clock: Returns the current time in seconds. Replaceable in tests.
+    """
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, cooldown: float = BREAKER_COOLDOWN_SECONDS,
+                 max_cooldown: float = BREAKER_MAX_COOLDOWN_SECONDS, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.clock = clock
+        self.failures: int = 0
+        self.opened_at: Optional[float] = None
+        self.current_cooldown: float = cooldown
+        self.probing: bool = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self.opened_at is None:
+            return CLOSED
+        if self.probing or self.clock() < self.opened_at + self.current_cooldown:
+            return OPEN
+        return HALF_OPEN
+
+    def is_open(self) -> bool:
+        """Whether a call would be rejected now; unlike allow(), this does not take the probe."""
+        return self.state == OPEN
+
+    def allow(self) -> bool:
+        """
+        Returns:
+            Whether a call may go ahead. In the half-open state only the first caller
+            is allowed, as the probe; the others are rejected until it finishes.
+        """
+        with self._lock:
+            state: str = self._state()
+            if state == HALF_OPEN:
+                self.probing = True
+                return True
+            return state == CLOSED
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.current_cooldown = self.cooldown
+            self.probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.probing:
+                self.current_cooldown = min(self.max_cooldown, self.current_cooldown * 2)
+                self.probing = False
+                self.opened_at = self.clock()
+            elif self.opened_at is None and self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+
+
+_failures: MemoryCache = MemoryCache(max_entries=int(os.getenv("NEGATIVE_CACHE_MAX_ENTRIES", "4096")))
+_breakers: "OrderedDict[str, CircuitBreaker]" = OrderedDict()
+_breakers_lock = threading.Lock()
+
+
+def domain_of(url: str) -> str:
+    """
+    Args:
+        url: A page URL.
+    Returns:
+        Its host name in lower case without a leading "www.", the unit of a breaker.
+    """
+    host: str = (urlsplit(url).hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """
+    Args:
+        name: A domain, or TRANSCRIPTS.
+    Returns:
+        The process-wide breaker of that name, created if there is none. Checks
+        (skip_reason, admit) do not create breakers and a success drops one, so
+        only breakers with failures are kept, at most BREAKER_MAX_ENTRIES of them.
+    """
+    with _breakers_lock:
+        circuit: Optional[CircuitBreaker] = _breakers.get(name)
+        if circuit is None:
+            circuit = _breakers[name] = CircuitBreaker()
+            while len(_breakers) > BREAKER_MAX_ENTRIES:
+                _breakers.popitem(last=False)
+        _breakers.move_to_end(name)
+        return circuit
+
+
+def _find(name: str) -> Optional[CircuitBreaker]:
+    with _breakers_lock:
+        circuit: Optional[CircuitBreaker] = _breakers.get(name)
+        if circuit is not None:
+            _breakers.move_to_end(name)
+        return circuit
+
+
+def _breaker_succeeded(name: str) -> None:
+    # A closed breaker without failures is the same as none
+    with _breakers_lock:
+        circuit: Optional[CircuitBreaker] = _breakers.pop(name, None)
+    if circuit is not None:
+        circuit.record_success()
+
+
+def recent_failure(key: Hashable) -> Optional[str]:
+    """
+    Args:
+        key: A failed call, e.g. ("page", url) or ("transcript", video_id).
+    Returns:
+        The error of its last failure if that is within its TTL, otherwise None.
+    """
+    cached: Optional[CachedValue] = _failures.get(key)
+    return cached.value if cached is not None and cached.fresh else None
+
+
+def record_failure(key: Hashable, error: str, ttl: float, breaker: Optional[str] = None,
+                   backend_failed: bool = True) -> None:
+    """
+    Remembers a failed call so that it is skipped for ttl seconds.
+    Args:
+        key: The failed call, see recent_failure.
+        error: The error message.
+        ttl: Seconds the failure is remembered.
+        breaker: The breaker the call went through, if any.
+        backend_failed: Whether the backend failed (e.g. a timeout, a 5xx or a block)
+                        rather than only this page or video (e.g. a 404 or disabled
+                        captions). Only backend failures count against the breaker;
+                        the others show that the backend is up.
+    """
+    _failures.put(key, error, ttl=ttl)
+    if breaker is not None:
+        if backend_failed:
+            get_breaker(breaker).record_failure()
+        else:
+            _breaker_succeeded(breaker)
+
+
+def record_success(key: Hashable, breaker: Optional[str] = None) -> None:
+    """Forgets a remembered failure and closes the breaker, if any."""
+    if recent_failure(key) is not None:
+        _failures.put(key, None, ttl=0)
+    if breaker is not None:
+        _breaker_succeeded(breaker)
+
+
+def skip_reason(key: Hashable, breaker: Optional[str] = None) -> Optional[str]:
+    """
+    Args:
+        key: A call, see recent_failure.
+        breaker: The breaker the call goes through, if any.
+    Returns:
+        Why the call should not be made now, or None if it may be.
+    """
+    error: Optional[str] = recent_failure(key)
+    if error is not None:
+        return f"failed recently: {error}"
+    circuit: Optional[CircuitBreaker] = _find(breaker) if breaker is not None else None
+    if circuit is not None and circuit.is_open():
+        return f"{breaker} is failing; circuit open"
+    return None
+
+
+def admit(key: Hashable, breaker: Optional[str] = None) -> Optional[str]:
+    """
+    Like skip_reason, but for the call about to be made: in the half-open state,
+    the first caller is admitted as the breaker's probe.
+    Returns:
+        Why the call must not be made, or None if it may be.
+    """
+    error: Optional[str] = recent_failure(key)
+    if error is not None:
+        return f"failed recently: {error}"
+    circuit: Optional[CircuitBreaker] = _find(breaker) if breaker is not None else None
+    if circuit is not None and not circuit.allow():
+        return f"{breaker} is failing; circuit open"
+    return None
+
+
+def stats() -> Dict[str, List[str]]:
+    """
+    Returns:
+        The names of the breakers that are "open" or "half-open".
+    """
+    with _breakers_lock:
+        breakers: Dict[str, CircuitBreaker] = dict(_breakers)
+    states: Dict[str, List[str]] = {OPEN: [], HALF_OPEN: []}
+    for name, circuit in sorted(breakers.items()):
+        state: str = circuit.state
+        if state != CLOSED:
+            states[state].append(name)
+    return states
@@ -0,0 +1,281 @@
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from dataclasses import dataclass
+from collections import OrderedDict
+from typing import Any, Callable, ContextManager, Dict, Hashable, Iterator, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+
+CACHE_DIR: str = os.getenv("CACHE_DIR", ".cache")
+CONTENT_CACHE_TTL_SECONDS: float = float(os.getenv("CONTENT_CACHE_TTL_SECONDS", str(24 * 3600)))
+CONTENT_CACHE_MAX_ENTRIES: int = int(os.getenv("CONTENT_CACHE_MAX_ENTRIES", "2000"))
+# Version of the stored text; bump it whenever extraction changes what is stored
+# (e.g. scraper.MAX_CONTENT_CHARS), so that text stored by older code is discarded.
+# 1: pages truncated to 100000 characters instead of 32000
+CONTENT_CACHE_VERSION: int = 1
+
+# Query parameters that only track the visitor and never change the page
+_TRACKING_PARAMS = ("utm_", "fbclid", "gclid", "mc_cid", "mc_eid", "ref_src")
+
+
+def normalize_url(url: str) -> str:
+    """
+    Normalizes a URL so that trivially different spellings share a cache entry.
+    Lowercases the scheme and host, drops default ports, fragments and tracking
+    parameters, sorts the query string and strips a trailing slash.
+    Args:
+        url: The URL to normalize.
+    Returns:
+        The normalized URL.
+    """
+    parts = urlsplit(url.strip())
+    scheme: str = parts.scheme.lower()
+    netloc: str = parts.netloc.lower()
+    if (scheme == "http" and netloc.endswith(":80")) or (scheme == "https" and netloc.endswith(":443")):
+        netloc = netloc.rsplit(":", 1)[0]
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith(_TRACKING_PARAMS)
+    )
+    path: str = parts.path.rstrip("/") or "/"
+    return urlunsplit((scheme, netloc, path, urlencode(query), ""))
+
+
+@contextmanager
+def connect(path: str) -> Iterator[sqlite3.Connection]:
+    """
+    Opens a short-lived SQLite connection that commits on success and is always closed.
+    One connection per operation keeps the on-disk stores usable from any thread.
+    Args:
+        path: The SQLite file.
+    Yields:
+        The open connection.
+    """
+    conn: sqlite3.Connection = sqlite3.connect(path, timeout=10)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+@dataclass
+class CachedContent:
+    """An entry of the content cache."""
+    text: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fresh: bool
+
+
+class ContentCache:
+    """
+    An on-disk cache of extracted page text, keyed by normalized URL.
+    Text is stored zlib-compressed in SQLite. Entries expire after a TTL, after
+    which they can be revalidated with their ETag/Last-Modified validators, and
+    the least recently used entries are evicted beyond max_entries.
+    Args:
+        path: The SQLite file to store the cache in.
+        ttl: Seconds an entry stays fresh unless put() is given another TTL.
+        max_entries: The number of entries kept before LRU eviction.
+        clock: Returns the current time in seconds. Replaceable in tests.
+        version: The version of the stored text. Entries stored under another
+                 version are deleted when the cache is opened.
+    """
+
+    def __init__(self, path: str, ttl: float = CONTENT_CACHE_TTL_SECONDS,
+                 max_entries: int = CONTENT_CACHE_MAX_ENTRIES, clock: Callable[[], float] = time.time,
+                 version: int = CONTENT_CACHE_VERSION):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._stats: Dict[str, int] = {"hits": 0, "misses": 0, "stale": 0, "revalidated": 0, "evictions": 0}
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS content ("
+                " key TEXT PRIMARY KEY, body BLOB NOT NULL, etag TEXT, last_modified TEXT,"
+                " expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS content_accessed ON content (accessed_at)")
+            if conn.execute("PRAGMA user_version").fetchone()[0] != version:
+                conn.execute("DELETE FROM content")
+                conn.execute(f"PRAGMA user_version = {int(version)}")
+
+    def _connect(self) -> ContextManager[sqlite3.Connection]:
+        return connect(self.path)
+
+    def _count(self, stat: str, n: int = 1) -> None:
+        with self._lock:
+            self._stats[stat] += n
+
+    def get(self, url: str) -> Optional[CachedContent]:
+        """
+        Looks up the cached text of a URL and marks it as recently used.
+        Args:
+            url: The URL of the page.
+        Returns:
+            The cached entry, with fresh=False if its TTL has passed, or None on a miss.
+        """
+        key: str = normalize_url(url)
+        now: float = self.clock()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT body, etag, last_modified, expires_at FROM content WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self._count("misses")
+                return None
+            conn.execute("UPDATE content SET accessed_at = ? WHERE key = ?", (now, key))
+        body, etag, last_modified, expires_at = row
+        fresh: bool = now < expires_at
+        self._count("hits" if fresh else "stale")
+        return CachedContent(zlib.decompress(body).decode("utf-8"), etag, last_modified, fresh)
+
+    def put(self, url: str, text: str, etag: Optional[str] = None, last_modified: Optional[str] = None,
+            ttl: Optional[float] = None) -> None:
+        """
+        Stores the extracted text of a URL and evicts least recently used entries
+        beyond max_entries.
+        Args:
+            url: The URL of the page.
+            text: The extracted text.
+            etag: The ETag response header, if any.
+            last_modified: The Last-Modified response header, if any.
+            ttl: Seconds the entry stays fresh. Defaults to the cache TTL.
+        """
+        now: float = self.clock()
+        expires_at: float = now + (self.ttl if ttl is None else ttl)
+        body: bytes = zlib.compress(text.encode("utf-8"))
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO content (key, body, etag, last_modified, expires_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (normalize_url(url), body, etag, last_modified, expires_at, now)
+            )
+            evicted: int = conn.execute(
+                "DELETE FROM content WHERE key IN ("
+                " SELECT key FROM content ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            ).rowcount
+        if evicted > 0:
+            self._count("evictions", evicted)
+
+    def refresh(self, url: str, ttl: Optional[float] = None) -> None:
+        """
+        Marks a stale entry fresh again after the server confirmed it is unchanged
+        (HTTP 304).
+        Args:
+            url: The URL of the page.
+            ttl: Seconds the entry stays fresh. Defaults to the cache TTL.
+        """
+        now: float = self.clock()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE content SET expires_at = ?, accessed_at = ? WHERE key = ?",
+                (now + (self.ttl if ttl is None else ttl), now, normalize_url(url))
+            )
+        self._count("revalidated")
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns:
+            The hit, miss, stale, revalidation and eviction counters of this
+            process, and the number of stored entries.
+        """
+        with self._connect() as conn:
+            entries: int = conn.execute("SELECT COUNT(*) FROM content").fetchone()[0]
+        with self._lock:
+            return dict(self._stats, entries=entries)
+
+
+@dataclass
+class CachedValue:
+    """An entry of a MemoryCache."""
+    value: Any
+    fresh: bool
+
+
+class MemoryCache:
+    """
+    A thread-safe in-memory LRU cache with optional per-entry TTLs.
+    Expired entries are still returned (with fresh=False) until they are
+    overwritten or evicted, so callers can serve them while refreshing.
+    Args:
+        max_entries: The number of entries kept before LRU eviction.
+        clock: Returns the current time in seconds. Replaceable in tests.
+    """
+
+    def __init__(self, max_entries: int = 1024, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, int] = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0}
+
+    def get(self, key: Hashable) -> Optional[CachedValue]:
+        """
+        Looks up a key and marks it as recently used.
+        Args:
+            key: The cache key.
+        Returns:
+            The cached value, with fresh=False if its TTL has passed, or None on a miss.
+        """
+        with self._lock:
+            entry: Optional[Tuple[Any, float]] = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            value, expires_at = entry
+            fresh: bool = self.clock() < expires_at
+            self._stats["hits" if fresh else "stale"] += 1
+            return CachedValue(value, fresh)
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        Stores a value and evicts least recently used entries beyond max_entries.
+        Args:
+            key: The cache key.
+            value: The value to store.
+            ttl: Seconds the entry stays fresh. None means it never goes stale.
+        """
+        expires_at: float = float("inf") if ttl is None else self.clock() + ttl
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns:
+            The hit, miss, stale and eviction counters and the number of entries.
+        """
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries))
+
+
+_content_cache: Optional[ContentCache] = None
+_content_cache_lock = threading.Lock()
+
+
+def get_content_cache() -> ContentCache:
+    """
+    Returns:
+        The process-wide content cache stored under CACHE_DIR.
+    """
+    global _content_cache
+    with _content_cache_lock:
+        if _content_cache is None:
+            _content_cache = ContentCache(os.path.join(CACHE_DIR, "content.sqlite3"))
+        return _content_cache
@@ -1,4 +1,5 @@
 import re
+from modules.transcripts import Transcript, format_timestamp
 from typing import List, Dict, Tuple, Optional, Union
 
 def process_citations(answer_text: str, web_sources: List[Dict[str, str]], youtube_sources: List[Dict[str, str]]) -> Tuple[str, str, Dict[int, Dict[str, Union[str, int]]]]:
@@ -23,12 +24,30 @@ def process_citations(answer_text: str, web_sources: List[Dict[str, str]], youtu
         main_answer: str = answer_text
         sources_section:str = ""
 
-    # Find all citations in the main answer [n] or [n][timestamp]
-    citation_pattern:re.Pattern[str] = r'\[(\d+)(?:\]\[([0-9:]+))?\]'
-
     # Create a map of the earliest timestamp for each YouTube source
     earliest_timestamps: Dict[int, Dict[str, Union[str, int]]] = {}
 
+    processed_answer: str = link_citations(main_answer, web_sources, youtube_sources, earliest_timestamps)
+    return processed_answer, sources_section, earliest_timestamps
+
+
+def link_citations(text: str, web_sources: List[Dict[str, str]], youtube_sources: List[Dict[str, str]],
+                   earliest_timestamps: Dict[int, Dict[str, Union[str, int]]]) -> str:
+    """
+    Makes the citations in a piece of answer text clickable links.
+
+    Args:
+        text: Answer text containing citations, without the sources section.
+        web_sources: A list of dictionaries containing information about the web sources.
+        youtube_sources: A list of dictionaries containing information about the YouTube sources.
+        earliest_timestamps: Updated in place with the earliest cited timestamp of each YouTube source.
+
+    Returns:
+        The text with each citation wrapped in an HTML link.
+    """
+    # Find all citations in the main answer [n] or [n][timestamp]
+    citation_pattern:re.Pattern[str] = r'\[(\d+)(?:\]\[([0-9:]+))?\]'
+
     def replace_citation(match: re.Match[str]) -> str:
         """
         Replaces a citation in the answer text with a clickable HTML link.
@@ -51,6 +70,7 @@ def process_citations(answer_text: str, web_sources: List[Dict[str, str]], youtu
         else:
             # YouTube source
             youtube_index: int = source_num - len(web_sources) - 1
+            link_text = match.group(0)
             if youtube_index < len(youtube_sources):
                 is_youtube = True
                 video_id: str = youtube_sources[youtube_index]["id"]
@@ -63,6 +83,14 @@ def process_citations(answer_text: str, web_sources: List[Dict[str, str]], youtu
                     if len(time_parts) == 2:
                         minutes, seconds = int(time_parts[0]), int(time_parts[1])
                         total_seconds = minutes * 60 + seconds
+
+                        # Snap to the nearest real segment boundary when the transcript is known
+                        transcript: Optional[Transcript] = youtube_sources[youtube_index].get("transcript")
+                        if isinstance(transcript, Transcript) and len(transcript):
+                            total_seconds = transcript.snap(total_seconds)
+                            timestamp = format_timestamp(total_seconds)
+                            link_text = f"[{source_num}][{timestamp}]"
+
                         url += f"&t={total_seconds}s"
                     
                         # Store the earliest timestamp for this source
@@ -71,13 +99,75 @@ def process_citations(answer_text: str, web_sources: List[Dict[str, str]], youtu
                                 "timestamp": timestamp,
                                 "seconds": total_seconds
                             }
-                
-            link_text = match.group(0)
     
         return f'<a href="{url}" target="_blank">{link_text}</a>'
     
-    processed_answer: str = re.sub(citation_pattern, replace_citation, main_answer)
-    return processed_answer, sources_section, earliest_timestamps
+    return re.sub(citation_pattern, replace_citation, text)
+
+
+class CitationStream:
+    """
+    Links citations in an answer while it is being streamed.
+    Text is released one complete sentence at a time, so a citation is never
+    split across chunks, and everything from the "SOURCES:" trailer on is held
+    back as the sources section.
+
+    Args:
+        web_sources: A list of dictionaries containing information about the web sources.
+        youtube_sources: A list of dictionaries containing information about the YouTube sources.
+    """
+
+    # A sentence ends at a newline, or at whitespace after closing punctuation or a citation
+    _boundary: re.Pattern[str] = re.compile(r'\n|(?<=[.!?\]])\s+')
+
+    def __init__(self, web_sources: List[Dict[str, str]], youtube_sources: List[Dict[str, str]]):
+        self.web_sources = web_sources
+        self.youtube_sources = youtube_sources
+        self.earliest_timestamps: Dict[int, Dict[str, Union[str, int]]] = {}
+        self.text: str = ""
+        self.in_sources: bool = False
+        self._released: int = 0
+
+    def feed(self, chunk: str) -> str:
+        """
+        Adds a streamed chunk of answer text.
+        Args:
+            chunk: The next piece of the answer.
+        Returns:
+            The newly completed part of the main answer with clickable citations,
+            or an empty string if no sentence was completed.
+        """
+        self.text += chunk
+        if self.in_sources:
+            return ""
+        pending: str = self.text[self._released:]
+        trailer: int = pending.find("SOURCES:")
+        if trailer >= 0:
+            self.in_sources = True
+            return self._release(trailer)
+        boundaries: List[re.Match[str]] = list(self._boundary.finditer(pending))
+        return self._release(boundaries[-1].end()) if boundaries else ""
+
+    def flush(self) -> str:
+        """
+        Releases whatever is left of the main answer once the stream has ended.
+        Returns:
+            The remaining main answer text with clickable citations.
+        """
+        if self.in_sources:
+            return ""
+        return self._release(len(self.text) - self._released)
+
+    @property
+    def sources_section(self) -> str:
+        """The sources section streamed so far, starting with "SOURCES:"."""
+        trailer: int = self.text.find("SOURCES:")
+        return self.text[trailer:] if trailer >= 0 else ""
+
+    def _release(self, length: int) -> str:
+        piece: str = self.text[self._released:self._released + length]
+        self._released += length
+        return link_citations(piece, self.web_sources, self.youtube_sources, self.earliest_timestamps)
 
 
 def create_sources_list(web_sources: List[Dict[str, str]], youtube_sources: List[Dict[str, str]], earliest_timestamps: Dict[int, Dict[str, Union[str, int]]]) -> str:
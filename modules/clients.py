@@ -0,0 +1,91 @@
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+GEMINI_MODEL_NAME: str = "gemini-1.5-flash-latest"
+
+_clients: Dict[Tuple[Hashable, ...], Any] = {}
+_clients_lock = threading.Lock()
+# The key genai is configured with; the SDK holds one key per process
+_gemini_key: Optional[str] = None
+# YouTube clients sit on httplib2, which is not thread-safe, so each thread keeps its own
+_thread_clients = threading.local()
+
+
+def get_client(key: Tuple[Hashable, ...], create: Callable[[], Any]) -> Any:
+    """
+    Returns the process-wide client stored under key, creating it on first use.
+    Clients are shared by every session and question, and the lock ensures each
+    one is created only once.
+    Args:
+        key: Identifies the client, including any credentials it was created with.
+        create: Creates the client; heavy imports belong inside it.
+    Returns:
+        The client.
+    """
+    client: Any = _clients.get(key)
+    if client is not None:
+        return client
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = create()
+        return _clients[key]
+
+
+def youtube(api_key: str) -> Any:
+    """
+    Returns a YouTube Data API v3 client for the calling thread. Building the
+    client parses the discovery document and opens a new connection, so each
+    thread builds it once and reuses it for later searches.
+    Args:
+        api_key: The YouTube API key.
+    Returns:
+        The client.
+    """
+    clients: Dict[str, Any] = getattr(_thread_clients, "youtube", None)
+    if clients is None:
+        clients = _thread_clients.youtube = {}
+    if api_key not in clients:
+        from googleapiclient.discovery import build
+        clients[api_key] = build('youtube', 'v3', developerKey=api_key, cache_discovery=False)
+    return clients[api_key]
+
+
+def gemini_model(api_key: str, model_name: str = GEMINI_MODEL_NAME) -> Any:
+    """
+    Returns the shared Gemini model. genai.configure sets the key for the whole
+    process, so one key is used at a time: a call with another key configures the
+    SDK again and replaces the shared models, and calls already in flight with the
+    old models continue with the new key.
+    Args:
+        api_key: The Gemini API key.
+        model_name: The Gemini model to use.
+    Returns:
+        The genai.GenerativeModel.
+    """
+    global _gemini_key
+    if api_key != _gemini_key:
+        import google.generativeai as genai
+        with _clients_lock:
+            if api_key != _gemini_key:
+                genai.configure(api_key=api_key)
+                _gemini_key = api_key
+                for key in [key for key in _clients if key[0] == "gemini"]:
+                    del _clients[key]
+
+    def create() -> Any:
+        import google.generativeai as genai
+        return genai.GenerativeModel(model_name)
+    return get_client(("gemini", model_name), create)
+
+
+def reset() -> None:
+    """
+    Drops all clients, e.g. after API keys change. Threads that already built a
+    YouTube client keep it until they exit.
+    """
+    global _gemini_key
+    with _clients_lock:
+        _clients.clear()
+        _gemini_key = None
+    _thread_clients.__dict__.clear()
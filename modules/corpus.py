@@ -0,0 +1,176 @@
+import math
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from modules import retrieval
+from modules.cache import normalize_url
+from modules.transcripts import Transcript
+
+
+# Share of a question's terms one stored passage must contain to answer it without searching
+CORPUS_COVERAGE: float = float(os.getenv("CORPUS_COVERAGE", "0.8"))
+# Share of a question's terms a stored source's best passage must contain for it to be reused
+CORPUS_SOURCE_COVERAGE: float = float(os.getenv("CORPUS_SOURCE_COVERAGE", "0.5"))
+# Sources kept per session; the oldest are forgotten first
+CORPUS_MAX_SOURCES: int = int(os.getenv("CORPUS_MAX_SOURCES", "60"))
+
+
+@dataclass
+class Lookup:
+    """
+    What a corpus holds for one question.
+    web_sources and youtube_sources are the stored sources relevant to it, best
+    first; coverage is the largest share of the question's terms found in one
+    passage of them. Terms spread over unrelated sources do not add up.
+    """
+    web_sources: List[Dict[str, Any]]
+    youtube_sources: List[Dict[str, Any]]
+    coverage: float
+
+    @property
+    def covered(self) -> bool:
+        """Whether the question can be answered from the corpus alone."""
+        return self.coverage >= CORPUS_COVERAGE and bool(self.web_sources or self.youtube_sources)
+
+
+class SessionCorpus:
+    """
+    The pages and transcripts fetched for one user's earlier questions, so that a
+    follow-up on the same topic can be answered without searching and fetching
+    again. Sources are split into passages once, when they are added, and the
+    passages are kept in a BM25 inverted index that grows with each source.
+    Args:
+        max_sources: The number of sources kept; the oldest are forgotten first.
+    """
+
+    def __init__(self, max_sources: Optional[int] = None):
+        self.max_sources: int = CORPUS_MAX_SOURCES if max_sources is None else max_sources
+        # Sources by normalized URL, oldest first, with their type
+        self.sources: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+        self._chunk_sources: List[str] = []
+        self._chunk_lengths: List[int] = []
+        self._total_length: int = 0
+        self._forgotten: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self.sources)
+
+    def add(self, kind: str, source: Dict[str, Any]) -> bool:
+        """
+        Stores a fetched source and indexes its passages.
+        Args:
+            kind: "web" or "youtube".
+            source: A source as returned by gather.gather_sources.
+        Returns:
+            Whether the source was new to the corpus.
+        """
+        key: str = normalize_url(source["url"])
+        if key in self.sources:
+            return False
+        if key in self._forgotten:  # its old passages are still in the index
+            self._compact()
+        self.sources[key] = (kind, source)
+        for passage in self._passages(kind, source):
+            chunk: int = len(self._chunk_sources)
+            counts: Dict[str, int] = {}
+            tokens: List[str] = retrieval.tokenize(passage)
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for term, count in counts.items():
+                self._postings.setdefault(term, []).append((chunk, count))
+            self._chunk_sources.append(key)
+            self._chunk_lengths.append(len(tokens))
+            self._total_length += len(tokens)
+        if len(self.sources) > self.max_sources:
+            self._forget(next(iter(self.sources)))
+        return True
+
+    def add_gathered(self, gathered: Dict[str, Any]) -> int:
+        """
+        Stores every source of a gather.gather_sources result.
+        Returns:
+            The number of sources that were new to the corpus.
+        """
+        added: int = sum(self.add("web", source) for source in gathered["web_sources"])
+        return added + sum(self.add("youtube", source) for source in gathered["youtube_sources"])
+
+    def clear(self) -> None:
+        self.__init__(self.max_sources)
+
+    def lookup(self, question: str, include_web: bool = True, include_youtube: bool = True,
+               max_web_results: int = 5, max_youtube_results: int = 3) -> Lookup:
+        """
+        Finds the stored sources relevant to a question.
+        Args:
+            question: The question to answer.
+            include_web: Whether web sources may be used.
+            include_youtube: Whether YouTube sources may be used.
+            max_web_results: The most web sources returned.
+            max_youtube_results: The most YouTube sources returned.
+        Returns:
+            The Lookup: the sources whose best passage contains CORPUS_SOURCE_COVERAGE
+            of the question's terms, best first by BM25, and the largest share of the
+            terms that one passage of them contains.
+        """
+        terms: Set[str] = set(retrieval.tokenize(question))
+        if not terms or not self._chunk_sources:
+            return Lookup([], [], 0.0)
+        kinds: Set[str] = {kind for kind, included in (("web", include_web), ("youtube", include_youtube)) if included}
+        chunk_terms: Dict[int, Set[str]] = {}
+        for term in terms:
+            for chunk, _ in self._postings.get(term, []):
+                chunk_terms.setdefault(chunk, set()).add(term)
+        scores: Dict[str, float] = {}
+        shares: Dict[str, float] = {}
+        for chunk, score in self._score(terms).items():
+            key: str = self._chunk_sources[chunk]
+            if self.sources[key][0] not in kinds:
+                continue
+            scores[key] = max(scores.get(key, 0.0), score)
+            shares[key] = max(shares.get(key, 0.0), len(chunk_terms[chunk]) / len(terms))
+        ranked: List[str] = sorted((key for key in scores if shares[key] >= CORPUS_SOURCE_COVERAGE),
+                                   key=lambda key: -scores[key])
+        web_sources: List[Dict[str, Any]] = [self.sources[key][1] for key in ranked if self.sources[key][0] == "web"]
+        youtube_sources: List[Dict[str, Any]] = [self.sources[key][1] for key in ranked
+                                                 if self.sources[key][0] == "youtube"]
+        return Lookup(
+            web_sources[:max_web_results],
+            youtube_sources[:max_youtube_results],
+            max(shares.values(), default=0.0),
+        )
+
+    @staticmethod
+    def _passages(kind: str, source: Dict[str, Any]) -> List[str]:
+        if kind == "youtube" and isinstance(source.get("transcript"), Transcript):
+            return retrieval.chunk_transcript(source["transcript"])
+        return retrieval.chunk_text(str(source.get("content", source.get("transcript_text", ""))))
+
+    def _score(self, terms: Set[str], k1: float = 1.5, b: float = 0.75) -> Dict[int, float]:
+        """BM25 scores of the live passages that contain any of the terms, as in retrieval.BM25Index."""
+        live: int = sum(1 for key in self._chunk_sources if key not in self._forgotten)
+        average_length: float = max(1.0, self._total_length / max(1, live))
+        scores: Dict[int, float] = {}
+        for term in terms:
+            postings: List[Tuple[int, int]] = [(chunk, count) for chunk, count in self._postings.get(term, [])
+                                               if self._chunk_sources[chunk] not in self._forgotten]
+            idf: float = math.log1p((live - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk, count in postings:
+                norm: float = k1 * (1 - b + b * self._chunk_lengths[chunk] / average_length)
+                scores[chunk] = scores.get(chunk, 0.0) + idf * count * (k1 + 1) / (count + norm)
+        return scores
+
+    def _forget(self, key: str) -> None:
+        """Drops a source; its passages stay in the index, unscored, until the index is compacted."""
+        del self.sources[key]
+        self._forgotten.add(key)
+        if len(self._forgotten) * 2 > len(self.sources):
+            self._compact()
+
+    def _compact(self) -> None:
+        sources: List[Tuple[str, Dict[str, Any]]] = list(self.sources.values())
+        max_sources: int = self.max_sources
+        self.__init__(max_sources)
+        for kind, source in sources:
+            self.add(kind, source)
@@ -0,0 +1,81 @@
+import hashlib
+import heapq
+import os
+import re
+from typing import FrozenSet, List, Optional, Tuple
+
+
+# Words per shingle; five-word runs rarely repeat between unrelated texts
+SHINGLE_WORDS: int = 5
+# Hashes kept per fingerprint (bottom-k MinHash); the similarity error is about 1/sqrt(k)
+SKETCH_SIZE: int = 128
+# Texts with fewer shingles are too short to judge and are never collapsed
+MIN_SHINGLES: int = 20
+# Estimated Jaccard similarity of the shingles above which two sources are one source
+DUPLICATE_SIMILARITY: float = float(os.getenv("DUPLICATE_SIMILARITY", "0.7"))
+
+_WORD_PATTERN: re.Pattern[str] = re.compile(r"\w+")
+# Re-uploads are often trimmed or padded, which shifts every timestamp
+_TIMESTAMP_PATTERN: re.Pattern[str] = re.compile(r"\[\d{1,2}:\d{2}(?::\d{2})?\]")
+
+
+def fingerprint(text: str) -> Optional[FrozenSet[int]]:
+    """
+    Computes the MinHash sketch of a text: the smallest hashes of its word shingles.
+    Args:
+        text: Extracted page content or formatted transcript text.
+    Returns:
+        The sketch, or None if the text has fewer than MIN_SHINGLES shingles.
+    """
+    words: List[str] = _WORD_PATTERN.findall(_TIMESTAMP_PATTERN.sub(" ", text).casefold())
+    if len(words) - SHINGLE_WORDS + 1 < MIN_SHINGLES:
+        return None
+    hashes = {
+        int.from_bytes(hashlib.blake2b(" ".join(words[i:i + SHINGLE_WORDS]).encode("utf-8"), digest_size=8).digest(), "big")
+        for i in range(len(words) - SHINGLE_WORDS + 1)
+    }
+    return frozenset(heapq.nsmallest(SKETCH_SIZE, hashes))
+
+
+def similarity(first: FrozenSet[int], second: FrozenSet[int]) -> float:
+    """
+    Estimates the Jaccard similarity of the shingles behind two sketches.
+    Args:
+        first: A sketch from fingerprint.
+        second: Another sketch from fingerprint.
+    Returns:
+        The share of the smallest hashes of the union that both texts contain.
+    """
+    union: List[int] = heapq.nsmallest(SKETCH_SIZE, first | second)
+    return sum(1 for value in union if value in first and value in second) / len(union)
+
+
+class NearDuplicateIndex:
+    """
+    Remembers the sources kept so far and recognizes near-duplicates of them,
+    such as syndicated copies of an article or re-uploads of a video.
+    Args:
+        threshold: The similarity from which a text counts as a duplicate.
+    """
+
+    def __init__(self, threshold: float = DUPLICATE_SIMILARITY):
+        self.threshold = threshold
+        self._kept: List[Tuple[str, FrozenSet[int]]] = []
+
+    def add(self, key: str, text: str) -> Optional[str]:
+        """
+        Adds a source unless it is a near-duplicate of one already added.
+        Args:
+            key: Identifies the source, e.g. its URL.
+            text: The content of the source.
+        Returns:
+            The key of the earlier source it duplicates, or None if it was added.
+        """
+        sketch: Optional[FrozenSet[int]] = fingerprint(text)
+        if sketch is None:
+            return None
+        for kept_key, kept_sketch in self._kept:
+            if similarity(sketch, kept_sketch) >= self.threshold:
+                return kept_key
+        self._kept.append((key, sketch))
+        return None
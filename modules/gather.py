@@ -0,0 +1,468 @@
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Generator, Iterable, List, Optional, Tuple, Union
+
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from modules import breaker, dedup, retrieval, scraper, search, tracing
+from modules.cache import normalize_url
+from modules.transcripts import Transcript
+
+
+FETCH_TIMEOUT_SECONDS: float = float(os.getenv("FETCH_TIMEOUT_SECONDS", "20"))
+MAX_FETCH_WORKERS: int = int(os.getenv("MAX_FETCH_WORKERS", "8"))
+# Total time a question may spend searching and fetching; later sources are dropped
+QUESTION_DEADLINE_SECONDS: float = float(os.getenv("QUESTION_DEADLINE_SECONDS", "25"))
+# Send a duplicate of a fetch that has not finished after this many seconds; 0 disables hedging
+HEDGE_AFTER_SECONDS: float = float(os.getenv("HEDGE_AFTER_SECONDS", "0"))
+# Extra search hits fetched per source type, to take the place of failed or near-duplicate sources
+SPARE_RESULTS: int = int(os.getenv("SPARE_RESULTS", "2"))
+# Rank search hits by their titles and snippets before fetching any page, instead of
+# fetching each hit as it arrives; see retrieval.rank_hits
+PRERANK_HITS: bool = os.getenv("PRERANK_HITS", "1") != "0"
+# With ranking, search for this many candidates per source wanted (plus the spares)
+CANDIDATE_FACTOR: int = int(os.getenv("CANDIDATE_FACTOR", "2"))
+# Content tokens per source type after which no more fetches are started; 0 for no limit
+FETCH_TOKEN_BUDGET: int = int(os.getenv("FETCH_TOKEN_BUDGET", str(3 * retrieval.PROMPT_TOKEN_BUDGET)))
+# Assumed size of a source in tokens until one has been fetched
+EXPECTED_SOURCE_TOKENS: int = int(os.getenv("EXPECTED_SOURCE_TOKENS", "2500"))
+
+# Shared across questions (and Streamlit sessions) so the number of concurrent
+# page/transcript downloads stays bounded for the whole process.
+_fetch_pool: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS, thread_name_prefix="fetch")
+_search_pool: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="search")
+
+
+def _in_caller_context(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Wraps a callable so that it runs with the caller's Streamlit script context and
+    context variables. Without them, st.error calls made from worker threads are
+    silently dropped and spans are not attributed to the question's trace.
+    Args:
+        fn: The callable to wrap.
+    Returns:
+        A callable with the same signature as fn.
+    """
+    ctx = get_script_run_ctx(suppress_warning=True)
+    context: contextvars.Context = contextvars.copy_context()
+
+    def run(*args: Any, **kwargs: Any) -> Any:
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        # A context can only be entered by one thread at a time, so each call gets a copy
+        return context.copy().run(fn, *args, **kwargs)
+    return run
+
+
+def fetch_transcript(video_id: str, coalesce: bool = True) -> Tuple[Union[Transcript, str], str]:
+    """
+    Fetches a YouTube transcript and its formatted text in one worker task.
+    Args:
+        video_id: The ID of the YouTube video.
+        coalesce: Whether to share a concurrent fetch of the same video, see scraper.get_video_transcript.
+    Returns:
+        A tuple of the transcript (or error message) and the formatted transcript text.
+    """
+    transcript = scraper.get_video_transcript(video_id, coalesce=coalesce)
+    return transcript, scraper.format_transcript_text(transcript)
+
+
+def search_size(limit: int) -> int:
+    """The number of search hits to ask for when limit sources are wanted."""
+    return (limit * max(1, CANDIDATE_FACTOR) if PRERANK_HITS else limit) + SPARE_RESULTS
+
+
+def rank_hits(question: str, hits: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """Search hits best first by their title and snippet (videos have only a title)."""
+    texts: List[str] = [f"{hit['title']} {hit.get('snippet', '')}" for hit in hits]
+    return [hits[i] for i in retrieval.rank_hits(question, texts)]
+
+
+def _skip_reason(kind: str, hit: Dict[str, str]) -> Optional[str]:
+    """Why a search hit should not be fetched: it failed recently, or its site or service is failing."""
+    if kind == "web":
+        return breaker.skip_reason(("page", normalize_url(hit["url"])), breaker.domain_of(hit["url"]))
+    return breaker.skip_reason(("transcript", hit["id"]), breaker.TRANSCRIPTS)
+
+
+def _fetch_error(kind: str, hit: Dict[str, str], fetched: Any) -> Optional[str]:
+    """The error of a failed page or transcript fetch, or None if it succeeded."""
+    if kind == "web":
+        prefix: str = f"Error extracting content from {hit['url']}: "
+        return fetched[len(prefix):] if fetched.startswith(prefix) else None
+    transcript: Union[Transcript, str] = fetched[0]
+    return transcript.replace("Error getting transcript: ", "", 1) if isinstance(transcript, str) else None
+
+
+class _ContentBudget:
+    """
+    The content fetched for one source type against FETCH_TOKEN_BUDGET. A fetch is
+    only started while the tokens kept so far, plus those expected from the fetches
+    still running, fall short of the budget.
+    Args:
+        tokens: The budget in tokens; 0 for no limit. Defaults to FETCH_TOKEN_BUDGET.
+    """
+
+    def __init__(self, tokens: Optional[int] = None):
+        self.tokens: int = FETCH_TOKEN_BUDGET if tokens is None else tokens
+        self.fetched: int = 0
+        self.kept: int = 0
+        self.pending: int = 0
+        self._lock = threading.Lock()
+
+    def allows(self) -> bool:
+        """Whether another fetch may be started."""
+        if self.tokens <= 0:
+            return True
+        with self._lock:
+            per_source: float = self.fetched / self.kept if self.kept else EXPECTED_SOURCE_TOKENS
+            return self.fetched + self.pending * per_source < self.tokens
+
+    def start(self) -> None:
+        with self._lock:
+            self.pending += 1
+
+    def finish(self, text: Optional[str]) -> None:
+        """Records a fetch as finished, with the text of the source kept, or None if it was dropped."""
+        with self._lock:
+            self.pending -= 1
+            if text is not None:
+                self.fetched += retrieval.estimate_tokens(text)
+                self.kept += 1
+
+
+# Steps of SourceSelection.run
+START: str = "start"
+WAIT: str = "wait"
+
+Hit = Dict[str, str]
+
+
+class SourceSelection:
+    """
+    Picks the sources of one type from its search hits: which hits are fetched, and
+    which fetched sources are kept. Sources that fail, are known to fail (see
+    modules.breaker) or are near-duplicates of an earlier source are dropped, and
+    their slots go to the next hits; no fetch is started once the sources fill
+    FETCH_TOKEN_BUDGET. The selection does no I/O itself, so that gather_sources
+    and the async service (modules.service) share it and only differ in how they
+    start fetches and wait for them, see run.
+    Args:
+        kind: "web" or "youtube".
+        limit: The most sources kept.
+        dropped_sources: Receives the type, title, URL and reason of each source left out.
+        deadline: The time.monotonic() value after which no spare hit is fetched.
+    """
+
+    def __init__(self, kind: str, limit: int, dropped_sources: List[Dict[str, str]], deadline: Optional[float] = None):
+        self.kind = kind
+        self.limit = limit
+        self.dropped_sources = dropped_sources
+        self.deadline = deadline
+        self.budget: _ContentBudget = _ContentBudget()
+        self.prefetched: int = 0
+
+    def prefetch(self, hit: Hit) -> bool:
+        """
+        Decides whether to fetch a hit as soon as it is known, before run. Spare hits
+        are only fetched once a failed or duplicate source frees a slot, and hits that
+        are known to fail are not fetched at all and leave their slot to a spare.
+        Returns:
+            Whether the caller should start fetching the hit now.
+        """
+        if self.prefetched < self.limit and _skip_reason(self.kind, hit) is None and self.budget.allows():
+            self.prefetched += 1
+            self.budget.start()
+            return True
+        return False
+
+    def drop(self, hit: Hit, reason: str) -> None:
+        self.dropped_sources.append({"type": self.kind, "title": hit["title"], "url": hit["url"], "reason": reason})
+        tracing.annotate(dropped=len(self.dropped_sources))
+
+    def run(self, hits: List[Hit], started: List[bool]) -> Generator[Tuple[str, int], Optional[Tuple[bool, Any]],
+                                                                      Tuple[List[Tuple[Hit, Any]], int]]:
+        """
+        Goes through the hits in order and keeps the first sources that work out.
+        Args:
+            hits: The search hits, best first.
+            started: For each hit, whether its fetch was started after prefetch.
+        Yields:
+            (START, i) when the fetch of hits[i] must be started, and (WAIT, i) when
+            its result is needed. After WAIT, the caller sends (True, result) back, or
+            (False, reason) if the fetch did not finish in time.
+        Returns:
+            The (hit, result) pairs kept and the number of hits used; hits past that
+            number were not fetched.
+        """
+        fetching: List[bool] = list(started)
+        index: dedup.NearDuplicateIndex = dedup.NearDuplicateIndex()
+        kept: List[Tuple[Hit, Any]] = []
+        wanted: int = min(self.limit, len(hits))
+        position: int = 0
+        while position < wanted:
+            hit: Hit = hits[position]
+            position += 1
+            reason: Optional[str] = None
+            if not fetching[position - 1]:
+                reason = _skip_reason(self.kind, hit)
+                if reason is None:
+                    if not self.budget.allows():
+                        position -= 1
+                        break
+                    self.budget.start()
+                    fetching[position - 1] = True
+                    yield START, position - 1
+            if reason is None:
+                finished, fetched = yield WAIT, position - 1
+                if not finished:
+                    self.budget.finish(None)
+                    self.drop(hit, fetched)
+                    continue
+                # Error messages are not sources; they must not reach the prompt
+                error: Optional[str] = _fetch_error(self.kind, hit, fetched)
+                if error is not None:
+                    reason = f"failed: {error}"
+                else:
+                    text: str = fetched if self.kind == "web" else fetched[1]
+                    duplicate_of: Optional[str] = index.add(hit["url"], text)
+                    if not duplicate_of:
+                        self.budget.finish(text)
+                        kept.append((hit, fetched))
+                        continue
+                    reason = f"near-duplicate of {duplicate_of}"
+                self.budget.finish(None)
+
+            # Replace the dropped source with the next hit, starting its fetch now
+            # instead of when the loop reaches it
+            self.drop(hit, reason)
+            if wanted < len(hits) and (self.deadline is None or time.monotonic() < self.deadline):
+                if not fetching[wanted]:
+                    if not self.budget.allows():
+                        continue  # the sources kept already fill the budget
+                    if _skip_reason(self.kind, hits[wanted]) is None:
+                        self.budget.start()
+                        fetching[wanted] = True
+                        yield START, wanted
+                wanted += 1
+        return kept, position
+
+    def sources(self, kept: List[Tuple[Hit, Any]]) -> List[Dict[str, Any]]:
+        """
+        Args:
+            kept: The pairs returned by run.
+        Returns:
+            The sources in the format of gather_sources.
+        """
+        if self.kind == "web":
+            return [{"title": result["title"], "url": result["url"], "content": content} for result, content in kept]
+        return [
+            {
+                "id": video["id"],
+                "title": video["title"],
+                "url": video["url"],
+                "transcript": transcript,
+                "transcript_text": transcript_text
+            }
+            for video, (transcript, transcript_text) in kept
+        ]
+
+
+class _Fetch:
+    """
+    One page or transcript fetch, with an optional hedged duplicate.
+    Args:
+        submit: Submits the fetch to the pool and returns its future.
+        deadline: The time.monotonic() value at which the fetch is given up.
+        hedge_at: The time.monotonic() value after which a duplicate is sent if
+                  the fetch has not finished, or None to never hedge.
+        submit_hedge: Submits the duplicate. It must not join the original's
+                      in-flight download (see modules.singleflight), or the
+                      duplicate would only wait for the original. Defaults to submit.
+    """
+    __slots__ = ("submit", "submit_hedge", "futures", "deadline", "hedge_at")
+
+    def __init__(self, submit: Callable[[], Future], deadline: float, hedge_at: Optional[float] = None,
+                 submit_hedge: Optional[Callable[[], Future]] = None):
+        self.submit = submit
+        self.submit_hedge = submit_hedge or submit
+        self.futures: List[Future] = [submit()]
+        self.deadline = deadline
+        self.hedge_at = hedge_at
+
+    def wait(self) -> Tuple[bool, Any]:
+        """
+        Waits for the first copy of the fetch to finish, until the deadline.
+        Copies still queued at the deadline are cancelled; running ones are abandoned.
+        Returns:
+            A tuple (finished, result). result is None if the fetch timed out.
+        """
+        if self.hedge_at is not None and self.hedge_at < self.deadline:
+            done, _ = wait(self.futures, timeout=max(0.0, self.hedge_at - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                # Slow fetches are usually a slow connection, not a slow page; a retry often wins
+                self.futures.append(self.submit_hedge())
+        done, _ = wait(self.futures, timeout=max(0.0, self.deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+        if done:
+            return True, next(iter(done)).result()
+        self.cancel()
+        return False, None
+
+    def cancel(self) -> None:
+        """Cancels the copies that have not started; running ones are abandoned."""
+        for future in self.futures:
+            future.cancel()
+
+
+def gather_sources(question: str, include_web: bool = True, include_youtube: bool = True,
+                   max_web_results: int = 5, max_youtube_results: int = 3,
+                   fetch_timeout: Optional[float] = None, deadline: Optional[float] = None,
+                   hedge_after: Optional[float] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Searches the web and YouTube concurrently, ranks each type's hits by how well
+    their titles and snippets match the question and fetches the best ones, in that
+    order (with PRERANK_HITS off, every hit is fetched as soon as it arrives). No
+    more fetches are started once a type's sources fill FETCH_TOKEN_BUDGET. When
+    the question's deadline is reached, the sources that have arrived are used
+    and the rest are dropped. Sources that fail, are known to fail (see
+    modules.breaker) or are near-duplicates of an earlier source are dropped too,
+    and their slots go to the next search hits.
+    Args:
+        question: The question to search for.
+        include_web: Whether to search the web.
+        include_youtube: Whether to search YouTube.
+        max_web_results: The maximum number of web pages to fetch.
+        max_youtube_results: The maximum number of YouTube videos to fetch.
+        fetch_timeout: Seconds each page or transcript fetch may take. Defaults to
+                       FETCH_TIMEOUT_SECONDS.
+        deadline: Seconds the whole search and fetch stage may take. Defaults to
+                  QUESTION_DEADLINE_SECONDS.
+        hedge_after: Seconds after which a duplicate of an unfinished fetch is sent.
+                     Defaults to HEDGE_AFTER_SECONDS; 0 disables hedging.
+    Returns:
+        A dictionary with the keys "web_results", "web_sources", "youtube_results",
+        "youtube_sources", "search_reports" (which provider answered each search
+        and whether it came from the cache) and "dropped_sources" (the title, URL,
+        type and reason of every source left out for time, as failed or as a
+        near-duplicate). Sources are in ranked order (search-result order with
+        PRERANK_HITS off), however their fetches finish.
+    """
+    timeout: float = FETCH_TIMEOUT_SECONDS if fetch_timeout is None else fetch_timeout
+    question_deadline: float = time.monotonic() + (QUESTION_DEADLINE_SECONDS if deadline is None else deadline)
+    hedge: float = HEDGE_AFTER_SECONDS if hedge_after is None else hedge_after
+    web_results: List[Dict[str, str]] = []
+    youtube_results: List[Dict[str, str]] = []
+    web_fetches: List[Optional[_Fetch]] = []
+    youtube_fetches: List[Optional[_Fetch]] = []
+    search_reports: Dict[str, Dict[str, Any]] = {}
+    dropped_sources: List[Dict[str, str]] = []
+    # Set at the deadline so a late search stops starting fetches nobody waits for
+    stopped: threading.Event = threading.Event()
+    # Guards the hit lists, which a search reorders once it has ranked them
+    hits_lock: threading.Lock = threading.Lock()
+    selections: Dict[str, SourceSelection] = {
+        "web": SourceSelection("web", max_web_results, dropped_sources, question_deadline),
+        "youtube": SourceSelection("youtube", max_youtube_results, dropped_sources, question_deadline),
+    }
+
+    extract = _in_caller_context(scraper.extract_web_content)
+    transcribe = _in_caller_context(fetch_transcript)
+
+    def start_fetch(fn: Callable[[str], Any], arg: str) -> _Fetch:
+        now: float = time.monotonic()
+        return _Fetch(
+            lambda: _fetch_pool.submit(fn, arg),
+            deadline=min(now + timeout, question_deadline),
+            hedge_at=now + hedge if hedge > 0 else None,
+            submit_hedge=lambda: _fetch_pool.submit(fn, arg, coalesce=False)
+        )
+
+    def run_search(kind: str, search_hits: Callable[[], Iterable[Hit]], results: List[Hit],
+                   fetches: List[Optional[_Fetch]], fn: Callable[[str], Any], arg: str) -> None:
+        selection: SourceSelection = selections[kind]
+        with tracing.span(f"search.{kind}") as search_span:
+            for hit in search_hits():
+                if stopped.is_set():
+                    break
+                fetch: Optional[_Fetch] = None
+                if not PRERANK_HITS and selection.prefetch(hit):
+                    fetch = start_fetch(fn, hit[arg])
+                with hits_lock:
+                    results.append(hit)
+                    fetches.append(fetch)
+            if PRERANK_HITS and not stopped.is_set():
+                ranked: List[Hit] = rank_hits(question, list(results))
+                ranked_fetches: List[Optional[_Fetch]] = [start_fetch(fn, hit[arg]) if selection.prefetch(hit) else None
+                                                          for hit in ranked]
+                with hits_lock:
+                    results[:] = ranked
+                    fetches[:] = ranked_fetches
+            search_span.set(results=len(results), **search_reports[kind])
+
+    def run_web_search() -> None:
+        search_reports["web"] = {}
+        run_search("web", lambda: search.iter_web_results(question, max_results=search_size(max_web_results),
+                                                          report=search_reports["web"]),
+                   web_results, web_fetches, extract, "url")
+
+    def run_youtube_search() -> None:
+        search_reports["youtube"] = {}
+        run_search("youtube", lambda: search.search_youtube(question, max_results=search_size(max_youtube_results),
+                                                            report=search_reports["youtube"]),
+                   youtube_results, youtube_fetches, transcribe, "id")
+
+    searches: Dict[str, Future] = {}
+    if include_web:
+        searches["web"] = _search_pool.submit(_in_caller_context(run_web_search))
+    if include_youtube:
+        searches["youtube"] = _search_pool.submit(_in_caller_context(run_youtube_search))
+    wait(list(searches.values()), timeout=max(0.0, question_deadline - time.monotonic()))
+    stopped.set()
+    for kind, future in searches.items():
+        if not future.done():
+            search_reports.setdefault(kind, {})["timed_out"] = True
+        elif future.exception() is not None:
+            raise future.exception()
+    # A search that missed the deadline keeps only the hits it had; copy them before it appends more
+    with hits_lock:
+        web_hits: List[Hit] = list(web_results)
+        youtube_hits: List[Hit] = list(youtube_results)
+        fetches: Dict[str, List[Optional[_Fetch]]] = {"web": web_fetches[:len(web_hits)],
+                                                      "youtube": youtube_fetches[:len(youtube_hits)]}
+
+    def timeout_reason(fetch: _Fetch) -> str:
+        return "question deadline reached" if fetch.deadline >= question_deadline else f"timed out after {timeout:g}s"
+
+    def select(kind: str, hits: List[Hit], fn: Callable[[str], Any], arg: str) -> Tuple[List[Dict[str, Any]], int]:
+        """Runs the kind's selection, starting and waiting for its fetches; returns its sources and hits used."""
+        kind_fetches: List[Optional[_Fetch]] = fetches[kind]
+        steps = selections[kind].run(hits, [fetch is not None for fetch in kind_fetches])
+        reply: Optional[Tuple[bool, Any]] = None
+        while True:
+            try:
+                action, i = steps.send(reply)
+            except StopIteration as done:
+                kept, used = done.value
+                return selections[kind].sources(kept), used
+            reply = None
+            if action == START:
+                kind_fetches[i] = start_fetch(fn, hits[i][arg])
+            else:
+                finished, fetched = kind_fetches[i].wait()
+                reply = (True, fetched) if finished else (False, timeout_reason(kind_fetches[i]))
+
+    web_sources, used_web_hits = select("web", web_hits, extract, "url")
+    youtube_sources, used_youtube_hits = select("youtube", youtube_hits, transcribe, "id")
+
+    return {
+        # Unfetched spare hits are left out
+        "web_results": web_hits[:used_web_hits],
+        "web_sources": web_sources,
+        "youtube_results": youtube_hits[:used_youtube_hits],
+        "youtube_sources": youtube_sources,
+        "search_reports": search_reports,
+        "dropped_sources": dropped_sources
+    }
@@ -0,0 +1,45 @@
+import os
+import threading
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# Keep-alive connections kept open per host, and hosts kept in the pool
+HTTP_POOL_MAXSIZE: int = int(os.getenv("HTTP_POOL_MAXSIZE", "32"))
+HTTP_POOL_CONNECTIONS: int = int(os.getenv("HTTP_POOL_CONNECTIONS", "64"))
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def create_session(pool_connections: Optional[int] = None, pool_maxsize: Optional[int] = None) -> requests.Session:
+    """
+    Creates a requests session whose connection pools are sized for concurrent fetches.
+    Args:
+        pool_connections: The number of hosts whose connections are kept. Defaults to HTTP_POOL_CONNECTIONS.
+        pool_maxsize: The number of keep-alive connections kept per host. Defaults to HTTP_POOL_MAXSIZE.
+    Returns:
+        The session.
+    """
+    session: requests.Session = requests.Session()
+    # pool_block=False: a burst beyond pool_maxsize opens extra connections instead of waiting
+    adapter: HTTPAdapter = HTTPAdapter(pool_connections=pool_connections or HTTP_POOL_CONNECTIONS,
+                                       pool_maxsize=pool_maxsize or HTTP_POOL_MAXSIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    Returns:
+        The process-wide session, so repeated requests to a host reuse its open
+        connections instead of a new TCP and TLS handshake each time.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
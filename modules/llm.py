@@ -1,55 +1,100 @@
 import streamlit as st
-import google.generativeai as genai
+import contextvars
+import hashlib
 import os
-from typing import List, Dict, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from modules import clients, ratelimit, retrieval, scraper, singleflight, tracing
+from modules.cache import CachedValue, MemoryCache
+from modules.search import normalize_query
+from modules.transcripts import Transcript
+from typing import Any, Iterator, List, Dict, Optional, Tuple, Union
 
-def generate_answer(question: str, web_sources: List[Dict[str, str]], youtube_sources: List[Dict[str, str]]) -> str:
+# Bump whenever the prompt or generation settings change, so cached answers are not reused
+PROMPT_VERSION: str = "2"
+
+# A plain dict, so importing this module does not import the Gemini SDK
+GENERATION_CONFIG: Dict[str, Any] = dict(
+    temperature=0.2,
+    max_output_tokens=1500,
+    top_p=0.95,
+    top_k=40
+)
+
+ANSWER_CACHE_MAX_ENTRIES: int = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "256"))
+
+# From this many sources, facts are extracted per source in parallel (map) and
+# one call writes the answer from them (reduce), instead of one prompt with every source
+MAP_REDUCE_MIN_SOURCES: int = int(os.getenv("MAP_REDUCE_MIN_SOURCES", "9"))
+MAP_CONCURRENCY: int = int(os.getenv("MAP_CONCURRENCY", "8"))
+MAP_SOURCE_TOKEN_BUDGET: int = int(os.getenv("MAP_SOURCE_TOKEN_BUDGET", "3000"))
+MAP_GENERATION_CONFIG: Dict[str, Any] = dict(
+    temperature=0.0,
+    max_output_tokens=400,
+    top_p=0.95,
+    top_k=40
+)
+NO_FACTS: str = "NONE"
+
+_map_pool: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=MAP_CONCURRENCY, thread_name_prefix="map")
+
+_answer_cache: MemoryCache = MemoryCache(max_entries=ANSWER_CACHE_MAX_ENTRIES)
+_answer_flights = singleflight.SingleFlight("answer", processes="result")
+
+
+class GenerationError(Exception):
+    """Raised by stream_answer when no complete answer could be generated; the message is the error to report."""
+
+
+def build_prompt(question: str, web_sources: List[Dict[str, str]], youtube_sources: List[Dict[str, str]],
+                 token_budget: int = retrieval.PROMPT_TOKEN_BUDGET) -> str:
     """
-    Generates an answer to a question based on provided web and YouTube sources using the Gemini model.
+    Builds the Gemini prompt, numbering web sources first and YouTube sources after them.
+    Each source contributes the passages most relevant to the question, within a
+    token budget shared by all sources.
     Args:
         question: The question to answer.
-        web_sources: A list of dictionaries, where each dictionary represents a web source
-                     and contains at least the keys "url" and "content".
-        youtube_sources: A list of dictionaries, where each dictionary represents a YouTube source
-                         and contains at least the keys "url" and "transcript_text".
+        web_sources: The web sources, see generate_answer.
+        youtube_sources: The YouTube sources, see generate_answer.
+        token_budget: The approximate number of tokens of source passages in the prompt.
     Returns:
-        A string containing the answer generated by the Gemini model, including citations
-        to the sources, or an error message if the API key is not configured or if an
-        error occurs during generation.
+        The prompt text.
     """
-    gemini_api_key: Optional[str] = os.getenv("GEMINI_API_KEY")
-    if not gemini_api_key:
-        st.error("Gemini API Key not found in environment variables")
-        return "Error: Gemini API Key not configured"
-    
-    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    # Send the passages most relevant to the question instead of each source's first 8000 characters
+    passages: List[str] = retrieval.select_passages(
+        question,
+        [source.get("content", "") for source in web_sources] + [_transcript(source) for source in youtube_sources],
+        token_budget=token_budget
+    )
 
-    try:
-        all_sources: List[str] = []
-        # Add web sources
-        for i, source in enumerate(web_sources, 1):
-            content: str = source.get("content", "").strip()
-            # Truncate long content
-            if len(content) > 8000:
-                content = content[:8000] + "..."
-            all_sources.append(f"SOURCE {i} (WEB): {source['url']}\n{content}\n")
-    
-        # Add YouTube sources starting from where web sources left off
-        start_idx: int = len(web_sources) + 1
-        for i, source in enumerate(youtube_sources, start_idx):
-            transcript_text: str = source.get("transcript_text", "").strip()
-            if transcript_text and len(transcript_text) > 8000:
-                transcript_text = transcript_text[:8000] + "..."
-            all_sources.append(f"SOURCE {i} (YOUTUBE): {source['url']}\n{transcript_text}\n")
-    
-        prompt: str = f"""
+    all_sources: List[str] = []
+    # Add web sources
+    for i, source in enumerate(web_sources, 1):
+        all_sources.append(f"SOURCE {i} (WEB): {source['url']}\n{passages[i - 1]}\n")
+
+    # Add YouTube sources starting from where web sources left off
+    start_idx: int = len(web_sources) + 1
+    for i, source in enumerate(youtube_sources, start_idx):
+        all_sources.append(f"SOURCE {i} (YOUTUBE): {source['url']}\n{passages[i - 1]}\n")
+
+    return _answer_prompt(question, all_sources)
+
+
+def _answer_prompt(question: str, all_sources: List[str]) -> str:
+    """
+    Args:
+        question: The question to answer.
+        all_sources: One "SOURCE n (WEB|YOUTUBE): url" block per source.
+    Returns:
+        The answer prompt, which defines the numbered citation format.
+    """
+    prompt: str = f"""
         Answer the following question based ONLY on the provided sources:
-    
+
         QUESTION: {question}
-    
+
         SOURCES:
         {'\n'.join(all_sources)}
-    
+
         INSTRUCTIONS:
         1. Answer the question directly and concisely based only on the information in the sources.
         2. Use numbered citations in square brackets [1], [2], etc. after every statement that uses information from the sources.
@@ -61,22 +106,300 @@ def generate_answer(question: str, web_sources: List[Dict[str, str]], youtube_so
         8. For web sources, include the title and URL.
         9. If you use multiple timestamps from the same video, list the earliest one in the SOURCES section.
         """
-    
-        
-        model: genai.GenerativeModel = genai.GenerativeModel('gemini-1.5-flash-latest')
-        response: genai.types.GenerateContentResponse = model.generate_content(
+    return prompt
+
+
+def use_map_reduce(web_sources: List[Dict[str, str]], youtube_sources: List[Dict[str, str]]) -> bool:
+    """
+    Returns:
+        Whether there are enough sources to answer in map-reduce mode.
+    """
+    return len(web_sources) + len(youtube_sources) >= MAP_REDUCE_MIN_SOURCES
+
+
+def build_map_prompt(question: str, number: int, kind: str, url: str, text: str) -> str:
+    """
+    Builds the prompt that extracts the facts of one source, already cited with
+    the source's final number.
+    Args:
+        question: The question to answer.
+        number: The citation number of the source.
+        kind: "WEB" or "YOUTUBE".
+        url: The URL of the source.
+        text: The passages of the source most relevant to the question.
+    Returns:
+        The prompt text.
+    """
+    return f"""
+        Extract the facts that help answer the question from the source below.
+
+        QUESTION: {question}
+
+        SOURCE {number} ({kind}): {url}
+        {text}
+
+        INSTRUCTIONS:
+        1. List each relevant fact on its own line, starting with "- " and ending with the citation [{number}].
+        2. For YouTube sources, add the timestamp of the fact like [{number}][02:15].
+        3. Use only information from the source. If it has nothing relevant, reply with {NO_FACTS} only.
+        """
+
+
+def extract_facts(question: str, web_sources: List[Dict[str, str]], youtube_sources: List[Dict[str, str]],
+                  api_key: str) -> List[str]:
+    """
+    Runs the map stage: one extraction call per source, MAP_CONCURRENCY at a time.
+    Args:
+        question: The question to answer.
+        web_sources: The web sources, see generate_answer.
+        youtube_sources: The YouTube sources, see generate_answer.
+        api_key: The Gemini API key.
+    Returns:
+        The cited facts of each source in citation order; empty for sources with
+        nothing relevant or whose call failed.
+    Raises:
+        Exception: The first error, if every call failed.
+    """
+    sources: List[Tuple[str, Dict[str, str], Union[Transcript, str]]] = (
+        [("WEB", source, source.get("content", "")) for source in web_sources]
+        + [("YOUTUBE", source, _transcript(source)) for source in youtube_sources]
+    )
+
+    def extract(number: int, kind: str, url: str, text: Union[Transcript, str]) -> str:
+        with tracing.span("llm.map_source", source=number):
+            passages: str = retrieval.select_passages(question, [text], token_budget=MAP_SOURCE_TOKEN_BUDGET)[0]
+            response: Any = _generate_content(api_key, build_map_prompt(question, number, kind, url, passages),
+                                              MAP_GENERATION_CONFIG)
+            facts: str = response.text.strip()
+            return "" if facts == NO_FACTS else facts
+
+    # Each call runs in a copy of this context, so its span joins the question's trace
+    futures: List[Future] = [
+        _map_pool.submit(contextvars.copy_context().run, extract, number, kind, source["url"], text)
+        for number, (kind, source, text) in enumerate(sources, 1)
+    ]
+    facts: List[str] = []
+    errors: List[BaseException] = []
+    for future in futures:
+        error: Optional[BaseException] = future.exception()
+        if error is not None:
+            errors.append(error)
+        facts.append("" if error is not None else future.result())
+    if errors and len(errors) == len(futures):
+        raise errors[0]
+    return facts
+
+
+def build_map_reduce_prompt(question: str, web_sources: List[Dict[str, str]], youtube_sources: List[Dict[str, str]],
+                            api_key: str) -> str:
+    """
+    Runs the map stage and builds the reduce prompt: the regular answer prompt
+    with each source's extracted facts in place of its passages. Sources keep
+    their numbers, so citations match create_sources_list.
+    Args:
+        question: The question to answer.
+        web_sources: The web sources, see generate_answer.
+        youtube_sources: The YouTube sources, see generate_answer.
+        api_key: The Gemini API key.
+    Returns:
+        The prompt text.
+    """
+    facts: List[str] = extract_facts(question, web_sources, youtube_sources, api_key)
+    kinds: List[Tuple[str, Dict[str, str]]] = [("WEB", source) for source in web_sources] + [("YOUTUBE", source) for source in youtube_sources]
+    all_sources: List[str] = [
+        f"SOURCE {i} ({kind}): {source['url']}\n{source_facts}\n"
+        for i, ((kind, source), source_facts) in enumerate(zip(kinds, facts), 1)
+        if source_facts
+    ]
+    return _answer_prompt(question, all_sources)
+
+
+def _build_prompt(question: str, web_sources: List[Dict[str, str]], youtube_sources: List[Dict[str, str]],
+                  api_key: str, map_reduce: bool) -> str:
+    if map_reduce:
+        with tracing.span("llm.map", sources=len(web_sources) + len(youtube_sources)):
+            return build_map_reduce_prompt(question, web_sources, youtube_sources, api_key)
+    with tracing.span("llm.build_prompt"):
+        return build_prompt(question, web_sources, youtube_sources)
+
+
+def _generate_content(api_key: str, prompt: str, generation_config: Dict[str, Any] = GENERATION_CONFIG,
+                      stream: bool = False) -> Any:
+    """
+    Calls Gemini through the rate limits, counting the prompt and the longest
+    possible answer against a tokens-per-minute limit.
+    """
+    model: Any = clients.gemini_model(api_key)
+    return ratelimit.call(
+        "gemini", "generate_content",
+        lambda: model.generate_content(
             [
                 {"role": "user", "parts": [{"text": prompt}]}
             ],
-            generation_config=genai.types.GenerationConfig(
-                temperature=0.2,
-                max_output_tokens=1500,
-                top_p=0.95,
-                top_k=40
-            )
-        )
-    
-        return response.text
-    except Exception as e:
-        return f"Error generating answer: {str(e)}"
+            generation_config=generation_config,
+            stream=stream
+        ),
+        tokens=retrieval.estimate_tokens(prompt) + generation_config["max_output_tokens"]
+    )
+
+
+def _transcript(source: Dict[str, str]) -> Union[Transcript, str]:
+    """
+    Args:
+        source: A YouTube source with a Transcript under "transcript" or a "transcript_text".
+    Returns:
+        The Transcript of the source if it has one, otherwise its transcript text.
+    """
+    transcript: Optional[Transcript] = source.get("transcript")
+    if isinstance(transcript, Transcript):
+        return transcript
+    return source.get("transcript_text", "")
+
+
+def answer_cache_key(question: str, web_sources: List[Dict[str, str]], youtube_sources: List[Dict[str, str]],
+                     map_reduce: bool = False) -> str:
+    """
+    Computes the answer cache key from the prompt version, the normalized question and
+    a content hash of every source in citation order.
+    Args:
+        question: The question to answer.
+        web_sources: The web sources, see generate_answer.
+        youtube_sources: The YouTube sources, see generate_answer.
+        map_reduce: Whether the answer is generated in map-reduce mode.
+    Returns:
+        A hex digest identifying the answer.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{PROMPT_VERSION}\0{normalize_query(question)}\0".encode("utf-8"))
+    if map_reduce:
+        digest.update(b"map-reduce\0")
+    for source in web_sources:
+        digest.update(hashlib.sha256(f"WEB\0{source['url']}\0{source.get('content', '')}".encode("utf-8")).digest())
+    for source in youtube_sources:
+        digest.update(hashlib.sha256(f"YOUTUBE\0{source['url']}\0{scraper.format_transcript_text(_transcript(source))}".encode("utf-8")).digest())
+    return digest.hexdigest()
+
+
+def answer_cache_stats() -> Dict[str, int]:
+    """
+    Returns:
+        The hit, miss and eviction counters of the answer cache.
+    """
+    return _answer_cache.stats()
+
+
+def generate_answer(question: str, web_sources: List[Dict[str, str]], youtube_sources: List[Dict[str, str]],
+                    map_reduce: Optional[bool] = None) -> str:
+    """
+    Generates an answer to a question based on provided web and YouTube sources using the Gemini model.
+    Answers are cached by question and source content, so a repeated question over
+    the same sources skips the model call, and concurrent identical calls share one. With many sources, facts are first
+    extracted from each source in parallel and the answer is written from them.
+    Args:
+        question: The question to answer.
+        web_sources: A list of dictionaries, where each dictionary represents a web source
+                     and contains at least the keys "url" and "content".
+        youtube_sources: A list of dictionaries, where each dictionary represents a YouTube source
+                         and contains at least the keys "url" and either a Transcript under
+                         "transcript" or "transcript_text".
+        map_reduce: Whether to answer in map-reduce mode. Defaults to use_map_reduce.
+    Returns:
+        A string containing the answer generated by the Gemini model, including citations
+        to the sources, or an error message if the API key is not configured or if an
+        error occurs during generation.
+    """
+    if map_reduce is None:
+        map_reduce = use_map_reduce(web_sources, youtube_sources)
+    cache_key: str = answer_cache_key(question, web_sources, youtube_sources, map_reduce)
+    cached: Optional[CachedValue] = _answer_cache.get(cache_key)
+    if cached is not None:
+        tracing.annotate(answer_cache="hit")
+        return cached.value
+
+    gemini_api_key: Optional[str] = os.getenv("GEMINI_API_KEY")
+    if not gemini_api_key:
+        st.error("Gemini API Key not found in environment variables")
+        return "Error: Gemini API Key not configured"
+
+    # Sessions asking the same question over the same sources share one model call
+    return _answer_flights.do(("generate", cache_key), lambda: _generate_answer(
+        question, web_sources, youtube_sources, map_reduce, cache_key, gemini_api_key))
+
+
+def _generate_answer(question: str, web_sources: List[Dict[str, str]], youtube_sources: List[Dict[str, str]],
+                     map_reduce: bool, cache_key: str, gemini_api_key: str) -> str:
+    with tracing.span("llm.generate") as llm_span:
+        try:
+            prompt: str = _build_prompt(question, web_sources, youtube_sources, gemini_api_key, map_reduce)
+            llm_span.set(prompt_chars=len(prompt), map_reduce=map_reduce)
+
+            response: Any = _generate_content(gemini_api_key, prompt)
+
+            answer: str = response.text
+            llm_span.set(answer_chars=len(answer))
+            _answer_cache.put(cache_key, answer)
+            return answer
+        except Exception as e:
+            llm_span.fail(str(e))
+            return f"Error generating answer: {str(e)}"
+
+
+def stream_answer(question: str, web_sources: List[Dict[str, str]], youtube_sources: List[Dict[str, str]],
+                  map_reduce: Optional[bool] = None) -> Iterator[str]:
+    """
+    Streaming mode of generate_answer: yields the answer in chunks as Gemini produces them.
+    A cached answer is yielded as a single chunk, and a completed stream is cached
+    like a generate_answer result. Concurrent identical streams share the chunks
+    of one model call.
+    Args:
+        question: The question to answer.
+        web_sources: The web sources, see generate_answer.
+        youtube_sources: The YouTube sources, see generate_answer.
+        map_reduce: Whether to answer in map-reduce mode; only the reduce call streams.
+    Yields:
+        Consecutive pieces of the answer text.
+    Raises:
+        GenerationError: If generation fails, possibly after part of the answer was yielded.
+    """
+    if map_reduce is None:
+        map_reduce = use_map_reduce(web_sources, youtube_sources)
+    cache_key: str = answer_cache_key(question, web_sources, youtube_sources, map_reduce)
+    cached: Optional[CachedValue] = _answer_cache.get(cache_key)
+    if cached is not None:
+        yield cached.value
+        return
+
+    gemini_api_key: Optional[str] = os.getenv("GEMINI_API_KEY")
+    if not gemini_api_key:
+        st.error("Gemini API Key not found in environment variables")
+        raise GenerationError("Error: Gemini API Key not configured")
+
+    try:
+        yield from _answer_flights.stream(("stream", cache_key), lambda: _stream_answer(
+            question, web_sources, youtube_sources, map_reduce, cache_key, gemini_api_key))
+    except singleflight.FlightAbandoned as e:
+        # The identical answer this one shared was abandoned part way
+        raise GenerationError(f"Error generating answer: {str(e)}") from e
+
+
+def _stream_answer(question: str, web_sources: List[Dict[str, str]], youtube_sources: List[Dict[str, str]],
+                   map_reduce: bool, cache_key: str, gemini_api_key: str) -> Iterator[str]:
+    with tracing.span("llm.stream") as llm_span:
+        try:
+            prompt: str = _build_prompt(question, web_sources, youtube_sources, gemini_api_key, map_reduce)
+            llm_span.set(prompt_chars=len(prompt), map_reduce=map_reduce)
+
+            response: Any = _generate_content(gemini_api_key, prompt, stream=True)
 
+            parts: List[str] = []
+            for chunk in response:
+                if chunk.text:
+                    if not parts:
+                        llm_span.set(first_token_ms=round(llm_span.duration * 1000, 2))
+                    parts.append(chunk.text)
+                    yield chunk.text
+            llm_span.set(answer_chars=sum(len(part) for part in parts))
+            _answer_cache.put(cache_key, "".join(parts))
+        except Exception as e:
+            llm_span.fail(str(e))
+            raise GenerationError(f"Error generating answer: {str(e)}") from e
@@ -0,0 +1,127 @@
+import os
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from typing import Any, Callable, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows: no per-process limits
+    resource = None
+
+
+# Worker processes that parse downloaded documents; 0 parses in the calling thread
+PARSE_WORKERS: int = int(os.getenv("PARSE_WORKERS", str(os.cpu_count() or 1)))
+# CPU seconds one document may take to parse before it is given up
+PARSE_CPU_SECONDS: float = float(os.getenv("PARSE_CPU_SECONDS", "10"))
+# Address space limit of each worker process
+PARSE_MEMORY_MB: int = int(os.getenv("PARSE_MEMORY_MB", "2048"))
+# Workers are replaced after this many documents, returning memory that parsers leak or fragment
+PARSE_TASKS_PER_WORKER: int = int(os.getenv("PARSE_TASKS_PER_WORKER", "100"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+class ParseLimitExceeded(Exception):
+    """Raised when parsing a document exceeds its CPU time, or its worker dies."""
+
+
+def _init_worker(memory_mb: int) -> None:
+    if resource is not None and memory_mb > 0:
+        limit: int = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    # Import the parsers once per worker instead of with the first document
+    from modules import scraper  # noqa: F401
+
+
+def _run_limited(fn: Callable[..., Any], args: Tuple[Any, ...], cpu_seconds: float) -> Any:
+    """
+    Runs one task in a worker with a CPU time limit. A timer signal raises
+    ParseLimitExceeded at the limit; parsers stuck in C code, where the signal
+    cannot interrupt them, are killed by the kernel at twice the limit.
+    """
+    if resource is None or not hasattr(signal, "SIGPROF"):
+        return fn(*args)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft: int = int(usage.ru_utime + usage.ru_stime + 2 * cpu_seconds) + 1
+    resource.setrlimit(resource.RLIMIT_CPU, (soft if hard == resource.RLIM_INFINITY else min(soft, hard), hard))
+
+    def raise_cpu_limit(signum: int, frame: Any) -> None:
+        raise ParseLimitExceeded(f"parsing took more than {cpu_seconds:g}s of CPU time")
+
+    signal.signal(signal.SIGPROF, raise_cpu_limit)
+    signal.setitimer(signal.ITIMER_PROF, cpu_seconds)
+    try:
+        return fn(*args)
+    finally:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+
+
+def create_pool(workers: int, memory_mb: int = PARSE_MEMORY_MB,
+                tasks_per_worker: int = PARSE_TASKS_PER_WORKER) -> ProcessPoolExecutor:
+    """
+    Creates a pool of parsing processes.
+    Args:
+        workers: The number of worker processes.
+        memory_mb: The address space limit of each worker.
+        tasks_per_worker: The number of tasks after which a worker is replaced.
+    Returns:
+        The pool. Workers are spawned rather than forked, because forking a
+        process with threads (like the Streamlit server) can deadlock the child.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"), initializer=_init_worker,
+                               initargs=(memory_mb,), max_tasks_per_child=tasks_per_worker)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = create_pool(PARSE_WORKERS)
+        return _pool
+
+
+def _replace_pool(broken: ProcessPoolExecutor) -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def run(fn: Callable[..., Any], *args: Any) -> Any:
+    """
+    Runs a CPU-bound parsing function in a worker process, so parsing does not
+    hold the GIL of the serving process and scales with the number of cores.
+    Args:
+        fn: A module-level function, so that workers can import it.
+        args: Its arguments; they are pickled, so pass bytes or text, not responses.
+    Returns:
+        The return value of fn.
+    Raises:
+        ParseLimitExceeded: If the task exceeds PARSE_CPU_SECONDS or kills its worker.
+        Exception: Any error raised by fn, e.g. MemoryError at PARSE_MEMORY_MB.
+    """
+    if PARSE_WORKERS <= 0:
+        return fn(*args)
+    # A dying worker breaks the whole pool, failing its other tasks too; those get one retry
+    for attempt in range(2):
+        pool: ProcessPoolExecutor = _get_pool()
+        try:
+            return pool.submit(_run_limited, fn, args, PARSE_CPU_SECONDS).result()
+        except BrokenProcessPool:
+            _replace_pool(pool)
+    raise ParseLimitExceeded("the parsing worker was killed, e.g. for exceeding its CPU or memory limit")
+
+
+def shutdown() -> None:
+    """Stops the worker processes; the next run() starts new ones."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,244 @@
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Set, Union
+
+from modules import citations, gather, llm, tracing
+from modules.cache import normalize_url
+from modules.corpus import Lookup, SessionCorpus
+
+
+@dataclass
+class PipelineResult:
+    """
+    Everything produced while answering one question.
+    web_results and youtube_results are the search hits; web_sources and
+    youtube_sources are the fetched sources in citation order. answer is the raw
+    model output, processed_answer has clickable citations and sources_html is the
+    rendered source list. timings holds seconds per stage: "gather",
+    "time_to_first_token", "generation" and "total". dropped_sources lists the
+    search hits left out because they missed the deadline. When a session corpus
+    is used, search_reports["corpus"] tells how much of it was reused.
+    generation_error is set when a streamed answer failed part way; answer then
+    holds the part that was streamed.
+    """
+    question: str
+    answer: str
+    processed_answer: str
+    sources_section: str
+    sources_html: str
+    web_results: List[Dict[str, str]]
+    youtube_results: List[Dict[str, str]]
+    web_sources: List[Dict[str, Any]]
+    youtube_sources: List[Dict[str, Any]]
+    earliest_timestamps: Dict[int, Dict[str, Union[str, int]]]
+    search_reports: Dict[str, Dict[str, Any]]
+    timings: Dict[str, float]
+    dropped_sources: List[Dict[str, str]] = field(default_factory=list)
+    generation_error: Optional[str] = None
+    trace: Optional[tracing.Trace] = field(default=None, repr=False)
+
+    @property
+    def error(self) -> Optional[str]:
+        """The error message if no complete answer could be generated, otherwise None."""
+        if self.generation_error is not None:
+            return self.generation_error
+        if self.answer.startswith(("Error generating answer", "Error: ")):
+            return self.answer
+        return None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns:
+            A JSON-serializable summary of the result. Source contents and transcripts
+            are left out; each source keeps its citation number, title, URL and
+            whether its content could be fetched.
+        """
+        sources: List[Dict[str, Any]] = []
+        for number, source in enumerate(self.web_sources, 1):
+            sources.append({
+                "number": number,
+                "type": "web",
+                "title": source["title"],
+                "url": source["url"],
+                "fetched": not str(source.get("content", "")).startswith("Error"),
+            })
+        for number, source in enumerate(self.youtube_sources, len(self.web_sources) + 1):
+            sources.append({
+                "number": number,
+                "type": "youtube",
+                "title": source["title"],
+                "url": source["url"],
+                "fetched": not str(source.get("transcript_text", "")).startswith("Error"),
+                "earliest_timestamp": self.earliest_timestamps.get(number, {}).get("timestamp"),
+            })
+        return {
+            "question": self.question,
+            "answer": self.answer,
+            "processed_answer": self.processed_answer,
+            "sources": sources,
+            "search_reports": self.search_reports,
+            "dropped_sources": self.dropped_sources,
+            "timings": {stage: round(seconds, 3) for stage, seconds in self.timings.items()},
+            "trace_id": self.trace.id if self.trace else None,
+            "error": self.error,
+        }
+
+
+def answer_question(question: str, include_web: bool = True, include_youtube: bool = True,
+                    max_web_results: int = 5, max_youtube_results: int = 3,
+                    deadline: Optional[float] = None,
+                    map_reduce: Optional[bool] = None,
+                    corpus: Optional[SessionCorpus] = None,
+                    on_chunk: Optional[Callable[[str], None]] = None,
+                    progress: Callable[[str], ContextManager] = nullcontext) -> PipelineResult:
+    """
+    Answers a question end to end: searches, fetches the sources, generates the
+    answer and links its citations. Runs without Streamlit, e.g. from scripts or
+    the batch runner; the app passes callbacks to render progress.
+    Args:
+        question: The question to answer.
+        include_web: Whether to use web sources.
+        include_youtube: Whether to use YouTube sources.
+        max_web_results: The maximum number of web pages to fetch.
+        max_youtube_results: The maximum number of YouTube videos to fetch.
+        deadline: Seconds the search and fetch stage may take before slow sources
+                  are dropped. Defaults to gather.QUESTION_DEADLINE_SECONDS.
+        map_reduce: Whether to extract facts per source before answering, see
+                    llm.generate_answer. Defaults to on for many sources.
+        corpus: The sources of the session's earlier questions. If it covers the
+                question, it is answered from the corpus without searching;
+                otherwise the relevant stored sources are reused and only the
+                remaining slots are searched and fetched. New sources are added to it.
+        on_chunk: If given, the answer is streamed and this is called with each newly
+                  completed part of the answer, with clickable citations.
+        progress: Called with a status message around each slow stage; the returned
+                  context manager is entered for the stage, e.g. st.spinner.
+    Returns:
+        The PipelineResult. Generation errors are reported in PipelineResult.error.
+    """
+    timings: Dict[str, float] = {}
+    start: float = time.perf_counter()
+    with tracing.trace(question) as question_trace:
+        with progress("Searching for information..."), tracing.span("gather"):
+            # Search and fetch concurrently; sources come back in ranked order
+            gathered: Dict[str, Any] = _gather_with_corpus(
+                question, include_web, include_youtube, max_web_results, max_youtube_results, deadline, corpus
+            )
+        web_sources: List[Dict[str, Any]] = gathered["web_sources"]
+        youtube_sources: List[Dict[str, Any]] = gathered["youtube_sources"]
+        timings["gather"] = time.perf_counter() - start
+
+        generation_start: float = time.perf_counter()
+        generation_error: Optional[str] = None
+        with progress("Generating answer..."):
+            if on_chunk is None:
+                answer: str = llm.generate_answer(question, web_sources, youtube_sources, map_reduce)
+            else:
+                # Link citations one complete sentence at a time while the answer streams
+                citation_stream: citations.CitationStream = citations.CitationStream(web_sources, youtube_sources)
+                try:
+                    for chunk in llm.stream_answer(question, web_sources, youtube_sources, map_reduce):
+                        if "time_to_first_token" not in timings:
+                            timings["time_to_first_token"] = time.perf_counter() - generation_start
+                        on_chunk(citation_stream.feed(chunk))
+                except llm.GenerationError as e:
+                    generation_error = str(e)
+                on_chunk(citation_stream.flush())
+                answer = citation_stream.text or generation_error or ""
+        timings.setdefault("time_to_first_token", time.perf_counter() - generation_start)
+        timings["generation"] = time.perf_counter() - generation_start
+
+        result: PipelineResult = link_answer(question, gathered, answer, timings)
+        result.generation_error = generation_error
+        result.trace = question_trace
+    timings["total"] = time.perf_counter() - start
+    return result
+
+
+def _gather_with_corpus(question: str, include_web: bool, include_youtube: bool, max_web_results: int,
+                        max_youtube_results: int, deadline: Optional[float],
+                        corpus: Optional[SessionCorpus]) -> Dict[str, Any]:
+    """
+    Gathers the sources for a question, taking what it can from the session corpus.
+    Returns:
+        The same dictionary as gather.gather_sources. Reused sources follow the new
+        ones of their type, so citations are numbered over exactly the sources sent.
+    """
+    if corpus is None:
+        return gather.gather_sources(question, include_web=include_web, include_youtube=include_youtube,
+                                     max_web_results=max_web_results, max_youtube_results=max_youtube_results,
+                                     deadline=deadline)
+    with tracing.span("corpus.lookup") as lookup_span:
+        found: Lookup = corpus.lookup(question, include_web, include_youtube, max_web_results, max_youtube_results)
+        lookup_span.set(sources=len(corpus), coverage=round(found.coverage, 2), covered=found.covered)
+    report: Dict[str, Any] = {"coverage": round(found.coverage, 2), "searched": not found.covered}
+    if found.covered:
+        report["reused"] = len(found.web_sources) + len(found.youtube_sources)
+        return {
+            "web_results": [],
+            "web_sources": found.web_sources,
+            "youtube_results": [],
+            "youtube_sources": found.youtube_sources,
+            "search_reports": {"corpus": report},
+            "dropped_sources": [],
+        }
+
+    # Part of the question is not in the corpus: leave at least one slot per type to new sources
+    reused_web: List[Dict[str, Any]] = found.web_sources[:max(0, max_web_results - 1)]
+    reused_youtube: List[Dict[str, Any]] = found.youtube_sources[:max(0, max_youtube_results - 1)]
+    gathered: Dict[str, Any] = gather.gather_sources(
+        question,
+        include_web=include_web,
+        include_youtube=include_youtube,
+        max_web_results=max_web_results - len(reused_web),
+        max_youtube_results=max_youtube_results - len(reused_youtube),
+        deadline=deadline
+    )
+    corpus.add_gathered(gathered)
+    reused_urls: Set[str] = {normalize_url(source["url"]) for source in reused_web + reused_youtube}
+    gathered["web_sources"] = [source for source in gathered["web_sources"]
+                               if normalize_url(source["url"]) not in reused_urls] + reused_web
+    gathered["youtube_sources"] = [source for source in gathered["youtube_sources"]
+                                   if normalize_url(source["url"]) not in reused_urls] + reused_youtube
+    report["reused"] = len(reused_web) + len(reused_youtube)
+    gathered["search_reports"]["corpus"] = report
+    return gathered
+
+
+def link_answer(question: str, gathered: Dict[str, Any], answer: str, timings: Dict[str, float]) -> PipelineResult:
+    """
+    Links the citations of a generated answer and collects the PipelineResult.
+    Shared by answer_question and the HTTP service.
+    Args:
+        question: The question that was answered.
+        gathered: The return value of gather.gather_sources.
+        answer: The generated answer text.
+        timings: The stage timings so far, see PipelineResult.
+    Returns:
+        The PipelineResult, without a trace.
+    """
+    web_sources: List[Dict[str, Any]] = gathered["web_sources"]
+    youtube_sources: List[Dict[str, Any]] = gathered["youtube_sources"]
+    with tracing.span("citations.process"):
+        processed_answer, sources_section, earliest_timestamps = citations.process_citations(
+            answer, web_sources, youtube_sources
+        )
+    with tracing.span("citations.sources_list"):
+        sources_html: str = citations.create_sources_list(web_sources, youtube_sources, earliest_timestamps)
+
+    return PipelineResult(
+        question=question,
+        answer=answer,
+        processed_answer=processed_answer,
+        sources_section=sources_section,
+        sources_html=sources_html,
+        web_results=gathered["web_results"],
+        youtube_results=gathered["youtube_results"],
+        web_sources=web_sources,
+        youtube_sources=youtube_sources,
+        earliest_timestamps=earliest_timestamps,
+        search_reports=gathered["search_reports"],
+        timings=timings,
+        dropped_sources=gathered.get("dropped_sources", []),
+    )
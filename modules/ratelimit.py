@@ -0,0 +1,411 @@
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from modules import cache, tracing
+
+
+# Backends that are rate limited, with their requests per second from the
+# environment, e.g. GEMINI_RATE_LIMIT=0.25. Unset means unlimited.
+PROVIDERS: Tuple[str, ...] = ("duckduckgo", "serpapi", "youtube", "youtube_transcript", "gemini")
+
+# Callers with a lower number are served first when they wait for the same backend
+INTERACTIVE: int = 0
+BATCH: int = 1
+
+# Daily quota units each operation costs. YouTube charges 100 units for search.list
+# and 1 for videos.list; SerpAPI and Gemini count requests.
+QUOTA_COSTS: Dict[str, Dict[str, int]] = {
+    "youtube": {"search.list": 100, "videos.list": 1},
+    "serpapi": {"search": 1},
+    "gemini": {"generate_content": 1},
+}
+# Daily quota units by provider, e.g. YOUTUBE_DAILY_QUOTA=10000. Unset means unlimited.
+DEFAULT_DAILY_QUOTAS: Dict[str, str] = {"youtube": "10000"}
+# Share of a daily quota that batch callers may use, keeping the rest for interactive questions
+BATCH_QUOTA_SHARE: float = float(os.getenv("BATCH_QUOTA_SHARE", "0.8"))
+# Quotas reset at midnight Pacific Time (YouTube); daylight saving time is ignored
+QUOTA_UTC_OFFSET_HOURS: float = float(os.getenv("QUOTA_UTC_OFFSET_HOURS", "-8"))
+
+# Retries of calls rejected with HTTP 429, with full-jitter exponential backoff
+MAX_RETRIES: int = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "3"))
+RETRY_BASE_SECONDS: float = 1.0
+RETRY_MAX_SECONDS: float = 30.0
+# A 429 halves a backend's rate down to this share of its configured rate
+MIN_RATE_SHARE: float = 0.125
+
+
+class QuotaExceeded(Exception):
+    """Raised instead of calling a backend whose daily quota is used up."""
+
+
+class RateLimiter:
+    """
+    A thread-safe token bucket that spaces out calls to one backend.
+    Args:
+        rate: The sustained number of calls (or tokens, see acquire) per second.
+        burst: The number of calls that may be made back to back after an idle period.
+        clock: Returns the current time in seconds; tests pass a fake clock.
+        sleep: Waits for a number of seconds; tests pass a fake sleep.
+    """
+
+    def __init__(self, rate: float, burst: int = 1, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.max_rate = rate
+        self.burst = max(1, burst)
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens: float = float(self.burst)
+        self._updated: float = clock()
+        self._cond = threading.Condition()
+        self._waiting: List[Tuple[int, int]] = []
+        self._tickets: Iterator[int] = itertools.count()
+
+    def _refill(self) -> None:
+        now: float = self._clock()
+        self._tokens = min(float(self.burst), self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, cost: float = 1.0, priority: int = INTERACTIVE) -> float:
+        """
+        Blocks until a call may be made. Waiting callers are served by priority,
+        and in the order they arrived within a priority.
+        Args:
+            cost: The tokens the call takes, e.g. its prompt tokens for a token
+                  limit. A cost above the burst waits for a full bucket and leaves
+                  it in debt, so large calls are slowed down but never starved.
+            priority: INTERACTIVE or BATCH.
+        Returns:
+            The number of seconds waited.
+        """
+        start: float = self._clock()
+        ticket: Tuple[int, int] = (priority, next(self._tickets))
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    self._refill()
+                    if self._waiting[0] != ticket:
+                        self._cond.wait()
+                        continue
+                    needed: float = min(cost, float(self.burst))
+                    if self._tokens >= needed:
+                        self._tokens -= cost
+                        return self._clock() - start
+                    # Sleep without the lock, so a higher-priority caller can take the head
+                    self._cond.release()
+                    try:
+                        self._sleep((needed - self._tokens) / self.rate)
+                    finally:
+                        self._cond.acquire()
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+
+    def slow_down(self) -> None:
+        """Halves the rate after the backend rejected a call, down to MIN_RATE_SHARE of the configured rate."""
+        with self._cond:
+            self.rate = max(self.max_rate * MIN_RATE_SHARE, self.rate / 2)
+
+    def speed_up(self) -> None:
+        """Raises the rate by a twentieth of the configured rate after a successful call."""
+        with self._cond:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class QuotaLedger:
+    """
+    Counts the quota units spent on each backend per day. With a path, the counts
+    are kept in SQLite by day, so that every process on the host (the app, the
+    service workers, the batch runner) draws on the same quota and a restart does
+    not reset it; otherwise they are kept in memory for this process only.
+    Args:
+        limits: Daily quota units by provider; providers without one are only counted.
+        clock: Returns the current Unix time; tests pass a fake clock.
+        utc_offset_hours: The UTC offset of the time zone whose midnight resets the quotas.
+        path: The SQLite file to keep the counts in.
+    """
+
+    def __init__(self, limits: Dict[str, int], clock: Callable[[], float] = time.time,
+                 utc_offset_hours: float = QUOTA_UTC_OFFSET_HOURS, path: Optional[str] = None):
+        self.limits = dict(limits)
+        self.path = path
+        self._clock = clock
+        self._offset: float = utc_offset_hours * 3600
+        self._day: int = self._today()
+        self._used: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        if path is not None:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            with cache.connect(path) as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("CREATE TABLE IF NOT EXISTS quota ("
+                             " day INTEGER NOT NULL, provider TEXT NOT NULL, used INTEGER NOT NULL,"
+                             " PRIMARY KEY (day, provider))")
+                conn.execute("DELETE FROM quota WHERE day < ?", (self._day - 1,))
+
+    def _today(self) -> int:
+        return int((self._clock() + self._offset) // 86400)
+
+    def _roll_over(self) -> None:
+        today: int = self._today()
+        if today != self._day:
+            self._day = today
+            self._used = {}
+
+    def charge(self, provider: str, units: int, priority: int = INTERACTIVE) -> None:
+        """
+        Records a call's quota units before it is made.
+        Args:
+            provider: The backend name, e.g. "youtube".
+            units: The quota units of the call, see QUOTA_COSTS.
+            priority: BATCH callers may only use BATCH_QUOTA_SHARE of the quota.
+        Raises:
+            QuotaExceeded: If the call does not fit in what is left of the quota.
+        """
+        limit: Optional[int] = self.limits.get(provider)
+        allowed: float = float("inf") if limit is None else limit
+        if priority != INTERACTIVE:
+            allowed *= BATCH_QUOTA_SHARE
+        with self._lock:
+            self._roll_over()
+            if self.path is None:
+                used: int = self._used.get(provider, 0)
+                if used + units > allowed:
+                    raise QuotaExceeded(f"{provider} daily quota exhausted ({used} of {limit} units used)")
+                self._used[provider] = used + units
+                return
+            with cache.connect(self.path) as conn:
+                # Checked and added in one statement, so processes charging at once cannot overspend
+                charged: bool = units <= allowed and conn.execute(
+                    "INSERT INTO quota (day, provider, used) VALUES (?, ?, ?)"
+                    " ON CONFLICT (day, provider) DO UPDATE SET used = used + excluded.used"
+                    " WHERE used + excluded.used <= ?",
+                    (self._day, provider, units, min(allowed, 2.0 ** 62))
+                ).rowcount > 0
+                if not charged:
+                    used = self._stored(conn).get(provider, 0)
+                    raise QuotaExceeded(f"{provider} daily quota exhausted ({used} of {limit} units used)")
+
+    def exhaust(self, provider: str) -> None:
+        """Marks a quota as used up for the rest of the day, e.g. when the backend says so."""
+        with self._lock:
+            self._roll_over()
+            if provider not in self.limits:
+                return
+            if self.path is None:
+                self._used[provider] = max(self._used.get(provider, 0), self.limits[provider])
+                return
+            with cache.connect(self.path) as conn:
+                conn.execute(
+                    "INSERT INTO quota (day, provider, used) VALUES (?, ?, ?)"
+                    " ON CONFLICT (day, provider) DO UPDATE SET used = max(used, excluded.used)",
+                    (self._day, provider, self.limits[provider])
+                )
+
+    def usage(self) -> Dict[str, Dict[str, Optional[int]]]:
+        """
+        Returns:
+            The units used today and the daily limit of every provider that has either.
+        """
+        with self._lock:
+            self._roll_over()
+            if self.path is None:
+                used: Dict[str, int] = self._used
+            else:
+                with cache.connect(self.path) as conn:
+                    used = self._stored(conn)
+            return {provider: {"used": used.get(provider, 0), "limit": self.limits.get(provider)}
+                    for provider in sorted(set(used) | set(self.limits))}
+
+    def _stored(self, conn: Any) -> Dict[str, int]:
+        return dict(conn.execute("SELECT provider, used FROM quota WHERE day = ?", (self._day,)).fetchall())
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_token_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+_ledger: Optional[QuotaLedger] = None
+_priority: ContextVar[int] = ContextVar("ratelimit_priority", default=INTERACTIVE)
+# Replaced by tests to run retries on a simulated clock
+_sleep: Callable[[float], None] = time.sleep
+_random: random.Random = random.Random()
+
+
+def _rate_from_env(provider: str) -> Optional[float]:
+    value: str = os.getenv(f"{provider.upper()}_RATE_LIMIT", "")
+    return float(value) if value else None
+
+
+def configure(rates: Dict[str, Optional[float]]) -> None:
+    """
+    Sets the requests per second of backends for the rest of the process,
+    e.g. configure({"gemini": 0.25, "duckduckgo": 1}). None removes a limit.
+    Args:
+        rates: Requests per second by provider name.
+    """
+    with _limiters_lock:
+        for provider, rate in rates.items():
+            if rate:
+                _limiters[provider] = RateLimiter(rate)
+            else:
+                _limiters.pop(provider, None)
+
+
+def get_limiter(provider: str) -> Optional[RateLimiter]:
+    """
+    Args:
+        provider: The backend name, e.g. "gemini".
+    Returns:
+        The limiter of the backend, or None if it is not rate limited.
+    """
+    with _limiters_lock:
+        if provider not in _limiters:
+            rate: Optional[float] = _rate_from_env(provider)
+            if not rate:
+                return None
+            _limiters[provider] = RateLimiter(rate)
+        return _limiters[provider]
+
+
+def get_token_limiter(provider: str) -> Optional[RateLimiter]:
+    """
+    Args:
+        provider: The backend name, e.g. "gemini".
+    Returns:
+        The tokens-per-minute limiter of the backend, set with e.g.
+        GEMINI_TOKENS_PER_MINUTE=1000000, or None if it has none.
+    """
+    with _limiters_lock:
+        if provider not in _token_limiters:
+            value: str = os.getenv(f"{provider.upper()}_TOKENS_PER_MINUTE", "")
+            if not value:
+                return None
+            # A full minute of tokens may be used at once, as in a per-minute window
+            _token_limiters[provider] = RateLimiter(float(value) / 60, burst=int(float(value)))
+        return _token_limiters[provider]
+
+
+def get_ledger() -> QuotaLedger:
+    """
+    Returns:
+        The quota ledger, with limits from e.g. YOUTUBE_DAILY_QUOTA, kept under
+        CACHE_DIR and shared by the processes that use it.
+    """
+    global _ledger
+    with _limiters_lock:
+        if _ledger is None:
+            limits: Dict[str, int] = {}
+            for provider in PROVIDERS:
+                value: str = os.getenv(f"{provider.upper()}_DAILY_QUOTA", DEFAULT_DAILY_QUOTAS.get(provider, ""))
+                if value:
+                    limits[provider] = int(value)
+            _ledger = QuotaLedger(limits, path=os.path.join(cache.CACHE_DIR, "quota.sqlite3"))
+        return _ledger
+
+
+@contextmanager
+def prioritized(priority: int) -> Iterator[None]:
+    """
+    Sets the priority of every rate-limited call made in this context, including
+    calls from worker threads that copy the context.
+    Args:
+        priority: INTERACTIVE or BATCH.
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def wait_for(provider: str, tokens: int = 0) -> None:
+    """
+    Blocks until the next call to a backend is allowed by its rate limits, if it has any.
+    Args:
+        provider: The backend name, e.g. "gemini".
+        tokens: The tokens the call uses, counted against a tokens-per-minute limit.
+    """
+    waited: float = 0.0
+    limiter: Optional[RateLimiter] = get_limiter(provider)
+    if limiter is not None:
+        waited += limiter.acquire(priority=_priority.get())
+    token_limiter: Optional[RateLimiter] = get_token_limiter(provider) if tokens else None
+    if token_limiter is not None:
+        waited += token_limiter.acquire(tokens, priority=_priority.get())
+    if waited > 0.001:
+        tracing.annotate(rate_limited_ms=round(waited * 1000, 2))
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """
+    Recognizes a rate-limit rejection from any of the client libraries.
+    Args:
+        error: The exception raised by a backend call.
+    Returns:
+        The seconds the backend asked to wait (0.0 if it did not say), or None if
+        the error is not an HTTP 429.
+    """
+    # requests raises with .response, googleapiclient with .resp, google.api_core with .code
+    response: Any = getattr(error, "response", None)
+    status: Any = getattr(response, "status_code", None) or getattr(getattr(error, "resp", None), "status", None) \
+        or getattr(error, "code", None)
+    if str(status) != "429":
+        return None
+    headers: Any = getattr(response, "headers", None) or getattr(error, "resp", None) or {}
+    try:
+        return float(headers.get("Retry-After") or headers.get("retry-after") or 0)
+    except (AttributeError, ValueError):
+        return 0.0
+
+
+def call(provider: str, operation: str, fn: Callable[[], Any], tokens: int = 0) -> Any:
+    """
+    Calls a backend through its rate limits and daily quota, retrying HTTP 429
+    rejections with jittered exponential backoff. Each rejection also halves the
+    backend's request rate, and successes restore it gradually, so throughput
+    settles below the backend's limit instead of failing in bursts.
+    Args:
+        provider: The backend name, e.g. "youtube".
+        operation: The operation, whose quota units are looked up in QUOTA_COSTS.
+        fn: Makes the call.
+        tokens: The tokens the call uses, see wait_for.
+    Returns:
+        The result of fn.
+    Raises:
+        QuotaExceeded: If the daily quota of the backend is used up.
+    """
+    units: int = QUOTA_COSTS.get(provider, {}).get(operation, 1)
+    for attempt in range(MAX_RETRIES + 1):
+        wait_for(provider, tokens)
+        get_ledger().charge(provider, units, _priority.get())
+        limiter: Optional[RateLimiter] = get_limiter(provider)
+        try:
+            result: Any = fn()
+        except Exception as e:
+            if "quotaExceeded" in str(e):
+                get_ledger().exhaust(provider)
+                raise QuotaExceeded(f"{provider} daily quota exhausted") from e
+            asked: Optional[float] = retry_after(e)
+            if asked is None or attempt == MAX_RETRIES:
+                raise
+            if limiter is not None:
+                limiter.slow_down()
+            backoff: float = _random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt))
+            tracing.annotate(rate_limit_retries=attempt + 1)
+            _sleep(max(asked, backoff))
+            continue
+        if limiter is not None:
+            limiter.speed_up()
+        return result
@@ -0,0 +1,241 @@
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Set, Tuple, Union
+
+import numpy as np
+
+from modules.transcripts import Transcript, format_timestamp
+
+
+PROMPT_TOKEN_BUDGET: int = int(os.getenv("PROMPT_TOKEN_BUDGET", "10000"))
+CHUNK_CHARS: int = 800
+
+# Rough characters-per-token ratio for English text with Gemini's tokenizer
+CHARS_PER_TOKEN: int = 4
+# Weight of the search engine's own order when ranking hits by their snippets;
+# the best snippet match scores 1, the engine's first hit gets this much on top
+SEARCH_RANK_WEIGHT: float = float(os.getenv("SEARCH_RANK_WEIGHT", "0.5"))
+
+_TOKEN_PATTERN: re.Pattern[str] = re.compile(r"\w+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it of on or that the this to was "
+    "what when where which who why will with you your".split()
+)
+
+
+@dataclass
+class Chunk:
+    """A passage of one source."""
+    source: int
+    position: int
+    text: str
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Args:
+        text: The text to tokenize.
+    Returns:
+        The lowercased word tokens of text, without stopwords.
+    """
+    return [token for token in _TOKEN_PATTERN.findall(text.lower()) if token not in _STOPWORDS]
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Args:
+        text: The text to measure.
+    Returns:
+        The approximate number of model tokens in text.
+    """
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def chunk_text(text: str, chunk_chars: int = CHUNK_CHARS) -> List[str]:
+    """
+    Splits page text into passages of about chunk_chars, keeping paragraphs whole
+    where they fit.
+    Args:
+        text: The extracted page text.
+        chunk_chars: The target passage length.
+    Returns:
+        The passages in document order.
+    """
+    chunks: List[str] = []
+    current: List[str] = []
+    length: int = 0
+    for paragraph in (line.strip() for line in text.splitlines()):
+        if not paragraph:
+            continue
+        # Hard-split paragraphs that alone exceed the target, at sentence ends where possible
+        while len(paragraph) > chunk_chars:
+            cut: int = paragraph.rfind(". ", 0, chunk_chars) + 1 or chunk_chars
+            if current:
+                chunks.append("\n".join(current))
+                current, length = [], 0
+            chunks.append(paragraph[:cut].strip())
+            paragraph = paragraph[cut:].strip()
+        if length + len(paragraph) > chunk_chars and current:
+            chunks.append("\n".join(current))
+            current, length = [], 0
+        if paragraph:
+            current.append(paragraph)
+            length += len(paragraph) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def chunk_transcript(transcript: Transcript, chunk_chars: int = CHUNK_CHARS) -> List[str]:
+    """
+    Splits a transcript into windows of consecutive segments, each line keeping its
+    [mm:ss] timestamp so the model can cite it.
+    Args:
+        transcript: The transcript.
+        chunk_chars: The target window length.
+    Returns:
+        The windows in time order.
+    """
+    chunks: List[str] = []
+    current: List[str] = []
+    length: int = 0
+    for i in range(len(transcript)):
+        line: str = f"[{format_timestamp(transcript.starts[i])}] {transcript.segment_text(i)}"
+        if length + len(line) > chunk_chars and current:
+            chunks.append("\n".join(current))
+            current, length = [], 0
+        current.append(line)
+        length += len(line) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+class BM25Index:
+    """
+    An in-memory Okapi BM25 index over passages, stored as NumPy arrays of
+    (passage, term, count) postings.
+    Args:
+        texts: The passages to index.
+        k1: The term frequency saturation parameter.
+        b: The length normalization parameter.
+    """
+
+    def __init__(self, texts: Sequence[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocabulary: Dict[str, int] = {}
+        doc_ids: List[int] = []
+        term_ids: List[int] = []
+        counts: List[int] = []
+        lengths: List[int] = []
+        for doc, text in enumerate(texts):
+            tokens: List[str] = tokenize(text)
+            lengths.append(len(tokens))
+            term_counts: Dict[int, int] = {}
+            for token in tokens:
+                term: int = self.vocabulary.setdefault(token, len(self.vocabulary))
+                term_counts[term] = term_counts.get(term, 0) + 1
+            doc_ids.extend([doc] * len(term_counts))
+            term_ids.extend(term_counts.keys())
+            counts.extend(term_counts.values())
+        self.doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        self.term_ids = np.asarray(term_ids, dtype=np.int64)
+        self.counts = np.asarray(counts, dtype=np.float64)
+        self.lengths = np.asarray(lengths, dtype=np.float64)
+        n_docs: int = len(texts)
+        document_frequency = np.bincount(self.term_ids, minlength=len(self.vocabulary))
+        self.idf = np.log1p((n_docs - document_frequency + 0.5) / (document_frequency + 0.5))
+        average_length: float = float(self.lengths.mean()) if n_docs and self.lengths.mean() > 0 else 1.0
+        self._norm = self.k1 * (1 - self.b + self.b * self.lengths / average_length)
+
+    def score(self, query: str) -> np.ndarray:
+        """
+        Args:
+            query: The query text.
+        Returns:
+            The BM25 score of every passage, in index order.
+        """
+        scores = np.zeros(len(self.lengths), dtype=np.float64)
+        query_terms = {self.vocabulary[token] for token in tokenize(query) if token in self.vocabulary}
+        if not query_terms:
+            return scores
+        mask = np.isin(self.term_ids, list(query_terms))
+        docs = self.doc_ids[mask]
+        tf = self.counts[mask]
+        weights = self.idf[self.term_ids[mask]] * tf * (self.k1 + 1) / (tf + self._norm[docs])
+        np.add.at(scores, docs, weights)
+        return scores
+
+
+def rank_hits(question: str, texts: Sequence[str], rank_weight: float = SEARCH_RANK_WEIGHT) -> List[int]:
+    """
+    Orders search hits by how likely their pages are to answer a question, before
+    any page is fetched: the BM25 score of each hit's title and snippet, scaled so
+    the best hit scores 1, plus a bonus that falls with the engine's own rank.
+    Args:
+        question: The question searched for.
+        texts: The title and snippet of each hit, in the engine's order.
+        rank_weight: The bonus of the engine's first hit; 0 ignores the engine's order.
+    Returns:
+        The indices of the hits, best first. Ties keep the engine's order.
+    """
+    if not texts:
+        return []
+    scores: np.ndarray = BM25Index(texts).score(question)
+    best: float = float(scores.max())
+    if best > 0:
+        scores = scores / best
+    value: List[float] = [float(scores[i]) + rank_weight * (1 - i / len(texts)) for i in range(len(texts))]
+    return sorted(range(len(texts)), key=lambda i: (-value[i], i))
+
+
+def select_passages(question: str, source_texts: List[Optional[Union[Transcript, str]]],
+                    token_budget: int = PROMPT_TOKEN_BUDGET) -> List[str]:
+    """
+    Picks the passages most relevant to a question across all sources until the
+    token budget is filled. Every source that has text gets at least its best
+    passage, so no numbered source is left empty.
+    Args:
+        question: The question to answer.
+        source_texts: The text of each source in citation order: page text, or a
+                      Transcript for YouTube sources.
+        token_budget: The approximate number of tokens of passages to select.
+    Returns:
+        For each source, its selected passages in document order, separated by "..." lines.
+    """
+    chunks: List[Chunk] = []
+    for source, text in enumerate(source_texts):
+        if isinstance(text, Transcript):
+            pieces: List[str] = chunk_transcript(text)
+        else:
+            pieces = chunk_text(text or "")
+        chunks.extend(Chunk(source, position, piece) for position, piece in enumerate(pieces))
+    if not chunks:
+        return ["" for _ in source_texts]
+
+    scores: np.ndarray = BM25Index([chunk.text for chunk in chunks]).score(question)
+    # Best first; ties (e.g. no matching terms) keep earlier passages first
+    ranking: List[int] = sorted(range(len(chunks)), key=lambda i: (-scores[i], chunks[i].position, chunks[i].source))
+
+    selected: Set[int] = set()
+    covered: Set[int] = set()
+    used: int = 0
+    for i in ranking:
+        if chunks[i].source not in covered:
+            covered.add(chunks[i].source)
+            selected.add(i)
+            used += estimate_tokens(chunks[i].text)
+    for i in ranking:
+        if used >= token_budget:
+            break
+        cost: int = estimate_tokens(chunks[i].text)
+        if i not in selected and used + cost <= token_budget:
+            selected.add(i)
+            used += cost
+
+    passages: List[List[Tuple[int, str]]] = [[] for _ in source_texts]
+    for i in selected:
+        passages[chunks[i].source].append((chunks[i].position, chunks[i].text))
+    return ["\n...\n".join(text for _, text in sorted(source_passages)) for source_passages in passages]
@@ -1,94 +1,371 @@
-import newspaper
+import importlib.util
+import io
+import os
+import re
 import requests
 from bs4 import BeautifulSoup
-from youtube_transcript_api import YouTubeTranscriptApi
-from typing import List, Dict, Union
+from modules import breaker, http, parsing, ratelimit, singleflight, tracing
+from modules.cache import CachedContent, ContentCache, get_content_cache, normalize_url
+from modules.transcripts import Transcript, TranscriptStore, get_transcript_store
+from typing import Iterator, List, Dict, Optional, Tuple, Union
 
-    
-def extract_web_content(url: str) -> str:
+
+# Stored in the content cache as is: bump cache.CONTENT_CACHE_VERSION when changing it
+MAX_CONTENT_CHARS: int = 100000
+# Downloads stop at these sizes, so memory per fetch is bounded however large the document is
+MAX_HTML_BYTES: int = int(os.getenv("MAX_HTML_BYTES", str(3 * 1024 * 1024)))
+MAX_PDF_BYTES: int = int(os.getenv("MAX_PDF_BYTES", str(20 * 1024 * 1024)))
+DOWNLOAD_CHUNK_BYTES: int = 64 * 1024
+# PDFs are only downloaded if the optional pypdf package can read them
+PDF_SUPPORTED: bool = importlib.util.find_spec("pypdf") is not None
+# Concurrent fetches of the same page or transcript share one download. Other processes
+# wait for it and then read the result from the shared content cache or transcript store.
+_page_flights = singleflight.SingleFlight("page", processes="lock")
+_transcript_flights = singleflight.SingleFlight("transcript", processes="lock")
+USER_AGENT: str = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+
+
+def extract_web_content(url: str, coalesce: bool = True) -> str:
     """
     Extracts the main content from a web page.
+    Fresh cached text is returned without downloading or parsing the page. Stale
+    entries are revalidated with a conditional request and reused if unchanged.
+    Concurrent calls for the same URL share one download.
     Args:
         url: The URL of the web page.
+        coalesce: Whether to share a concurrent call's download. A hedged copy of
+                  a slow fetch passes False so that it starts a download of its own.
     Returns:
         The extracted text content, or an error message if extraction fails.
     """
+    with tracing.span("scrape.page", url=url) as page_span:
+        try:
+            if coalesce:
+                text: str = _page_flights.do(normalize_url(url), lambda: _extract_web_content(url))
+            else:
+                text = _extract_web_content(url)
+        except PageFetchError as e:
+            # Built here, not in the shared call: callers coalesced by normalized URL may
+            # have written the URL differently, and each must get an error naming its own
+            text = f"Error extracting content from {url}: {e}"
+            page_span.fail(text)
+        page_span.set(chars=len(text))
+        return text
+
+
+class PageFetchError(Exception):
+    """Raised by a page fetch that failed or was skipped; the message is the reason, without the URL."""
+
+
+def _extract_web_content(url: str) -> str:
+    content_cache: ContentCache = get_content_cache()
+    cached: Optional[CachedContent] = content_cache.get(url)
+    if cached and cached.fresh:
+        tracing.annotate(cache="hit")
+        return cached.text
+
+    # Pages that failed recently and domains that keep failing are not tried again for a while
+    failure_key: Tuple[str, str] = ("page", normalize_url(url))
+    domain: str = breaker.domain_of(url)
+    skipped: Optional[str] = breaker.admit(failure_key, domain)
+    if skipped is not None:
+        tracing.annotate(skipped=skipped)
+        if cached:
+            tracing.annotate(cache="stale")
+            return cached.text
+        raise PageFetchError(skipped)
+
     try:
-        article = newspaper.Article(url)
-        article.download()
-        article.parse()
-    
+        headers: Dict[str, str] = {"User-Agent": USER_AGENT}
+        if cached and cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached and cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+        with http.get_session().get(url, headers=headers, timeout=10, stream=True) as page:
+            if cached and page.status_code == 304:
+                content_cache.refresh(url)
+                breaker.record_success(failure_key, domain)
+                tracing.annotate(cache="revalidated")
+                return cached.text
+            page.raise_for_status()
+            kind, body, truncated = download_document(page)
+            response_headers: Dict[str, str] = page.headers
+        tracing.annotate(cache="stale" if cached else "miss", bytes=len(body), kind=kind, truncated=truncated)
+
+        # Parsing is CPU-bound, so it runs in a worker process; the download stays here
+        with tracing.span("scrape.parse", kind=kind):
+            text: str = parsing.run(parse_document, url, kind, body, response_headers.get("Content-Type", ""))
+        content_cache.put(url, text, etag=response_headers.get("ETag"), last_modified=response_headers.get("Last-Modified"))
+        breaker.record_success(failure_key, domain)
+        return text
+    except Exception as e:
+        breaker.record_failure(failure_key, str(e), breaker.PAGE_FAILURE_TTL_SECONDS, domain,
+                               backend_failed=not _concerns_page_only(e))
+        raise PageFetchError(str(e)) from e
+
+
+def _concerns_page_only(error: Exception) -> bool:
+    # A missing page or an unsupported document says nothing about the rest of the site
+    if isinstance(error, requests.HTTPError):
+        return getattr(error.response, "status_code", None) in (404, 410)
+    return isinstance(error, (ValueError, parsing.ParseLimitExceeded))
+
+
+def parse_document(url: str, kind: str, body: bytes, content_type: str) -> str:
+    """
+    Extracts the text of a downloaded document. Runs in a parsing worker, see parsing.run.
+    Args:
+        url: The URL the document was downloaded from.
+        kind: "html" or "pdf", see sniff_document_kind.
+        body: The downloaded bytes.
+        content_type: The Content-Type header.
+    Returns:
+        The text, truncated to MAX_CONTENT_CHARS.
+    """
+    if kind == "pdf":
+        text: str = extract_pdf_text(body)
+    else:
+        # Decode once; both parsers work on the same downloaded HTML
+        html: str = decode_html(body, content_type)
+
         # Get the main text
-        text: str = article.text
-    
+        text = extract_article_text(url, html)
+
         # If text is empty or very short, try BeautifulSoup as fallback
         if not text or len(text) < 100:
-            headers: Dict[str, str] = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-            }
-            response: requests.Response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
-        
-            soup: BeautifulSoup = BeautifulSoup(response.text, 'html.parser')
-            for script in soup(["script", "style"]):
-                script.extract()
-            text = soup.get_text(separator='\n', strip=True)
-    
-            # Truncate if too long (roughly 8000 tokens)
-        if len(text) > 32000:
-            text = text[:32000] + "..."
-        return text
-    except Exception as e:
-        return f"Error extracting content from {url}: {str(e)}"
+            text = extract_page_text(html)
+
+    # Truncate if too long; passage retrieval picks what reaches the prompt
+    if len(text) > MAX_CONTENT_CHARS:
+        text = text[:MAX_CONTENT_CHARS] + "..."
+    return text
+
 
-def get_video_transcript(video_id: str) -> Union[List[Dict[str, str]], str]:
+def sniff_document_kind(content_type: str, head: bytes) -> Optional[str]:
+    """
+    Decides from the Content-Type header and the first bytes of a download
+    whether it can be extracted.
+    Args:
+        content_type: The Content-Type header, possibly empty.
+        head: The first bytes of the body.
+    Returns:
+        "html" for HTML and plain text, "pdf" for PDF documents, or None for
+        anything else, e.g. images, archives or video.
+    """
+    media_type: str = content_type.split(";")[0].strip().lower()
+    if head.startswith(b"%PDF-"):
+        return "pdf"
+    if media_type and not (media_type.startswith("text/") or media_type in ("application/xhtml+xml", "application/xml")):
+        return None
+    # Servers often mislabel binaries as text/html; NUL bytes never occur in real markup
+    if b"\x00" in head[:1024]:
+        return None
+    return "html"
+
+
+def download_document(response: requests.Response) -> Tuple[str, bytes, bool]:
+    """
+    Reads a streamed response up to the size cap of its kind, rejecting
+    unsupported documents after the first chunk.
+    Args:
+        response: A response requested with stream=True.
+    Returns:
+        A tuple (kind, body, truncated), see sniff_document_kind for kind.
+    Raises:
+        ValueError: If the document is neither HTML nor PDF, is a PDF while pypdf
+                    is not installed, or is a PDF larger than MAX_PDF_BYTES (a
+                    cut-off PDF cannot be parsed).
+    """
+    content_type: str = response.headers.get("Content-Type", "")
+    chunks: Iterator[bytes] = response.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES)
+    head: bytes = next((chunk for chunk in chunks if chunk), b"")
+    kind: Optional[str] = sniff_document_kind(content_type, head)
+    if kind is None:
+        raise ValueError(f"unsupported content type {content_type.split(';')[0] or 'unknown'}")
+    if kind == "pdf" and not PDF_SUPPORTED:
+        raise ValueError("PDF extraction requires the optional pypdf package")
+    limit: int = MAX_PDF_BYTES if kind == "pdf" else MAX_HTML_BYTES
+
+    body: bytearray = bytearray(head)
+    truncated: bool = False
+    for chunk in chunks:
+        if len(body) + len(chunk) > limit:
+            body.extend(chunk[:limit - len(body)])
+            truncated = True
+            break
+        body.extend(chunk)
+    if truncated and kind == "pdf":
+        raise ValueError(f"PDF larger than {MAX_PDF_BYTES} bytes")
+    return kind, bytes(body), truncated
+
+
+_META_CHARSET: re.Pattern[bytes] = re.compile(rb"""<meta[^>]+charset=["']?([\w-]+)""", re.IGNORECASE)
+
+
+def decode_html(body: bytes, content_type: str) -> str:
+    """
+    Decodes downloaded HTML using the charset of the Content-Type header or the
+    page's meta tag, falling back to UTF-8.
+    Args:
+        body: The downloaded bytes.
+        content_type: The Content-Type header.
+    Returns:
+        The HTML text; undecodable bytes are replaced.
+    """
+    match: Optional[re.Match[str]] = re.search(r"charset=[\"']?([\w-]+)", content_type, re.IGNORECASE)
+    charset: Optional[str] = match.group(1) if match else None
+    if charset is None:
+        meta: Optional[re.Match[bytes]] = _META_CHARSET.search(body[:4096])
+        charset = meta.group(1).decode("ascii") if meta else "utf-8"
+    try:
+        return body.decode(charset, errors="replace")
+    except LookupError:
+        return body.decode("utf-8", errors="replace")
+
+
+def extract_pdf_text(data: bytes, max_chars: int = MAX_CONTENT_CHARS) -> str:
+    """
+    Extracts the text of a PDF with pypdf, stopping once max_chars are collected.
+    Args:
+        data: The PDF bytes.
+        max_chars: The number of characters after which later pages are skipped.
+    Returns:
+        The text of the pages, one page per paragraph.
+    Raises:
+        ValueError: If pypdf is not installed.
+    """
+    try:
+        import pypdf
+    except ImportError:
+        raise ValueError("PDF extraction requires the optional pypdf package")
+    reader = pypdf.PdfReader(io.BytesIO(data))
+    pages: List[str] = []
+    length: int = 0
+    for page in reader.pages:
+        text: str = (page.extract_text() or "").strip()
+        if text:
+            pages.append(text)
+            length += len(text)
+        if length >= max_chars:
+            break
+    return "\n\n".join(pages)
+
+
+def extract_article_text(url: str, html: str) -> str:
+    """
+    Extracts the main article text from downloaded HTML with newspaper.
+    Args:
+        url: The URL the HTML was downloaded from.
+        html: The HTML of the page.
+    Returns:
+        The article text, which is empty if newspaper finds no article body.
+    """
+    import newspaper  # imported on first use; it is the slowest import of the app
+    # Images are not used, and fetching them would download each one during parsing,
+    # in the worker processes that must not do network I/O
+    article = newspaper.Article(url, fetch_images=False)
+    article.download(input_html=html)
+    article.parse()
+    return article.text
+
+
+def extract_page_text(html: str) -> str:
+    """
+    Extracts all visible text from HTML with BeautifulSoup, the fallback for pages
+    where newspaper finds no article body.
+    Args:
+        html: The HTML of the page.
+    Returns:
+        The text of the page, one line per text block.
+    """
+    soup: BeautifulSoup = BeautifulSoup(html, 'html.parser')
+    for script in soup(["script", "style"]):
+        script.extract()
+    # Stop collecting once there is more text than is kept
+    lines: List[str] = []
+    length: int = 0
+    for line in soup.stripped_strings:
+        lines.append(line)
+        length += len(line) + 1
+        if length > MAX_CONTENT_CHARS:
+            break
+    return '\n'.join(lines)
+
+
+def get_video_transcript(video_id: str, coalesce: bool = True) -> Union[Transcript, str]:
     """
     Retrieves the transcript of a YouTube video.
+    Transcripts are kept in the persistent transcript store, so each video is
+    fetched from YouTube only once, even by concurrent calls.
     Args:
         video_id: The ID of the YouTube video.
+        coalesce: Whether to share a concurrent call's download, see extract_web_content.
     Returns:
-        A list of dictionaries representing the transcript, where each dictionary
-        contains 'text' and 'start' and 'duration', or an error message if
-        the transcript cannot be fetched.
+        A Transcript, whose segments index like dictionaries with 'text', 'start',
+        'timestamp' and 'timestamp_seconds', or an error message if the
+        transcript cannot be fetched.
     """
+    store: TranscriptStore = get_transcript_store()
+    with tracing.span("transcript.fetch", video_id=video_id) as transcript_span:
+        try:
+            transcript: Optional[Transcript] = store.get(video_id)
+            transcript_span.set(cache="hit" if transcript is not None else "miss")
+            if transcript is None:
+                if coalesce:
+                    transcript = _transcript_flights.do(video_id, lambda: _download_transcript(video_id, store))
+                else:
+                    transcript = _download_transcript(video_id, store)
+            transcript_span.set(segments=len(transcript), bytes=len(transcript.text.encode("utf-8")))
+            return transcript
+        except Exception as e:
+            transcript_span.fail(str(e))
+            return f"Error getting transcript: {str(e)}"
+
+
+# Errors of youtube-transcript-api about one video, not about the service
+VIDEO_ONLY_TRANSCRIPT_ERRORS: Tuple[str, ...] = ("TranscriptsDisabled", "NoTranscriptFound", "NoTranscriptAvailable",
+                                                 "VideoUnavailable", "InvalidVideoId", "AgeRestricted")
+
+
+class TranscriptSkipped(Exception):
+    """Raised instead of fetching a transcript that failed recently, or while the service is failing."""
+
+
+def _download_transcript(video_id: str, store: TranscriptStore) -> Transcript:
+    # Another process may have stored the transcript while this one waited for it
+    transcript: Optional[Transcript] = store.get(video_id)
+    if transcript is not None:
+        return transcript
+    failure_key: Tuple[str, str] = ("transcript", video_id)
+    skipped: Optional[str] = breaker.admit(failure_key, breaker.TRANSCRIPTS)
+    if skipped is not None:
+        tracing.annotate(skipped=skipped)
+        raise TranscriptSkipped(skipped)
     try:
-        transcript_list: YouTubeTranscriptApi = YouTubeTranscriptApi.get_transcript(video_id)
-
-        # Process transcript to include timestamps
-        formatted_transcript: List[Dict[str, str]] = []
-        for entry in transcript_list:
-            start_time = entry['start']
-            text = entry['text']
-            minutes = int(start_time // 60)
-            seconds = int(start_time % 60)
-            timestamp = f"{minutes:02d}:{seconds:02d}"
-            formatted_entry = {
-                'text': text,
-                'start': start_time,
-                'timestamp': timestamp,
-                'timestamp_seconds': start_time
-            }
-            formatted_transcript.append(formatted_entry)
-    
-        return formatted_transcript
+        from youtube_transcript_api import YouTubeTranscriptApi
+        ratelimit.wait_for("youtube_transcript")
+        transcript = Transcript.from_segments(video_id, YouTubeTranscriptApi.get_transcript(video_id))
     except Exception as e:
-        return f"Error getting transcript: {str(e)}"
+        breaker.record_failure(failure_key, str(e).strip().split("\n")[0], breaker.TRANSCRIPT_FAILURE_TTL_SECONDS,
+                               breaker.TRANSCRIPTS, backend_failed=type(e).__name__ not in VIDEO_ONLY_TRANSCRIPT_ERRORS)
+        raise
+    breaker.record_success(failure_key, breaker.TRANSCRIPTS)
+    store.put(transcript)
+    return transcript
 
 
-def format_transcript_text(transcript: List[Dict[str, str]]) -> str:
+def format_transcript_text(transcript: Union[Transcript, List[Dict[str, str]], str]) -> str:
     """
-    Formats a YouTube transcript into a single string.]
+    Formats a YouTube transcript into a single string.
     Args:
-        transcript: A list of transcript segments, where each segment is a
-                    dictionary containing atleast 'text', and 'timestamp'.
+        transcript: A Transcript, or a list of transcript segments where each segment
+                    is a dictionary containing atleast 'text', and 'timestamp'.
     Returns:
         A string containing the concatenated text of the transcript segments.
     """
     if isinstance(transcript, str):  # Error message
         return transcript
+    if isinstance(transcript, Transcript):
+        return transcript.formatted()
 
-    formatted_text = ""
-    for entry in transcript:
-        formatted_text += f"[{entry['timestamp']}] {entry['text']}\n"
-    return formatted_text
-    
\ No newline at end of file
+    return "".join(f"[{entry['timestamp']}] {entry['text']}\n" for entry in transcript)
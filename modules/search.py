@@ -1,41 +1,185 @@
 import streamlit as st
-import requests
 import os
-from duckduckgo_search import DDGS
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from typing import List, Dict
+import re
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from modules import clients, http, ratelimit, singleflight, tracing
+from modules.cache import CachedValue, MemoryCache
+from typing import Any, Callable, Iterator, List, Dict, Optional, Set, Tuple
+
+
+VIDEOS_LIST_BATCH_SIZE: int = 50
+
+# How long results stay fresh, by the provider that answered
+SEARCH_CACHE_TTL_SECONDS: Dict[str, float] = {
+    "duckduckgo": float(os.getenv("DUCKDUCKGO_CACHE_TTL_SECONDS", str(6 * 3600))),
+    "serpapi": float(os.getenv("SERPAPI_CACHE_TTL_SECONDS", str(24 * 3600))),
+    "youtube": float(os.getenv("YOUTUBE_CACHE_TTL_SECONDS", str(24 * 3600))),
+}
+
+_search_cache: MemoryCache = MemoryCache(max_entries=int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "1024")))
+# Concurrent identical searches, here and in other processes, share one provider call
+_search_flights = singleflight.SingleFlight("search", processes="result")
+# Transcript probes of uncaptioned videos, one network round trip each, run side by side
+_probe_pool: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=int(os.getenv("TRANSCRIPT_PROBE_WORKERS", "8")),
+                                                     thread_name_prefix="probe")
+# Background refreshes of stale results; long-lived threads keep their YouTube clients (see clients.youtube)
+_refresh_pool: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=int(os.getenv("SEARCH_REFRESH_WORKERS", "2")),
+                                                       thread_name_prefix="search-refresh")
+_refreshing: Set[Tuple] = set()
+_refreshing_lock = threading.Lock()
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizes a search query so that trivially different spellings share cached results.
+    Args:
+        query: The search query
+    Returns:
+        The query casefolded, with punctuation removed and whitespace collapsed
+    """
+    return " ".join(re.sub(r"[^\w\s]", " ", query.casefold()).split())
+
+
+def _fill_report(report: Optional[Dict[str, Any]], provider: str, cached: bool, stale: bool = False) -> None:
+    if report is not None:
+        report.update({"provider": provider, "cached": cached, "stale": stale})
+
+
+def _refresh_in_background(key: Tuple, refresh: Callable[[], None]) -> None:
+    """
+    Runs a cache refresh on the refresh pool, at most one at a time per key.
+    Args:
+        key: The cache key being refreshed
+        refresh: Fetches fresh results and stores them in the cache
+    """
+    with _refreshing_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+
+    def run() -> None:
+        try:
+            refresh()
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(key)
+    _refresh_pool.submit(run)
 
 
-def search_web(query: str, max_results: int =5) -> List[Dict[str, str]]:
+def search_web(query: str, max_results: int =5, report: Optional[Dict[str, Any]] = None) -> List[Dict[str, str]]:
     """
     Search the web using DuckDuckGo with SerpAPI as a backup
     Args:
         query: The search query
         max_results: Maximum number of results to return
+        report: If given, filled with the 'provider' that answered and whether the
+                results were 'cached' and 'stale'
         
     Returns:
         List of dictionaries containing search results
     """
-    try:
+    return list(iter_web_results(query, max_results, report))
+
+
+def iter_web_results(query: str, max_results: int = 5, report: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, str]]:
+    """
+    Streams web search results from DuckDuckGo as they arrive, with SerpAPI as a backup.
+    Results are cached by normalized query and max_results for the TTL of the
+    provider that answered. Stale results are served while a background
+    refresh runs, and concurrent identical searches share one provider call.
+    Args:
+        query: The search query
+        max_results: Maximum number of results to yield
+        report: If given, filled with the 'provider' that answered and whether the
+                results were 'cached' and 'stale' once the results are exhausted
+
+    Yields:
+        Dictionaries containing the 'title', 'url' and 'snippet' of each result
+    """
+    key: Tuple = ("web", normalize_query(query), max_results)
+    cached: Optional[CachedValue] = _search_cache.get(key)
+    if cached is not None:
+        provider, results = cached.value
+        if not cached.fresh:
+            _refresh_in_background(key, lambda: _refresh_web_results(key, query, max_results))
+        _fill_report(report, provider, cached=True, stale=not cached.fresh)
+        yield from (dict(result) for result in results)
+        return
+
+    def produce() -> Iterator[Tuple[str, Dict[str, str]]]:
+        answered: Dict[str, str] = {}
         results: List[Dict[str, str]] = []
+        for result in _stream_web_results(query, max_results, answered):
+            results.append(result)
+            yield answered["provider"], result
+        _cache_web_results(key, results, answered.get("provider"))
+
+    provider: str = "none"
+    seen: Set[str] = set()
+    for _ in range(3):
+        try:
+            for provider, result in _search_flights.stream(key, produce):
+                if result["url"] not in seen:
+                    seen.add(result["url"])
+                    yield dict(result)
+            break
+        except singleflight.FlightAbandoned:
+            # The search this one shared was stopped early, e.g. at its question's
+            # deadline; search again and skip the results already yielded
+            continue
+    _fill_report(report, provider, cached=False)
+
+
+def _cache_web_results(key: Tuple, results: List[Dict[str, str]], provider: Optional[str] = None) -> None:
+    # Empty result lists usually mean every provider failed, so they are not cached
+    if results and provider:
+        _search_cache.put(key, (provider, results), ttl=SEARCH_CACHE_TTL_SECONDS[provider])
+
+
+def _refresh_web_results(key: Tuple, query: str, max_results: int) -> None:
+    answered: Dict[str, str] = {}
+    results: List[Dict[str, str]] = list(_stream_web_results(query, max_results, answered))
+    _cache_web_results(key, results, answered.get("provider"))
+
+
+def _stream_web_results(query: str, max_results: int, answered: Dict[str, str]) -> Iterator[Dict[str, str]]:
+    """
+    Streams web search results from DuckDuckGo, with SerpAPI as a backup.
+    The backup is only used if DuckDuckGo fails before yielding any result.
+    Args:
+        query: The search query
+        max_results: Maximum number of results to yield
+        answered: Filled with the 'provider' that produced the results
+
+    Yields:
+        Dictionaries containing the 'title', 'url' and 'snippet' of each result
+    """
+    yielded: int = 0
+    try:
+        from duckduckgo_search import DDGS
+        ratelimit.wait_for("duckduckgo")
         with DDGS() as ddgs:
-            search_results: List[Dict[str, str]] = list(ddgs.text(query, max_results=max_results))
-        
-            for result in search_results:
-                results.append({
+            # Iterate instead of list()-ing so callers can act on each hit immediately
+            for result in ddgs.text(query, max_results=max_results):
+                yielded += 1
+                answered["provider"] = "duckduckgo"
+                yield {
                     "title": result.get("title", "No title"),
                     "url": result.get("href", ""),
                     "snippet": result.get("body", "No snippet")
-                })
-        return results
-    
+                }
+                if yielded >= max_results:
+                    return
     except Exception as e:
+        if yielded:
+            return
         try:
-            return search_with_serpapi(query, max_results)
+            answered["provider"] = "serpapi"
+            yield from search_with_serpapi(query, max_results)
         except Exception as e:
             st.error(f"SerpAPI search failed: {str(e)}")
-            return []
     
 def search_with_serpapi(query: str, max_results: int = 5) -> List[Dict[str, str]]:
     """
@@ -59,7 +203,15 @@ def search_with_serpapi(query: str, max_results: int = 5) -> List[Dict[str, str]
         "engine": "google",
         "num": max_results
     }
-    response = requests.get("https://serpapi.com/search", params=params)
+    def fetch() -> requests.Response:
+        response = http.get_session().get("https://serpapi.com/search", params=params, timeout=10)
+        if response.status_code == 429:
+            response.raise_for_status()  # lets the scheduler back off and retry
+        return response
+
+    with tracing.span("search.serpapi") as serpapi_span:
+        response = ratelimit.call("serpapi", "search", fetch)
+        serpapi_span.set(bytes=len(response.content), status_code=response.status_code)
     data = response.json()
     if "organic_results" in data:
         for result in data["organic_results"][:max_results]:
@@ -72,64 +224,146 @@ def search_with_serpapi(query: str, max_results: int = 5) -> List[Dict[str, str]
     return results
 
 
-def search_youtube(query: str, max_results: int = 3) -> List[Dict[str, str]]:
+def search_youtube(query: str, max_results: int = 3, probe_transcripts: bool = True,
+                   report: Optional[Dict[str, Any]] = None) -> List[Dict[str, str]]:
     """
     Searches YouTube using the YouTube Data API v3.
+    Results are cached by normalized query; stale results are served while a
+    background refresh runs.
     Args:
         query: The search query.
         max_results: The maximum number of search results to return.
+        probe_transcripts: Whether to fill remaining slots with videos that are not
+                           flagged as captioned but still have a (e.g. auto-generated)
+                           transcript.
+        report: If given, filled with the 'provider' that answered and whether the
+                results were 'cached' and 'stale'.
         
     Returns:
         A list of dictionaries, where each dictionary represents a video
         and contains the 'id', 'title', and 'url'. Returns an empty list if
         the YouTube API key is missing or if there are no results.
     """
+    key: Tuple = ("youtube", normalize_query(query), max_results, probe_transcripts)
+
+    def fetch_and_cache() -> List[Dict[str, str]]:
+        videos: List[Dict[str, str]] = _search_youtube_uncached(query, max_results, probe_transcripts)
+        if videos:
+            _search_cache.put(key, ("youtube", videos), ttl=SEARCH_CACHE_TTL_SECONDS["youtube"])
+        return videos
+
+    cached: Optional[CachedValue] = _search_cache.get(key)
+    if cached is not None:
+        provider, videos = cached.value
+        if not cached.fresh:
+            _refresh_in_background(key, fetch_and_cache)
+        _fill_report(report, provider, cached=True, stale=not cached.fresh)
+        return [dict(video) for video in videos]
+
+    _fill_report(report, "youtube", cached=False)
+    return [dict(video) for video in _search_flights.do(key, fetch_and_cache)]
+
+
+def _search_youtube_uncached(query: str, max_results: int, probe_transcripts: bool) -> List[Dict[str, str]]:
+    """
+    Searches YouTube, bypassing the result cache. See search_youtube.
+    """
     youtube_api_key: str = os.getenv("YOUTUBE_API_KEY")
     if not youtube_api_key:
         st.error("YouTube API Key not found in environment variables")
         return []
     
+    from googleapiclient.errors import HttpError
     try:
-        youtube = build('youtube', 'v3', developerKey=youtube_api_key)
+        youtube = clients.youtube(youtube_api_key)
     
         # Call the search.list method to retrieve matching videos
-        search_response = youtube.search().list(
-            q=query,
-            part='id,snippet',
-            maxResults=max_results * 2,
-            type='video'
-        ).execute()
+        with tracing.span("youtube.search_list"):
+            search_response = ratelimit.call("youtube", "search.list", youtube.search().list(
+                q=query,
+                part='id,snippet',
+                maxResults=max_results * 2,
+                type='video'
+            ).execute)
     
-        videos: List[Dict[str, str]] = []
+        candidates: List[Dict[str, str]] = []
         for search_result in search_response.get('items', []):
-            if search_result['id']['kind'] == 'youtube#video':
-                video_id = search_result['id']['videoId']
-            
-            # Check if this video has captions/transcripts
-            try:
-                caption_response = youtube.captions().list(
-                    part='snippet',
-                    videoId=video_id
-                ).execute()
-                
-                # Only include videos that have captions
-                if caption_response.get('items', []):
-                    title = search_result['snippet']['title']
-                    video_url = f"https://www.youtube.com/watch?v={video_id}"
-                    
-                    videos.append({
-                        'id': video_id,
-                        'title': title,
-                        'url': video_url
-                    })
-                    
-                    if len(videos) >= max_results:
-                        break
-            except HttpError:
-                # Skip videos where caption check fails
+            if search_result['id']['kind'] != 'youtube#video':
                 continue
-        return videos
-    except HttpError as e:
+            video_id: str = search_result['id']['videoId']
+            candidates.append({
+                'id': video_id,
+                'title': search_result['snippet']['title'],
+                'url': f"https://www.youtube.com/watch?v={video_id}"
+            })
+
+        captioned: Set[str] = get_captioned_video_ids(youtube, [video['id'] for video in candidates])
+
+        # Uncaptioned videos only fill slots left over; they are probed concurrently,
+        # as many at a time as there are free slots, best-ranked first
+        accepted: Set[str] = set(captioned)
+        if probe_transcripts:
+            uncaptioned: List[str] = [video['id'] for video in candidates if video['id'] not in captioned]
+            slots_left: int = max_results - sum(1 for video in candidates if video['id'] in captioned)
+            while slots_left > 0 and uncaptioned:
+                batch: List[str] = uncaptioned[:slots_left]
+                uncaptioned = uncaptioned[slots_left:]
+                with tracing.span("youtube.probe_transcripts", videos=len(batch)):
+                    found: List[str] = [video_id for video_id, listed in zip(batch, _probe_pool.map(has_transcript, batch))
+                                        if listed]
+                accepted.update(found)
+                slots_left -= len(found)
+
+        # Keep search-rank order
+        return [video for video in candidates if video['id'] in accepted][:max_results]
+    except (HttpError, ratelimit.QuotaExceeded) as e:
         st.error(f"Error searching YouTube: {str(e)}")
     return []
 
+
+def get_captioned_video_ids(youtube: Any, video_ids: List[str]) -> Set[str]:
+    """
+    Checks caption availability for many videos with batched videos.list calls.
+    Each call covers up to 50 IDs and costs 1 quota unit, where a captions.list
+    call per video costs 50.
+    Args:
+        youtube: A YouTube Data API v3 client.
+        video_ids: The IDs of the videos to check.
+    Returns:
+        The subset of video_ids whose contentDetails.caption flag is "true".
+        Videos in a batch whose call fails are treated as uncaptioned.
+    """
+    from googleapiclient.errors import HttpError
+    captioned: Set[str] = set()
+    for i in range(0, len(video_ids), VIDEOS_LIST_BATCH_SIZE):
+        batch: List[str] = video_ids[i:i + VIDEOS_LIST_BATCH_SIZE]
+        try:
+            with tracing.span("youtube.videos_list", videos=len(batch)):
+                response = ratelimit.call("youtube", "videos.list", youtube.videos().list(
+                    part='contentDetails',
+                    id=','.join(batch),
+                    maxResults=len(batch)
+                ).execute)
+        except (HttpError, ratelimit.QuotaExceeded):
+            continue
+        for item in response.get('items', []):
+            if item.get('contentDetails', {}).get('caption') == 'true':
+                captioned.add(item['id'])
+    return captioned
+
+
+def has_transcript(video_id: str) -> bool:
+    """
+    Probes whether a transcript can be fetched for a video, including
+    auto-generated ones that the caption flag does not report.
+    Args:
+        video_id: The ID of the YouTube video.
+    Returns:
+        True if at least one transcript is listed for the video.
+    """
+    try:
+        from youtube_transcript_api import YouTubeTranscriptApi
+        ratelimit.wait_for("youtube_transcript")
+        return any(True for _ in YouTubeTranscriptApi.list_transcripts(video_id))
+    except Exception:
+        return False
@@ -0,0 +1,377 @@
+"""
+Asyncio JSON HTTP service that answers questions with the same flow as the app:
+search, fetch sources, generate the answer and link its citations.
+
+Questions beyond the concurrency limit wait in a bounded queue; when the queue
+is full the service answers 429 with a Retry-After header instead of piling up
+work. Every backend (search, page fetches, transcripts, Gemini) has its own
+concurrency limit, and page fetches share one pool of keep-alive connections.
+
+Usage:
+    python -m modules.service --host 0.0.0.0 --port 8000
+    curl -X POST localhost:8000/answer -H 'Content-Type: application/json' \\
+        -d '{"question": "How do solar panels work?"}'
+"""
+import argparse
+import asyncio
+import contextvars
+import functools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import uvicorn
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from modules import breaker, gather, http, llm, pipeline, ratelimit, scraper, search, singleflight, tracing
+
+
+SERVICE_MAX_IN_FLIGHT: int = int(os.getenv("SERVICE_MAX_IN_FLIGHT", "16"))
+SERVICE_MAX_QUEUED: int = int(os.getenv("SERVICE_MAX_QUEUED", "64"))
+SERVICE_WORKER_THREADS: int = int(os.getenv("SERVICE_WORKER_THREADS", "64"))
+# Upper limits of a request's options, as in the app's sliders; larger values are lowered to them
+SERVICE_MAX_WEB_RESULTS: int = int(os.getenv("SERVICE_MAX_WEB_RESULTS", "30"))
+SERVICE_MAX_YOUTUBE_RESULTS: int = int(os.getenv("SERVICE_MAX_YOUTUBE_RESULTS", "10"))
+SERVICE_MAX_DEADLINE_SECONDS: float = float(os.getenv("SERVICE_MAX_DEADLINE_SECONDS", "120"))
+
+# Calls allowed at the same time per backend, across all questions
+BACKEND_CONCURRENCY: Dict[str, int] = {
+    "search": int(os.getenv("SERVICE_SEARCH_CONCURRENCY", "8")),
+    "scrape": int(os.getenv("SERVICE_SCRAPE_CONCURRENCY", "32")),
+    "transcript": int(os.getenv("SERVICE_TRANSCRIPT_CONCURRENCY", "16")),
+    "gemini": int(os.getenv("SERVICE_GEMINI_CONCURRENCY", "8")),
+}
+
+
+class ServiceState:
+    """
+    The limits and counters of one service instance. The counters are only
+    touched from the event loop, so they need no locks.
+    Args:
+        max_in_flight: The number of questions answered at the same time.
+        max_queued: The number of questions that may wait for a slot before
+                    requests are rejected with 429.
+        backend_concurrency: Concurrent calls allowed per backend.
+        worker_threads: The size of the thread pool that runs blocking backend calls.
+    """
+
+    def __init__(self, max_in_flight: int = SERVICE_MAX_IN_FLIGHT, max_queued: int = SERVICE_MAX_QUEUED,
+                 backend_concurrency: Optional[Dict[str, int]] = None,
+                 worker_threads: int = SERVICE_WORKER_THREADS):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.backend_concurrency: Dict[str, int] = dict(BACKEND_CONCURRENCY, **(backend_concurrency or {}))
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=worker_threads, thread_name_prefix="service")
+        self.questions: asyncio.Semaphore = asyncio.Semaphore(max_in_flight)
+        self.backends: Dict[str, asyncio.Semaphore] = {
+            backend: asyncio.Semaphore(limit) for backend, limit in self.backend_concurrency.items()
+        }
+        self.pending: int = 0
+        self.in_flight: int = 0
+        self.counters: Dict[str, int] = {"answered": 0, "failed": 0, "rejected": 0}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.pending - self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "max_queued": self.max_queued,
+            "backend_concurrency": self.backend_concurrency,
+            **self.counters,
+        }
+
+    async def call(self, backend: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Runs a blocking backend call on the worker pool within the backend's
+        concurrency limit, in a copy of the caller's context so spans join its trace.
+        A caller that stops waiting (e.g. on a timeout, see _within) cannot stop the
+        worker thread, so the backend's slot is only freed when the call finishes.
+        """
+        slot: asyncio.Semaphore = self.backends[backend]
+        await slot.acquire()
+        try:
+            loop = asyncio.get_running_loop()
+            context: contextvars.Context = contextvars.copy_context()
+            future: asyncio.Future = loop.run_in_executor(self.executor,
+                                                          functools.partial(context.run, fn, *args, **kwargs))
+        except BaseException:
+            slot.release()
+            raise
+        future.add_done_callback(lambda _: slot.release())
+        return await asyncio.shield(future)
+
+
+async def _within(awaitable: Awaitable[Any], timeout: float) -> Tuple[bool, Any]:
+    """
+    Returns:
+        A tuple (finished, result); result is None if awaitable took longer than timeout.
+    """
+    try:
+        return True, await asyncio.wait_for(awaitable, max(0.0, timeout))
+    except asyncio.TimeoutError:
+        # The worker thread finishes in the background; its result is ignored
+        return False, None
+
+
+async def _no_results() -> List[Dict[str, str]]:
+    return []
+
+
+def _traced(name: str, fn: Callable[..., Any]) -> Callable[..., Any]:
+    def run(*args: Any, **kwargs: Any) -> Any:
+        with tracing.span(name):
+            return fn(*args, **kwargs)
+    return run
+
+
+async def gather_sources(state: ServiceState, question: str, include_web: bool = True, include_youtube: bool = True,
+                         max_web_results: int = 5, max_youtube_results: int = 3,
+                         fetch_timeout: float = gather.FETCH_TIMEOUT_SECONDS,
+                         deadline: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Async counterpart of gather.gather_sources with per-backend concurrency limits.
+    Args:
+        state: The service state.
+        question: The question to search for.
+        include_web: Whether to search the web.
+        include_youtube: Whether to search YouTube.
+        max_web_results: The maximum number of web pages to fetch.
+        max_youtube_results: The maximum number of YouTube videos to fetch.
+        fetch_timeout: Seconds each page or transcript fetch may take.
+        deadline: Seconds the whole stage may take. Defaults to gather.QUESTION_DEADLINE_SECONDS.
+    Returns:
+        The same dictionary as gather.gather_sources.
+    """
+    question_deadline: float = time.monotonic() + (gather.QUESTION_DEADLINE_SECONDS if deadline is None else deadline)
+    search_reports: Dict[str, Dict[str, Any]] = {"web": {}, "youtube": {}}
+    web_search = state.call("search", _traced("search.web", search.search_web), question,
+                            gather.search_size(max_web_results), report=search_reports["web"]) if include_web else _no_results()
+    youtube_search = state.call("search", _traced("search.youtube", search.search_youtube), question,
+                                gather.search_size(max_youtube_results),
+                                report=search_reports["youtube"]) if include_youtube else _no_results()
+    searches: List[Tuple[bool, Any]] = await asyncio.gather(
+        _within(web_search, question_deadline - time.monotonic()),
+        _within(youtube_search, question_deadline - time.monotonic()),
+    )
+    for kind, (finished, _) in zip(("web", "youtube"), searches):
+        if not finished:
+            search_reports[kind]["timed_out"] = True
+    web_hits: List[Dict[str, str]] = searches[0][1] or []
+    youtube_hits: List[Dict[str, str]] = searches[1][1] or []
+    if gather.PRERANK_HITS:
+        web_hits = gather.rank_hits(question, web_hits)
+        youtube_hits = gather.rank_hits(question, youtube_hits)
+    if not include_web:
+        del search_reports["web"]
+    if not include_youtube:
+        del search_reports["youtube"]
+
+    dropped_sources: List[Dict[str, str]] = []
+
+    async def select(kind: str, hits: List[Dict[str, str]], limit: int,
+                     start: Callable[[Dict[str, str]], Any]) -> Tuple[List[Dict[str, Any]], int]:
+        # Runs gather's selection, starting fetches as tasks and waiting for them within the deadline
+        selection: gather.SourceSelection = gather.SourceSelection(kind, limit, dropped_sources, question_deadline)
+        tasks: List[Optional[asyncio.Future]] = [None] * len(hits)
+        # Like gather's fetches, each one gets fetch_timeout from when it starts
+        deadlines: List[float] = [question_deadline] * len(hits)
+
+        def fetch(i: int) -> None:
+            deadlines[i] = min(time.monotonic() + fetch_timeout, question_deadline)
+            tasks[i] = asyncio.ensure_future(start(hits[i]))
+
+        for i, hit in enumerate(hits):
+            if selection.prefetch(hit):
+                fetch(i)
+        steps = selection.run(hits, [task is not None for task in tasks])
+        reply: Optional[Tuple[bool, Any]] = None
+        while True:
+            try:
+                action, i = steps.send(reply)
+            except StopIteration as done:
+                kept, used = done.value
+                return selection.sources(kept), used
+            reply = None
+            if action == gather.START:
+                fetch(i)
+            else:
+                finished, fetched = await _within(tasks[i], deadlines[i] - time.monotonic())
+                reason: str = ("question deadline reached" if deadlines[i] >= question_deadline
+                               else f"timed out after {fetch_timeout:g}s")
+                reply = (True, fetched) if finished else (False, reason)
+
+    (web_sources, used_web_hits), (youtube_sources, used_youtube_hits) = await asyncio.gather(
+        select("web", web_hits, max_web_results,
+               lambda result: state.call("scrape", scraper.extract_web_content, result["url"])),
+        select("youtube", youtube_hits, max_youtube_results,
+               lambda video: state.call("transcript", gather.fetch_transcript, video["id"])),
+    )
+    web_results: List[Dict[str, str]] = web_hits[:used_web_hits]
+    youtube_results: List[Dict[str, str]] = youtube_hits[:used_youtube_hits]
+
+    return {
+        "web_results": web_results,
+        "web_sources": web_sources,
+        "youtube_results": youtube_results,
+        "youtube_sources": youtube_sources,
+        "search_reports": search_reports,
+        "dropped_sources": dropped_sources
+    }
+
+
+async def answer_question(state: ServiceState, question: str, include_web: bool = True, include_youtube: bool = True,
+                          max_web_results: int = 5, max_youtube_results: int = 3,
+                          deadline: Optional[float] = None) -> pipeline.PipelineResult:
+    """
+    Async counterpart of pipeline.answer_question.
+    Args:
+        state: The service state.
+        question: The question to answer.
+        include_web: Whether to use web sources.
+        include_youtube: Whether to use YouTube sources.
+        max_web_results: The maximum number of web pages to fetch.
+        max_youtube_results: The maximum number of YouTube videos to fetch.
+        deadline: Seconds the search and fetch stage may take, see gather_sources.
+    Returns:
+        The PipelineResult.
+    """
+    timings: Dict[str, float] = {}
+    start: float = time.perf_counter()
+    with tracing.trace(question) as question_trace:
+        with tracing.span("gather"):
+            gathered: Dict[str, Any] = await gather_sources(
+                state, question, include_web, include_youtube, max_web_results, max_youtube_results, deadline=deadline
+            )
+        timings["gather"] = time.perf_counter() - start
+
+        generation_start: float = time.perf_counter()
+        answer: str = await state.call(
+            "gemini", llm.generate_answer, question, gathered["web_sources"], gathered["youtube_sources"]
+        )
+        timings["time_to_first_token"] = timings["generation"] = time.perf_counter() - generation_start
+
+        result: pipeline.PipelineResult = pipeline.link_answer(question, gathered, answer, timings)
+        result.trace = question_trace
+    timings["total"] = time.perf_counter() - start
+    return result
+
+
+def _error(status_code: int, message: str, headers: Optional[Dict[str, str]] = None) -> JSONResponse:
+    return JSONResponse({"error": message}, status_code=status_code, headers=headers)
+
+
+def _option(body: Dict[str, Any], name: str, cast: Callable[[Any], Any], default: Any, maximum: Any) -> Any:
+    """
+    Reads a positive numeric option of a request, lowered to maximum.
+    Raises:
+        ValueError: If the option is not a positive number.
+    """
+    value: Any = body.get(name)
+    if value is None:
+        return default
+    try:
+        if isinstance(value, bool):
+            raise TypeError
+        number: Any = cast(value)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"'{name}' must be a positive number")
+    if not number > 0:  # also rejects NaN
+        raise ValueError(f"'{name}' must be a positive number")
+    return min(number, maximum)
+
+
+async def answer_endpoint(request: Request) -> JSONResponse:
+    state: ServiceState = request.app.state.service
+    try:
+        body: Dict[str, Any] = await request.json()
+    except ValueError:
+        return _error(400, "Request body must be JSON")
+    question: str = str(body.get("question") or "").strip() if isinstance(body, dict) else ""
+    if not question:
+        return _error(400, "Missing 'question'")
+    sources: str = body.get("sources", "both")
+    if sources not in ("both", "web", "youtube"):
+        return _error(400, "'sources' must be 'both', 'web' or 'youtube'")
+    try:
+        max_web_results: int = _option(body, "max_web_results", int, 5, SERVICE_MAX_WEB_RESULTS)
+        max_youtube_results: int = _option(body, "max_youtube_results", int, 3, SERVICE_MAX_YOUTUBE_RESULTS)
+        deadline: Optional[float] = _option(body, "deadline", float, None, SERVICE_MAX_DEADLINE_SECONDS)
+    except ValueError as e:
+        return _error(400, str(e))
+
+    # Backpressure: reject instead of queueing without bound
+    if state.pending >= state.max_in_flight + state.max_queued:
+        state.counters["rejected"] += 1
+        return _error(429, "Too many questions in progress, retry later", headers={"Retry-After": "1"})
+    state.pending += 1
+    try:
+        async with state.questions:
+            state.in_flight += 1
+            try:
+                result: pipeline.PipelineResult = await answer_question(
+                    state,
+                    question,
+                    include_web=sources in ("both", "web"),
+                    include_youtube=sources in ("both", "youtube"),
+                    max_web_results=max_web_results,
+                    max_youtube_results=max_youtube_results,
+                    deadline=deadline,
+                )
+            finally:
+                state.in_flight -= 1
+    except Exception as e:
+        state.counters["failed"] += 1
+        return _error(500, f"Error answering question: {str(e)}")
+    finally:
+        state.pending -= 1
+
+    state.counters["failed" if result.error else "answered"] += 1
+    return JSONResponse(result.to_dict(), status_code=502 if result.error else 200)
+
+
+async def health_endpoint(request: Request) -> JSONResponse:
+    return JSONResponse({"status": "ok"})
+
+
+async def stats_endpoint(request: Request) -> JSONResponse:
+    state: ServiceState = request.app.state.service
+    return JSONResponse({"service": state.stats(), "latency": tracing.latency_summary(),
+                         "quota": ratelimit.get_ledger().usage(), "coalesced": singleflight.stats(),
+                         "breakers": breaker.stats()})
+
+
+def create_app(state: Optional[ServiceState] = None) -> Starlette:
+    """
+    Args:
+        state: The limits and counters to serve with; defaults from the environment.
+    Returns:
+        The ASGI application, with POST /answer, GET /health and GET /stats.
+    """
+    app: Starlette = Starlette(routes=[
+        Route("/answer", answer_endpoint, methods=["POST"]),
+        Route("/health", health_endpoint, methods=["GET"]),
+        Route("/stats", stats_endpoint, methods=["GET"]),
+    ])
+    app.state.service = state or ServiceState()
+    return app
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    # Size the keep-alive pool for every concurrent page fetch
+    http.HTTP_POOL_MAXSIZE = max(http.HTTP_POOL_MAXSIZE, BACKEND_CONCURRENCY["scrape"])
+    uvicorn.run(create_app(), host=args.host, port=args.port, log_level="info")
+
+
+if __name__ == "__main__":
+    main()
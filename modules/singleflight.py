@@ -0,0 +1,289 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Optional
+
+from modules import cache, tracing
+
+try:
+    import fcntl
+except ImportError:  # Windows: calls are only coalesced within a process
+    fcntl = None
+
+
+# Coalesce identical calls of different processes (e.g. several service workers) through lock files
+# and published results; off unless configured, since a single process needs neither
+ACROSS_PROCESSES: bool = os.getenv("SINGLEFLIGHT_ACROSS_PROCESSES", "0") == "1"
+# Published results older than this are not reused and are eventually deleted
+RESULT_TTL_SECONDS: float = 60.0
+# Longest wait for another caller's next result, or for another process's lock; a
+# caller that waited this long runs the call itself
+WAIT_TIMEOUT_SECONDS: float = float(os.getenv("SINGLEFLIGHT_WAIT_SECONDS", "120"))
+LOCK_POLL_SECONDS: float = 0.05
+
+_MISSING: Any = object()
+_groups: Dict[str, "SingleFlight"] = {}
+
+
+class FlightAbandoned(Exception):
+    """Raised in a follower whose leader stopped before finishing, or made no progress within WAIT_TIMEOUT_SECONDS."""
+
+
+class _Call:
+    """One in-flight operation; its items are visible to followers as the leader produces them."""
+
+    def __init__(self):
+        self.items: List[Any] = []
+        self.done: bool = False
+        self.error: Optional[BaseException] = None
+        self.cond = threading.Condition()
+
+    def put(self, item: Any) -> None:
+        with self.cond:
+            self.items.append(item)
+            self.cond.notify_all()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        with self.cond:
+            self.done = True
+            self.error = error
+            self.cond.notify_all()
+
+    def iterate(self) -> Iterator[Any]:
+        index: int = 0
+        while True:
+            with self.cond:
+                if not self.cond.wait_for(lambda: index < len(self.items) or self.done, timeout=WAIT_TIMEOUT_SECONDS):
+                    raise FlightAbandoned(f"no result after waiting {WAIT_TIMEOUT_SECONDS:g}s")
+                if index < len(self.items):
+                    item: Any = self.items[index]
+                elif self.error is not None:
+                    raise self.error
+                else:
+                    return
+            index += 1
+            yield item
+
+
+class SingleFlight:
+    """
+    Lets concurrent identical calls share one in-flight operation: the first
+    caller of a key runs it and the others wait for its result.
+    Args:
+        name: Names the group in stats() and its lock files.
+        processes: How identical calls in other processes are coalesced. "lock"
+                   waits for the other process and then runs the call, which finds
+                   the other process's result in a cache shared by both (e.g. the
+                   SQLite content cache). "result" reuses the other process's
+                   result, published as JSON, so results must be plain lists,
+                   dicts and strings. None does not coalesce them. Either way,
+                   only if ACROSS_PROCESSES is set.
+    """
+
+    def __init__(self, name: str, processes: Optional[str] = None):
+        self.name = name
+        self.processes = processes
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {"leaders": 0, "followers": 0}
+        _groups[name] = self
+
+    def _join(self, key: Hashable) -> tuple:
+        with self._lock:
+            call: Optional[_Call] = self._calls.get(key)
+            if call is not None:
+                self.counters["followers"] += 1
+                return call, False
+            call = self._calls[key] = _Call()
+            self.counters["leaders"] += 1
+            return call, True
+
+    def _leave(self, key: Hashable) -> None:
+        with self._lock:
+            self._calls.pop(key, None)
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Runs fn once for all concurrent callers of key.
+        Args:
+            key: Identifies the operation, e.g. a URL.
+            fn: Performs the operation.
+        Returns:
+            The result of fn, from whichever caller ran it.
+        Raises:
+            Exception: The error of fn, raised in every waiting caller.
+        """
+        call, leader = self._join(key)
+        if not leader:
+            tracing.annotate(coalesced=True)
+            try:
+                return next(call.iterate())
+            except FlightAbandoned:
+                # The leader is stuck; run the call here rather than wait on it
+                tracing.annotate(coalesced=False)
+                return fn()
+        try:
+            with self._process_lock(key) as shared:
+                value: Any = fn() if shared is _MISSING else shared
+                if shared is _MISSING:
+                    self._publish(key, value)
+            call.put(value)
+            call.finish()
+            return value
+        except BaseException as e:
+            call.finish(e)
+            raise
+        finally:
+            self._leave(key)
+
+    def stream(self, key: Hashable, fn: Callable[[], Iterable[Any]]) -> Iterator[Any]:
+        """
+        Streaming form of do: followers receive the leader's items as they are produced.
+        Args:
+            key: Identifies the operation.
+            fn: Returns the items, e.g. a generator of search results.
+        Yields:
+            The items of fn, from whichever caller ran it.
+        Raises:
+            FlightAbandoned: In a follower that had received items when its leader
+                             stopped reading early or got stuck. A follower that had
+                             received nothing runs fn itself instead.
+        """
+        call, leader = self._join(key)
+        if not leader:
+            tracing.annotate(coalesced=True)
+            received: bool = False
+            try:
+                for item in call.iterate():
+                    received = True
+                    yield item
+                return
+            except FlightAbandoned:
+                if received:
+                    raise
+            tracing.annotate(coalesced=False)
+            yield from fn()
+            return
+        try:
+            with self._process_lock(key) as shared:
+                items: List[Any] = []
+                for item in (fn() if shared is _MISSING else shared):
+                    items.append(item)
+                    call.put(item)
+                    yield item
+                if shared is _MISSING:
+                    self._publish(key, items)
+            call.finish()
+        except GeneratorExit:
+            # The followers' results would be silently cut short
+            call.finish(FlightAbandoned("the caller running the call stopped reading it"))
+            raise
+        except BaseException as e:
+            call.finish(e)
+            raise
+        finally:
+            self._leave(key)
+
+    def _path(self, key: Hashable) -> str:
+        digest: str = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()[:32]
+        return os.path.join(cache.CACHE_DIR, "flights", f"{self.name}-{digest}")
+
+    @contextmanager
+    def _process_lock(self, key: Hashable) -> Iterator[Any]:
+        """
+        Holds the key's lock file; yields a result another process published while we
+        waited, or _MISSING. If the lock is not free within WAIT_TIMEOUT_SECONDS, the
+        process holding it is taken to be stuck and _MISSING is yielded without it.
+        """
+        if not (ACROSS_PROCESSES and self.processes and fcntl is not None):
+            yield _MISSING
+            return
+        path: str = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".lock", "a+b") as lock_file:
+            waited_since: Optional[float] = None
+            locked: bool = _try_lock(lock_file)
+            if not locked:
+                waited_since = time.time()
+                give_up_at: float = time.monotonic() + WAIT_TIMEOUT_SECONDS
+                while not locked and time.monotonic() < give_up_at:
+                    time.sleep(LOCK_POLL_SECONDS)
+                    locked = _try_lock(lock_file)
+            if not locked:
+                yield _MISSING
+                return
+            try:
+                yield self._read(path, waited_since) if waited_since is not None else _MISSING
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self, path: str, since: float) -> Any:
+        if self.processes != "result":
+            return _MISSING
+        try:
+            if os.path.getmtime(path + ".result") < since - 1:
+                return _MISSING
+            with open(path + ".result", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return _MISSING
+
+    def _publish(self, key: Hashable, value: Any) -> None:
+        if not (ACROSS_PROCESSES and self.processes == "result" and fcntl is not None):
+            return
+        path: str = self._path(key)
+        try:
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(value, f)
+            os.replace(path + ".tmp", path + ".result")
+        except (OSError, TypeError, ValueError):
+            return
+        if self.counters["leaders"] % 100 == 0:
+            _sweep(os.path.dirname(path))
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns:
+            How many calls ran the operation (leaders) and how many shared another's (followers).
+        """
+        with self._lock:
+            return dict(self.counters, in_flight=len(self._calls))
+
+
+def _try_lock(lock_file: Any) -> bool:
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+
+def _sweep(directory: str) -> None:
+    # Lock and result files are per key; old ones are no longer needed, unless a
+    # process still holds the lock (taking a lock does not update its file's time)
+    cutoff: float = time.time() - 10 * RESULT_TTL_SECONDS
+    for name in os.listdir(directory):
+        path: str = os.path.join(directory, name)
+        try:
+            if os.path.getmtime(path) >= cutoff:
+                continue
+            if not name.endswith(".lock"):
+                os.remove(path)
+                continue
+            with open(path, "a+b") as lock_file:
+                if _try_lock(lock_file):
+                    os.remove(path)
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        except OSError:
+            pass
+
+
+def stats() -> Dict[str, Dict[str, int]]:
+    """
+    Returns:
+        The counters of every single-flight group, by name.
+    """
+    return {name: group.stats() for name, group in sorted(_groups.items())}
@@ -0,0 +1,290 @@
+import contextvars
+import html
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+
+TRACE_LOG_PATH: str = os.getenv("TRACE_LOG_PATH", os.path.join("logs", "traces.jsonl"))
+
+_current_trace: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("current_trace", default=None)
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    One timed stage of a question, e.g. a search, a page fetch or the Gemini call.
+    Args:
+        name: The stage name, e.g. "scrape.page".
+        attributes: Details such as the URL, video ID or byte count.
+        parent: The enclosing span, if any.
+    """
+    __slots__ = ("name", "attributes", "parent", "start", "end", "status", "error", "thread")
+
+    def __init__(self, name: str, attributes: Dict[str, Any], parent: Optional["Span"] = None):
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent
+        self.start: float = time.perf_counter()
+        self.end: Optional[float] = None
+        self.status: str = "ok"
+        self.error: Optional[str] = None
+        self.thread: str = threading.current_thread().name
+
+    @property
+    def duration(self) -> float:
+        """Seconds from start to end, or until now if the span is still open."""
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def set(self, **attributes: Any) -> None:
+        """Adds or updates attributes of the span."""
+        self.attributes.update(attributes)
+
+    def fail(self, error: str) -> None:
+        """Marks the span as failed, e.g. when a function returns an error message."""
+        self.status = "error"
+        self.error = error
+
+    def to_dict(self, origin: float) -> Dict[str, Any]:
+        """
+        Args:
+            origin: The perf_counter value that offsets are measured from.
+        Returns:
+            A JSON-serializable description of the span.
+        """
+        return {
+            "name": self.name,
+            "parent": self.parent.name if self.parent else None,
+            "offset_ms": round((self.start - origin) * 1000, 2),
+            "duration_ms": round(self.duration * 1000, 2),
+            "status": self.status,
+            "error": self.error,
+            "thread": self.thread,
+            "attributes": self.attributes,
+        }
+
+
+class Trace:
+    """
+    All spans recorded while answering one question, across threads.
+    Args:
+        question: The question being answered.
+    """
+
+    def __init__(self, question: str):
+        self.id: str = uuid.uuid4().hex
+        self.question = question
+        self.start: float = time.perf_counter()
+        self.started_at: float = time.time()
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans: List[Span] = sorted(self.spans, key=lambda span: span.start)
+        return {
+            "trace_id": self.id,
+            "question": self.question,
+            "started_at": self.started_at,
+            "duration_ms": round((time.perf_counter() - self.start) * 1000, 2),
+            "spans": [span.to_dict(self.start) for span in spans],
+        }
+
+
+class LatencyHistogram:
+    """
+    A thread-safe latency histogram with logarithmic buckets (about 10% wide)
+    from 0.1 ms to about 20 minutes, so percentiles need constant memory.
+    """
+    MIN_SECONDS: float = 1e-4
+    GROWTH: float = 1.1
+    BUCKETS: int = 175
+
+    def __init__(self):
+        self.counts: List[int] = [0] * (self.BUCKETS + 1)
+        self.count: int = 0
+        self.total: float = 0.0
+        self.maximum: float = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        if seconds <= self.MIN_SECONDS:
+            bucket: int = 0
+        else:
+            bucket = min(self.BUCKETS, int(math.log(seconds / self.MIN_SECONDS, self.GROWTH)) + 1)
+        with self._lock:
+            self.counts[bucket] += 1
+            self.count += 1
+            self.total += seconds
+            self.maximum = max(self.maximum, seconds)
+
+    def percentile(self, fraction: float) -> float:
+        """
+        Args:
+            fraction: The percentile as a fraction, e.g. 0.95.
+        Returns:
+            The upper bound in seconds of the bucket holding that percentile, or 0 if empty.
+        """
+        with self._lock:
+            if not self.count:
+                return 0.0
+            rank: float = fraction * self.count
+            seen: int = 0
+            for bucket, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank:
+                    return min(self.maximum, self.MIN_SECONDS * self.GROWTH ** bucket)
+            return self.maximum
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            "p50_ms": round(self.percentile(0.50) * 1000, 2),
+            "p95_ms": round(self.percentile(0.95) * 1000, 2),
+            "p99_ms": round(self.percentile(0.99) * 1000, 2),
+            "max_ms": round(self.maximum * 1000, 2),
+        }
+
+
+_histograms: Dict[str, LatencyHistogram] = {}
+_histograms_lock = threading.Lock()
+_log_lock = threading.Lock()
+
+
+def record_latency(name: str, seconds: float) -> None:
+    """Adds a duration to the process-wide histogram of a stage."""
+    with _histograms_lock:
+        histogram: LatencyHistogram = _histograms.setdefault(name, LatencyHistogram())
+    histogram.record(seconds)
+
+
+def latency_summary() -> Dict[str, Dict[str, float]]:
+    """
+    Returns:
+        The p50/p95/p99 latency of every stage seen by this process, by stage name.
+    """
+    with _histograms_lock:
+        histograms: Dict[str, LatencyHistogram] = dict(_histograms)
+    return {name: histogram.summary() for name, histogram in sorted(histograms.items())}
+
+
+def reset_latency() -> None:
+    """Empties the process-wide histograms, e.g. between load test runs."""
+    with _histograms_lock:
+        _histograms.clear()
+
+
+def current_trace() -> Optional[Trace]:
+    """Returns the trace of the question being answered in this context, if any."""
+    return _current_trace.get()
+
+
+def annotate(**attributes: Any) -> None:
+    """Adds attributes to the innermost open span of this context, if any."""
+    current: Optional[Span] = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+    """
+    Times a stage and records it in the current trace and the process histograms.
+    An exception escaping the block marks the span as failed and is re-raised.
+    Args:
+        name: The stage name.
+        **attributes: Initial span attributes.
+    Yields:
+        The span, for adding attributes or marking it failed.
+    """
+    current: Span = Span(name, attributes, parent=_current_span.get())
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.fail(str(e))
+        raise
+    finally:
+        current.end = time.perf_counter()
+        _current_span.reset(token)
+        record_latency(name, current.duration)
+        trace: Optional[Trace] = _current_trace.get()
+        if trace is not None:
+            trace.add(current)
+
+
+@contextmanager
+def trace(question: str) -> Iterator[Trace]:
+    """
+    Collects the spans of one question. On exit the trace and the current
+    histograms are appended to TRACE_LOG_PATH as JSON lines.
+    Args:
+        question: The question being answered.
+    Yields:
+        The trace.
+    """
+    current: Trace = Trace(question)
+    token = _current_trace.set(current)
+    try:
+        with span("question"):
+            yield current
+    finally:
+        _current_trace.reset(token)
+        write_log(current)
+
+
+def write_log(trace: Trace) -> None:
+    """Appends a trace and a snapshot of the latency histograms to TRACE_LOG_PATH."""
+    if not TRACE_LOG_PATH:
+        return
+    lines: List[str] = [
+        json.dumps(dict(trace.to_dict(), type="trace"), default=str),
+        json.dumps({"type": "histograms", "time": time.time(), "stages": latency_summary()}),
+    ]
+    try:
+        if os.path.dirname(TRACE_LOG_PATH):
+            os.makedirs(os.path.dirname(TRACE_LOG_PATH), exist_ok=True)
+        with _log_lock, open(TRACE_LOG_PATH, "a", encoding="utf-8") as log:
+            log.write("\n".join(lines) + "\n")
+    except OSError:
+        # Tracing must never break answering a question
+        pass
+
+
+def render_waterfall(trace: Trace) -> str:
+    """
+    Creates an HTML waterfall of the spans of a trace.
+    Args:
+        trace: The trace to render.
+    Returns:
+        An HTML table with one bar per span, positioned by start offset and duration.
+    """
+    data: Dict[str, Any] = trace.to_dict()
+    total: float = max([data["duration_ms"]] + [s["offset_ms"] + s["duration_ms"] for s in data["spans"]]) or 1.0
+    rows: List[str] = []
+    for s in data["spans"]:
+        detail: Any = s["attributes"].get("url") or s["attributes"].get("video_id") or ""
+        if "bytes" in s["attributes"]:
+            detail = f"{detail} ({s['attributes']['bytes']:,} bytes)".strip()
+        colour: str = "#d9534f" if s["status"] == "error" else "#4a90d9"
+        left: float = s["offset_ms"] / total * 100
+        width: float = max(s["duration_ms"] / total * 100, 0.5)
+        title: str = html.escape(s["error"] or "", quote=True)
+        rows.append(
+            f'<tr title="{title}"><td>{html.escape(s["name"])}</td>'
+            f'<td style="max-width:24em;overflow:hidden;white-space:nowrap">{html.escape(str(detail))}</td>'
+            f'<td style="text-align:right">{s["duration_ms"]:.0f} ms</td>'
+            f'<td style="width:50%"><div style="margin-left:{left:.2f}%;width:{width:.2f}%;'
+            f'height:0.8em;background:{colour}"></div></td></tr>'
+        )
+    return "<table><tr><th>Stage</th><th>Detail</th><th>Time</th><th>Waterfall</th></tr>" + "".join(rows) + "</table>"
@@ -0,0 +1,295 @@
+import os
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Union
+
+from modules import cache
+
+
+TRANSCRIPT_STORE_TTL_SECONDS: float = float(os.getenv("TRANSCRIPT_STORE_TTL_SECONDS", str(30 * 24 * 3600)))
+TRANSCRIPT_STORE_MAX_ENTRIES: int = int(os.getenv("TRANSCRIPT_STORE_MAX_ENTRIES", "2000"))
+# Version of the store's table; a file with another version is emptied when opened
+_STORE_VERSION: int = 1
+
+
+def format_timestamp(seconds: float) -> str:
+    """
+    Formats a position in a video as mm:ss, the format used in citations.
+    Args:
+        seconds: The position in seconds.
+    Returns:
+        The timestamp, e.g. "02:15". Minutes are not wrapped into hours.
+    """
+    return f"{int(seconds // 60):02d}:{int(seconds % 60):02d}"
+
+
+# "[mm:ss] " line prefixes indexed by whole second, grown to the longest video seen
+_labels: List[str] = []
+
+
+def _timestamp_labels(count: int) -> List[str]:
+    """
+    Returns:
+        A list whose first count items are the "[mm:ss] " prefixes of those seconds.
+        Formatting is the bulk of the cost of formatting a transcript, so labels are
+        built once per process.
+    """
+    global _labels
+    labels: List[str] = _labels
+    if len(labels) < count:
+        # Build a new list and swap it in, so concurrent readers never see a partial one
+        labels = labels + [f"[{format_timestamp(second)}] " for second in range(len(labels), count)]
+        _labels = labels
+    return labels
+
+
+class Transcript:
+    """
+    A compact, read-only YouTube transcript.
+    Segment start times live in an array('d') and all segment text in one string
+    with an array of offsets, instead of one dict per segment. Indexing still
+    returns the segment dict that get_video_transcript used to build.
+    Args:
+        video_id: The ID of the YouTube video.
+        starts: Segment start times in seconds, in ascending order.
+        durations: Segment durations in seconds.
+        text: The text of all segments, concatenated.
+        offsets: len(starts) + 1 offsets into text; segment i is text[offsets[i]:offsets[i + 1]].
+    """
+    __slots__ = ("video_id", "starts", "durations", "text", "offsets", "_formatted")
+
+    def __init__(self, video_id: str, starts: array, durations: array, text: str, offsets: array):
+        self.video_id = video_id
+        self.starts = starts
+        self.durations = durations
+        self.text = text
+        self.offsets = offsets
+        self._formatted: Optional[str] = None
+
+    @classmethod
+    def from_segments(cls, video_id: str, segments: Iterable[Dict[str, Union[str, float]]]) -> "Transcript":
+        """
+        Builds a transcript from youtube-transcript-api segments.
+        Args:
+            video_id: The ID of the YouTube video.
+            segments: Dictionaries with 'text', 'start' and optionally 'duration'.
+        Returns:
+            The transcript, with segments sorted by start time.
+        """
+        ordered = sorted(segments, key=lambda segment: segment["start"])
+        starts: array = array('d', (float(segment["start"]) for segment in ordered))
+        durations: array = array('d', (float(segment.get("duration", 0.0)) for segment in ordered))
+        texts: List[str] = [segment["text"] for segment in ordered]
+        offsets: array = array('Q', [0])
+        position: int = 0
+        for text in texts:
+            position += len(text)
+            offsets.append(position)
+        return cls(video_id, starts, durations, "".join(texts), offsets)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, index: int) -> Dict[str, Union[str, float]]:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("transcript segment index out of range")
+        start: float = self.starts[index]
+        return {
+            'text': self.segment_text(index),
+            'start': start,
+            'timestamp': format_timestamp(start),
+            'timestamp_seconds': start
+        }
+
+    def __iter__(self) -> Iterator[Dict[str, Union[str, float]]]:
+        return (self[i] for i in range(len(self)))
+
+    def segment_text(self, index: int) -> str:
+        """
+        Args:
+            index: The index of the segment.
+        Returns:
+            The text of the segment.
+        """
+        return self.text[self.offsets[index]:self.offsets[index + 1]]
+
+    def nearest_index(self, seconds: float) -> int:
+        """
+        Finds the segment whose start is closest to a position in the video.
+        Starts are compared in whole seconds, as they appear in mm:ss citations.
+        Args:
+            seconds: The position in seconds.
+        Returns:
+            The index of the nearest segment, or -1 if the transcript is empty.
+        """
+        if not self.starts:
+            return -1
+        i: int = bisect_left(self.starts, seconds)
+        if i == len(self.starts):
+            return i - 1
+        if i > 0 and seconds - int(self.starts[i - 1]) <= int(self.starts[i]) - seconds:
+            return i - 1
+        return i
+
+    def snap(self, seconds: float) -> int:
+        """
+        Snaps a position in the video to the nearest segment boundary.
+        Args:
+            seconds: The position in seconds.
+        Returns:
+            The start of the nearest segment in whole seconds, or seconds itself if the
+            transcript is empty.
+        """
+        index: int = self.nearest_index(seconds)
+        return int(seconds) if index < 0 else int(self.starts[index])
+
+    def formatted(self, max_chars: Optional[int] = None) -> str:
+        """
+        Formats the transcript as "[mm:ss] text" lines.
+        Args:
+            max_chars: If given, only whole lines that fit in this many characters are
+                       included, followed by "..." if any were left out.
+        Returns:
+            The formatted transcript text.
+        """
+        if self._formatted is None:
+            labels: List[str] = _timestamp_labels(int(self.starts[-1]) + 1 if len(self) else 0)
+            text: str = self.text
+            offsets: List[int] = self.offsets.tolist()
+            parts: List[str] = []
+            for second, begin, end in zip(map(int, self.starts), offsets, offsets[1:]):
+                parts.append(labels[second])
+                parts.append(text[begin:end])
+                parts.append("\n")
+            self._formatted = "".join(parts)
+        if max_chars is None or len(self._formatted) <= max_chars:
+            return self._formatted
+        cut: int = self._formatted.rfind("\n", 0, max_chars) + 1
+        return self._formatted[:cut] + "..."
+
+    def to_bytes(self) -> bytes:
+        """
+        Returns:
+            A compact binary encoding of the transcript, read back with from_bytes().
+        """
+        header: array = array('Q', [len(self)])
+        payload: bytes = (
+            header.tobytes() + self.starts.tobytes() + self.durations.tobytes()
+            + self.offsets.tobytes() + self.text.encode("utf-8")
+        )
+        return zlib.compress(payload)
+
+    @classmethod
+    def from_bytes(cls, video_id: str, data: bytes) -> "Transcript":
+        """
+        Args:
+            video_id: The ID of the YouTube video.
+            data: The output of to_bytes().
+        Returns:
+            The decoded transcript.
+        """
+        payload: bytes = zlib.decompress(data)
+        header: array = array('Q')
+        header.frombytes(payload[:8])
+        count: int = header[0]
+        position: int = 8
+        starts: array = array('d')
+        starts.frombytes(payload[position:position + 8 * count])
+        position += 8 * count
+        durations: array = array('d')
+        durations.frombytes(payload[position:position + 8 * count])
+        position += 8 * count
+        offsets: array = array('Q')
+        offsets.frombytes(payload[position:position + 8 * (count + 1)])
+        position += 8 * (count + 1)
+        return cls(video_id, starts, durations, payload[position:].decode("utf-8"), offsets)
+
+
+class TranscriptStore:
+    """
+    A persistent SQLite store of transcripts by video ID, so that each transcript
+    is fetched from YouTube only once. Like cache.ContentCache, entries expire
+    after a TTL and the least recently used ones are evicted beyond max_entries.
+    Args:
+        path: The SQLite file to store transcripts in.
+        ttl: Seconds a transcript is kept after it was stored.
+        max_entries: The number of transcripts kept before LRU eviction.
+        clock: Returns the current time in seconds. Replaceable in tests.
+    """
+
+    def __init__(self, path: str, ttl: float = TRANSCRIPT_STORE_TTL_SECONDS,
+                 max_entries: int = TRANSCRIPT_STORE_MAX_ENTRIES, clock: Callable[[], float] = time.time):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with cache.connect(self.path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            if conn.execute("PRAGMA user_version").fetchone()[0] != _STORE_VERSION:
+                # Stored without expiry and access times, which eviction needs
+                conn.execute("DROP TABLE IF EXISTS transcripts")
+                conn.execute(f"PRAGMA user_version = {_STORE_VERSION}")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS transcripts ("
+                " video_id TEXT PRIMARY KEY, data BLOB NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS transcripts_accessed ON transcripts (accessed_at)")
+
+    def get(self, video_id: str) -> Optional[Transcript]:
+        """
+        Looks up a transcript and marks it as recently used.
+        Args:
+            video_id: The ID of the YouTube video.
+        Returns:
+            The stored transcript, or None if it has not been fetched yet or has expired.
+        """
+        now: float = self.clock()
+        with cache.connect(self.path) as conn:
+            row = conn.execute(
+                "SELECT data FROM transcripts WHERE video_id = ? AND expires_at > ?", (video_id, now)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE transcripts SET accessed_at = ? WHERE video_id = ?", (now, video_id))
+        return Transcript.from_bytes(video_id, row[0])
+
+    def put(self, transcript: Transcript) -> None:
+        """
+        Stores a transcript and evicts least recently used ones beyond max_entries.
+        Args:
+            transcript: The transcript to store under its video ID.
+        """
+        now: float = self.clock()
+        with cache.connect(self.path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO transcripts (video_id, data, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (transcript.video_id, transcript.to_bytes(), now + self.ttl, now)
+            )
+            conn.execute(
+                "DELETE FROM transcripts WHERE video_id IN ("
+                " SELECT video_id FROM transcripts ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+
+_transcript_store: Optional[TranscriptStore] = None
+_transcript_store_lock = threading.Lock()
+
+
+def get_transcript_store() -> TranscriptStore:
+    """
+    Returns:
+        The process-wide transcript store under CACHE_DIR.
+    """
+    global _transcript_store
+    with _transcript_store_lock:
+        if _transcript_store is None:
+            _transcript_store = TranscriptStore(os.path.join(cache.CACHE_DIR, "transcripts.sqlite3"))
+        return _transcript_store
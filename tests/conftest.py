@@ -0,0 +1,22 @@
+from collections import OrderedDict
+import pytest
+from modules import breaker, cache, llm, parsing, ratelimit, search, tracing, transcripts
+from modules.cache import MemoryCache
+
+
+@pytest.fixture(autouse=True)
+def isolated_caches(tmp_path, monkeypatch):
+    # Keep every test's caches out of the working tree and apart from other tests
+    monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(cache, "_content_cache", None)
+    monkeypatch.setattr(transcripts, "_transcript_store", None)
+    monkeypatch.setattr(search, "_search_cache", MemoryCache())
+    monkeypatch.setattr(llm, "_answer_cache", MemoryCache())
+    monkeypatch.setattr(tracing, "TRACE_LOG_PATH", str(tmp_path / "logs" / "traces.jsonl"))
+    monkeypatch.setattr(ratelimit, "_limiters", {})
+    monkeypatch.setattr(ratelimit, "_token_limiters", {})
+    monkeypatch.setattr(ratelimit, "_ledger", None)
+    monkeypatch.setattr(breaker, "_failures", MemoryCache())
+    monkeypatch.setattr(breaker, "_breakers", OrderedDict())
+    # Parse in the test process, where parser patches apply; tests/test_parsing.py covers the workers
+    monkeypatch.setattr(parsing, "PARSE_WORKERS", 0)
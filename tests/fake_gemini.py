@@ -0,0 +1,63 @@
+import re
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+
+class FakeGeminiModel:
+    """
+    An offline stand-in for genai.GenerativeModel that follows the map and reduce prompts.
+    A map call returns the first line of its source as a cited fact, or NONE if
+    the source mentions "unrelated". A reduce call joins the facts of every source
+    into the answer and lists the cited sources.
+    Args:
+        delay: Seconds each call takes, to measure how calls overlap.
+    """
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.prompts: List[str] = []
+        self.active: int = 0
+        self.max_active: int = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents: List[Dict[str, Any]], generation_config: Any = None, stream: bool = False) -> Any:
+        prompt: str = contents[0]["parts"][0]["text"]
+        with self._lock:
+            self.prompts.append(prompt)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            text: str = self._map(prompt) if "Extract the facts" in prompt else self._reduce(prompt)
+        finally:
+            with self._lock:
+                self.active -= 1
+        if stream:
+            return iter([SimpleNamespace(text=text[:10]), SimpleNamespace(text=text[10:])])
+        return SimpleNamespace(text=text)
+
+    def map_prompts(self) -> List[str]:
+        return [prompt for prompt in self.prompts if "Extract the facts" in prompt]
+
+    def reduce_prompts(self) -> List[str]:
+        return [prompt for prompt in self.prompts if "Extract the facts" not in prompt]
+
+    @staticmethod
+    def _map(prompt: str) -> str:
+        match = re.search(r"SOURCE (\d+) \((WEB|YOUTUBE)\): \S+\n\s*(.+)", prompt)
+        number, kind, first_line = match.group(1), match.group(2), match.group(3).strip()
+        if "unrelated" in first_line:
+            return "NONE"
+        if kind == "YOUTUBE":
+            timestamp, text = re.match(r"\[(\d\d:\d\d)\] (.*)", first_line).groups()
+            return f"- {text} [{number}][{timestamp}]"
+        return f"- {first_line} [{number}]"
+
+    @staticmethod
+    def _reduce(prompt: str) -> str:
+        facts: List[str] = re.findall(r"^\s*- (.+)$", prompt.split("INSTRUCTIONS:")[0], re.MULTILINE)
+        cited: List[str] = re.findall(r"SOURCE (\d+) \((?:WEB|YOUTUBE)\): (\S+)", prompt)
+        sources: str = "\n".join(f"{number}. {url}" for number, url in cited)
+        return " ".join(facts) + f"\n\nSOURCES:\n{sources}"
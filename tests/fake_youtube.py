@@ -0,0 +1,65 @@
+from typing import Any, Dict, List, Optional
+
+
+class FakeRequest:
+    """A prepared API request; execute() returns the canned response."""
+
+    def __init__(self, response: Dict[str, Any]):
+        self.response = response
+
+    def execute(self) -> Dict[str, Any]:
+        return self.response
+
+
+class FakeResource:
+    """Records list() calls for one API resource (search, videos, captions)."""
+
+    def __init__(self, client: "FakeYouTubeClient", name: str):
+        self.client = client
+        self.name = name
+
+    def list(self, **params: Any) -> FakeRequest:
+        self.client.calls.append((self.name, params))
+        return FakeRequest(getattr(self.client, f"_{self.name}_response")(params))
+
+
+class FakeYouTubeClient:
+    """
+    An offline stand-in for googleapiclient's YouTube Data API v3 client.
+    Args:
+        videos: Search results in rank order, as dicts with 'id', 'title' and
+                optionally 'caption' ("true"/"false", defaults to "true").
+    """
+
+    def __init__(self, videos: List[Dict[str, str]]):
+        self.catalog = videos
+        self.calls: List[tuple] = []
+
+    def search(self) -> FakeResource:
+        return FakeResource(self, "search")
+
+    def videos(self) -> FakeResource:
+        return FakeResource(self, "videos")
+
+    def captions(self) -> FakeResource:
+        return FakeResource(self, "captions")
+
+    def calls_to(self, name: str) -> List[Dict[str, Any]]:
+        return [params for resource, params in self.calls if resource == name]
+
+    def _search_response(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return {"items": [
+            {"id": {"kind": "youtube#video", "videoId": video["id"]}, "snippet": {"title": video["title"]}}
+            for video in self.catalog[:params.get("maxResults", 5)]
+        ]}
+
+    def _videos_response(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        requested: List[str] = params["id"].split(",")
+        return {"items": [
+            {"id": video["id"], "contentDetails": {"caption": video.get("caption", "true")}}
+            for video in self.catalog if video["id"] in requested
+        ]}
+
+    def _captions_response(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        video: Optional[Dict[str, str]] = next((v for v in self.catalog if v["id"] == params["videoId"]), None)
+        return {"items": [{"id": "caption"}] if video and video.get("caption", "true") == "true" else []}
@@ -0,0 +1,57 @@
+import threading
+from unittest.mock import MagicMock, patch
+from modules.llm import answer_cache_key, generate_answer
+
+
+WEB_SOURCES = [{"title": "Article", "url": "https://example.com", "content": "Python was created by Guido."}]
+YOUTUBE_SOURCES = [{"id": "vid", "title": "Video", "url": "https://www.youtube.com/watch?v=vid", "transcript_text": "[00:10] Hello"}]
+
+
+def fake_model(text="Guido created Python [1].\n\nSOURCES:\n1. Article"):
+    model = MagicMock()
+    model.generate_content.return_value = MagicMock(text=text)
+    return model
+
+
+class TestAnswerCache:
+
+    def test_key_depends_on_question_and_source_content(self):
+        key = answer_cache_key("Who created Python?", WEB_SOURCES, YOUTUBE_SOURCES)
+
+        assert answer_cache_key("who created python", WEB_SOURCES, YOUTUBE_SOURCES) == key
+        changed = [dict(WEB_SOURCES[0], content="Different text.")]
+        assert answer_cache_key("Who created Python?", changed, YOUTUBE_SOURCES) != key
+        # Swapping source order changes citation numbers, so it is a different answer
+        assert answer_cache_key("Who created Python?", [], WEB_SOURCES + YOUTUBE_SOURCES) != key
+
+    @patch.dict('os.environ', {'GEMINI_API_KEY': 'test-key'})
+    def test_repeated_question_skips_the_model(self):
+        model = fake_model()
+        with patch('modules.llm.clients.gemini_model', return_value=model):
+            first = generate_answer("Who created Python?", WEB_SOURCES, YOUTUBE_SOURCES)
+            second = generate_answer("who created python", WEB_SOURCES, YOUTUBE_SOURCES)
+
+        assert second == first
+        assert model.generate_content.call_count == 1
+
+    @patch.dict('os.environ', {'GEMINI_API_KEY': 'test-key'})
+    def test_errors_are_not_cached(self):
+        model = fake_model()
+        model.generate_content.side_effect = [RuntimeError("quota"), MagicMock(text="Answer [1].")]
+        with patch('modules.llm.clients.gemini_model', return_value=model):
+            assert generate_answer("q", WEB_SOURCES, []).startswith("Error generating answer")
+            assert generate_answer("q", WEB_SOURCES, []) == "Answer [1]."
+
+    @patch.dict('os.environ', {'GEMINI_API_KEY': 'test-key'})
+    def test_concurrent_sessions_read_consistent_answers(self):
+        model = fake_model()
+        answers = []
+        with patch('modules.llm.clients.gemini_model', return_value=model):
+            threads = [threading.Thread(target=lambda: answers.append(generate_answer("q", WEB_SOURCES, [])))
+                       for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        assert answers == [model.generate_content.return_value.text] * 8
@@ -0,0 +1,175 @@
+from unittest.mock import patch
+import requests
+from modules import breaker, gather, scraper
+from modules.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from modules.cache import MemoryCache
+from tests.test_content_cache import ARTICLE_HTML, FakeClock, make_response
+from tests.test_dedup import article
+
+
+def not_found(url):
+    response = make_response(status_code=404)
+    response.raise_for_status.side_effect = requests.HTTPError("404 Client Error: Not Found", response=response)
+    return response
+
+
+class TranscriptsDisabled(Exception):
+    """Named like the youtube-transcript-api error for a video without captions."""
+
+
+class TestCircuitBreaker:
+
+    def test_opens_after_consecutive_failures_and_probes_once(self):
+        clock = FakeClock()
+        circuit = CircuitBreaker(failure_threshold=3, cooldown=30, max_cooldown=100, clock=clock)
+        for _ in range(3):
+            assert circuit.allow()
+            circuit.record_failure()
+
+        assert circuit.state == OPEN and not circuit.allow()
+        clock.now += 31
+        assert circuit.state == HALF_OPEN
+        assert circuit.allow()
+        # Only the first caller probes; the rest wait for its outcome
+        assert not circuit.allow() and circuit.is_open()
+
+        circuit.record_failure()
+        clock.now += 31
+        assert circuit.state == OPEN  # the failed probe doubled the cooldown
+        clock.now += 30
+        assert circuit.allow()
+        circuit.record_success()
+        assert circuit.state == CLOSED and circuit.allow()
+
+    def test_success_resets_the_failure_count(self):
+        circuit = CircuitBreaker(failure_threshold=2)
+        circuit.record_failure()
+        circuit.record_success()
+        circuit.record_failure()
+
+        assert circuit.state == CLOSED
+
+    def test_only_breakers_with_failures_are_kept(self, monkeypatch):
+        monkeypatch.setattr(breaker, "BREAKER_MAX_ENTRIES", 2)
+        for i in range(100):
+            assert breaker.skip_reason(("page", f"https://site{i}.example/"), f"site{i}.example") is None
+        assert len(breaker._breakers) == 0
+
+        for name in ("a.example", "b.example", "c.example"):
+            breaker.record_failure(("page", f"https://{name}/"), "timed out", ttl=60, breaker=name)
+        assert list(breaker._breakers) == ["b.example", "c.example"]
+        breaker.record_success(("page", "https://c.example/"), breaker="c.example")
+        assert list(breaker._breakers) == ["b.example"]
+
+
+class TestFailingPages:
+
+    def test_failed_page_is_not_fetched_again_until_its_ttl_passes(self, monkeypatch):
+        clock = FakeClock()
+        monkeypatch.setattr(breaker, "_failures", MemoryCache(clock=clock))
+        with patch('modules.scraper.http.get_session') as get_session:
+            get_session.return_value.get.side_effect = requests.ConnectionError("Connection refused")
+            first = scraper.extract_web_content("https://paywall.example/a")
+            second = scraper.extract_web_content("https://paywall.example/a")
+            assert get_session.return_value.get.call_count == 1
+
+            clock.now += breaker.PAGE_FAILURE_TTL_SECONDS + 1
+            get_session.return_value.get.side_effect = lambda *args, **kwargs: make_response(text=ARTICLE_HTML)
+            third = scraper.extract_web_content("https://paywall.example/a")
+
+        assert first.endswith("Connection refused")
+        assert second.endswith("failed recently: Connection refused")
+        assert "Cached paragraph text." in third
+
+    def test_failing_domain_opens_its_breaker(self):
+        with patch('modules.scraper.http.get_session') as get_session:
+            get_session.return_value.get.side_effect = requests.ConnectTimeout("timed out")
+            for i in range(breaker.BREAKER_FAILURE_THRESHOLD):
+                scraper.extract_web_content(f"https://down.example/{i}")
+            skipped = scraper.extract_web_content("https://www.down.example/other")
+            other_site = scraper.extract_web_content("https://up.example/")
+
+        assert skipped.endswith("down.example is failing; circuit open")
+        assert get_session.return_value.get.call_count == breaker.BREAKER_FAILURE_THRESHOLD + 1
+        assert "circuit open" not in other_site
+
+    def test_missing_pages_do_not_open_the_breaker(self):
+        with patch('modules.scraper.http.get_session') as get_session:
+            get_session.return_value.get.side_effect = lambda url, **kwargs: not_found(url)
+            for i in range(breaker.BREAKER_FAILURE_THRESHOLD + 1):
+                scraper.extract_web_content(f"https://example.com/missing/{i}")
+
+        assert breaker.get_breaker("example.com").state == CLOSED
+        assert breaker.recent_failure(("page", "https://example.com/missing/0")).startswith("404")
+
+    def test_open_breaker_serves_stale_cached_text(self, monkeypatch):
+        monkeypatch.setattr(scraper.get_content_cache(), "ttl", -1)
+        with patch('modules.scraper.http.get_session') as get_session:
+            get_session.return_value.get.side_effect = lambda *args, **kwargs: make_response(text=ARTICLE_HTML)
+            scraper.extract_web_content("https://flaky.example/a")
+        for _ in range(breaker.BREAKER_FAILURE_THRESHOLD):
+            breaker.get_breaker("flaky.example").record_failure()
+
+        with patch('modules.scraper.http.get_session') as get_session:
+            text = scraper.extract_web_content("https://flaky.example/a")
+
+        assert "Cached paragraph text." in text
+        get_session.return_value.get.assert_not_called()
+
+
+class TestFailingTranscripts:
+
+    def test_disabled_transcript_is_remembered_without_opening_the_breaker(self):
+        with patch('youtube_transcript_api.YouTubeTranscriptApi.get_transcript',
+                   side_effect=TranscriptsDisabled("Subtitles are disabled for this video")) as get_transcript:
+            for _ in range(breaker.BREAKER_FAILURE_THRESHOLD + 1):
+                result = scraper.get_video_transcript("nocaptions")
+
+        assert get_transcript.call_count == 1
+        assert result == "Error getting transcript: failed recently: Subtitles are disabled for this video"
+        assert breaker.get_breaker(breaker.TRANSCRIPTS).state == CLOSED
+
+    def test_blocked_transcript_service_opens_the_breaker(self):
+        with patch('youtube_transcript_api.YouTubeTranscriptApi.get_transcript',
+                   side_effect=RuntimeError("Too Many Requests")) as get_transcript:
+            for i in range(breaker.BREAKER_FAILURE_THRESHOLD + 2):
+                result = scraper.get_video_transcript(f"video{i}")
+
+        assert get_transcript.call_count == breaker.BREAKER_FAILURE_THRESHOLD
+        assert result.endswith("youtube transcripts is failing; circuit open")
+
+
+PAGES = {f"https://site{i}.example/": article(i) for i in range(4)}
+
+
+def fake_web_hits(query, max_results=5, report=None):
+    for i in range(min(max_results, 4)):
+        yield {"title": f"Page {i}", "url": f"https://site{i}.example/", "snippet": ""}
+
+
+def extract(url):
+    if url == "https://site1.example/":
+        return f"Error extracting content from {url}: 403 Client Error: Forbidden"
+    return PAGES[url]
+
+
+class TestGatherSkipsFailures:
+
+    @patch('modules.gather.scraper.extract_web_content', side_effect=extract)
+    @patch('modules.gather.search.iter_web_results', side_effect=fake_web_hits)
+    def test_failed_source_is_dropped_and_replaced(self, mock_search, mock_extract):
+        gathered = gather.gather_sources("question", include_youtube=False, max_web_results=2)
+
+        assert [source["url"] for source in gathered["web_sources"]] == ["https://site0.example/", "https://site2.example/"]
+        assert gathered["dropped_sources"] == [{"type": "web", "title": "Page 1", "url": "https://site1.example/",
+                                                "reason": "failed: 403 Client Error: Forbidden"}]
+
+    @patch('modules.gather.scraper.extract_web_content', side_effect=extract)
+    @patch('modules.gather.search.iter_web_results', side_effect=fake_web_hits)
+    def test_known_bad_hits_are_not_fetched(self, mock_search, mock_extract):
+        breaker.record_failure(("page", "https://site0.example/"), "Connection refused", ttl=60)
+        gathered = gather.gather_sources("question", include_youtube=False, max_web_results=2)
+
+        assert [source["url"] for source in gathered["web_sources"]] == ["https://site2.example/", "https://site3.example/"]
+        assert "https://site0.example/" not in [call.args[0] for call in mock_extract.call_args_list]
+        assert gathered["dropped_sources"][0]["reason"] == "failed recently: Connection refused"
@@ -0,0 +1,58 @@
+import sys
+import subprocess
+import threading
+from unittest.mock import MagicMock, patch
+from modules import clients
+
+
+class TestClients:
+
+    def setup_method(self):
+        clients.reset()
+
+    def teardown_method(self):
+        clients.reset()
+
+    def test_client_is_created_once_across_threads(self):
+        create = MagicMock(side_effect=lambda: object())
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(clients.get_client(("test",), create)))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert create.call_count == 1
+        assert all(result is results[0] for result in results)
+
+    def test_youtube_client_is_reused_per_thread(self):
+        with patch('googleapiclient.discovery.build', side_effect=lambda *args, **kwargs: object()) as build:
+            first = clients.youtube("key")
+            assert clients.youtube("key") is first
+            other = []
+            thread = threading.Thread(target=lambda: other.append(clients.youtube("key")))
+            thread.start()
+            thread.join()
+
+        assert build.call_count == 2
+        assert other[0] is not first
+
+    def test_gemini_uses_one_key_at_a_time(self):
+        with patch('google.generativeai.configure') as configure, \
+                patch('google.generativeai.GenerativeModel', side_effect=lambda name: MagicMock()):
+            model = clients.gemini_model("key")
+            assert clients.gemini_model("key") is model
+            assert clients.gemini_model("other-key") is not model
+            # The SDK now holds the other key, so the first key's model is not reused
+            assert clients.gemini_model("key") is not model
+
+        assert [call.kwargs["api_key"] for call in configure.call_args_list] == ["key", "other-key", "key"]
+
+    def test_pipeline_import_defers_heavy_sdks(self):
+        code = ("import sys, modules.pipeline, modules.service; "
+                "print(sorted(m for m in ('newspaper', 'google.generativeai', 'googleapiclient.discovery', "
+                "'duckduckgo_search', 'youtube_transcript_api') if m in sys.modules))")
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+
+        assert output.strip() == "[]"
@@ -0,0 +1,120 @@
+from unittest.mock import MagicMock, patch
+from modules.cache import ContentCache, normalize_url
+from modules.scraper import extract_web_content
+
+
+class FakeClock:
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def make_response(status_code=200, text="", headers=None, body=None):
+    response = MagicMock()
+    response.__enter__.return_value = response
+    response.status_code = status_code
+    response.headers = {"Content-Type": "text/html; charset=utf-8"} if headers is None else headers
+    body = text.encode("utf-8") if body is None else body
+    response.iter_content.return_value = iter([body[i:i + 1000] for i in range(0, len(body), 1000)])
+    return response
+
+
+ARTICLE_HTML = "<html><body><article><p>" + "Cached paragraph text. " * 20 + "</p></article></body></html>"
+
+
+class TestContentCache:
+
+    def test_normalize_url(self):
+        assert normalize_url("HTTPS://Example.com:443/a/?utm_source=x&b=2&a=1#top") == "https://example.com/a?a=1&b=2"
+        assert normalize_url("https://example.com") == "https://example.com/"
+
+    def test_entries_go_stale_after_ttl(self, tmp_path):
+        clock = FakeClock()
+        cache = ContentCache(str(tmp_path / "content.sqlite3"), ttl=60, clock=clock)
+        cache.put("https://example.com/a", "text " * 1000, etag='"v1"')
+
+        assert cache.get("https://example.com/a/").fresh
+        clock.now += 61
+        entry = cache.get("https://example.com/a")
+        assert not entry.fresh
+        assert entry.text == "text " * 1000
+        assert entry.etag == '"v1"'
+        assert cache.get("https://example.com/b") is None
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["stale"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_least_recently_used_entry_is_evicted(self, tmp_path):
+        clock = FakeClock()
+        cache = ContentCache(str(tmp_path / "content.sqlite3"), max_entries=2, clock=clock)
+        cache.put("https://example.com/1", "one")
+        clock.now += 1
+        cache.put("https://example.com/2", "two")
+        clock.now += 1
+        cache.get("https://example.com/1")
+        clock.now += 1
+        cache.put("https://example.com/3", "three")
+
+        assert cache.get("https://example.com/2") is None
+        assert cache.get("https://example.com/1").text == "one"
+        assert cache.stats()["evictions"] == 1
+        assert cache.stats()["entries"] == 2
+
+    def test_text_stored_under_another_version_is_discarded(self, tmp_path):
+        path = str(tmp_path / "content.sqlite3")
+        ContentCache(path, version=1).put("https://example.com/a", "truncated text")
+
+        assert ContentCache(path, version=1).get("https://example.com/a").text == "truncated text"
+        assert ContentCache(path, version=2).get("https://example.com/a") is None
+        ContentCache(path, version=2).put("https://example.com/a", "full text")
+        assert ContentCache(path, version=2).get("https://example.com/a").text == "full text"
+
+
+class TestCachedExtraction:
+
+    def test_fresh_hit_skips_download_and_parsing(self, tmp_path):
+        cache = ContentCache(str(tmp_path / "content.sqlite3"))
+        with patch('modules.scraper.get_content_cache', return_value=cache), \
+                patch('modules.scraper.http.get_session') as mock_session:
+            mock_get = mock_session.return_value.get
+            mock_get.return_value = make_response(text=ARTICLE_HTML)
+            first = extract_web_content("https://example.com/article")
+            with patch('newspaper.Article') as mock_article:
+                second = extract_web_content("https://example.com/article")
+
+        assert "Cached paragraph text." in first
+        assert second == first
+        assert mock_get.call_count == 1
+        mock_article.assert_not_called()
+
+    def test_thin_article_falls_back_without_second_download(self, tmp_path):
+        cache = ContentCache(str(tmp_path / "content.sqlite3"))
+        html = "<html><body><table><tr><td>" + "Reference row text. " * 10 + "</td></tr></table></body></html>"
+        with patch('modules.scraper.get_content_cache', return_value=cache), \
+                patch('modules.scraper.extract_article_text', return_value=""), \
+                patch('modules.scraper.http.get_session') as mock_session:
+            mock_get = mock_session.return_value.get
+            mock_get.return_value = make_response(text=html)
+            text = extract_web_content("https://example.com/table")
+
+        assert text.startswith("Reference row text.")
+        assert mock_get.call_count == 1
+
+    def test_stale_entry_is_revalidated(self, tmp_path):
+        clock = FakeClock()
+        cache = ContentCache(str(tmp_path / "content.sqlite3"), ttl=60, clock=clock)
+        cache.put("https://example.com/article", "old text", etag='"v1"')
+        clock.now += 61
+
+        with patch('modules.scraper.get_content_cache', return_value=cache), \
+                patch('modules.scraper.http.get_session') as mock_session:
+            mock_get = mock_session.return_value.get
+            mock_get.return_value = make_response(status_code=304)
+            text = extract_web_content("https://example.com/article")
+
+        assert text == "old text"
+        assert mock_get.call_args.kwargs["headers"]["If-None-Match"] == '"v1"'
+        assert cache.get("https://example.com/article").fresh
@@ -0,0 +1,82 @@
+from unittest.mock import patch
+from modules import pipeline
+from modules.corpus import SessionCorpus
+
+
+def page(i, text):
+    return {"title": f"Page {i}", "url": f"https://example.com/{i}", "content": text}
+
+
+VOLCANO = "Volcanoes erupt when magma rises through the crust and pressure builds in the chamber."
+LAVA = "Lava flows cool into basalt; the magma temperature decides how fluid the lava is."
+RECIPE = "Whisk the eggs with sugar and bake the sponge cake for thirty minutes."
+
+
+def gathered(*sources):
+    return {"web_results": [], "web_sources": list(sources), "youtube_results": [], "youtube_sources": [],
+            "search_reports": {"web": {"provider": "duckduckgo"}}, "dropped_sources": []}
+
+
+class TestSessionCorpus:
+
+    def test_lookup_finds_relevant_sources_best_first(self):
+        corpus = SessionCorpus()
+        corpus.add_gathered(gathered(page(0, RECIPE), page(1, LAVA), page(2, VOLCANO)))
+
+        found = corpus.lookup("Why do volcanoes erupt?")
+        assert [source["url"] for source in found.web_sources] == ["https://example.com/2"]
+        assert found.coverage == 1.0 and found.covered
+        assert not corpus.lookup("How do glaciers form?").covered
+
+    def test_terms_spread_over_unrelated_sources_are_not_coverage(self):
+        corpus = SessionCorpus()
+        corpus.add("web", page(0, "Solar panel efficiency depends on the cell material and the angle of the sun."))
+        corpus.add("web", page(1, "The state taxes income above the personal allowance at a flat rate."))
+
+        found = corpus.lookup("What is the income efficiency of a state?")
+        assert not found.covered and found.coverage < 0.8
+        assert [source["url"] for source in found.web_sources] == ["https://example.com/1"]
+        assert corpus.lookup("Why do volcanoes erupt?", include_web=False).web_sources == []
+
+    def test_oldest_sources_are_forgotten(self):
+        corpus = SessionCorpus(max_sources=2)
+        for i, text in enumerate([VOLCANO, LAVA, RECIPE]):
+            corpus.add("web", page(i, text))
+
+        assert len(corpus) == 2
+        assert corpus.lookup("volcanoes erupt").web_sources == []
+        assert [source["url"] for source in corpus.lookup("lava basalt").web_sources] == ["https://example.com/1"]
+        # A forgotten source can be stored again
+        assert corpus.add("web", page(0, VOLCANO))
+        assert [source["url"] for source in corpus.lookup("volcanoes erupt").web_sources] == ["https://example.com/0"]
+
+
+class TestFollowUps:
+
+    @patch('modules.pipeline.llm.generate_answer', return_value="Magma rises [1].")
+    @patch('modules.pipeline.gather.gather_sources', return_value=gathered(page(0, VOLCANO), page(1, LAVA)))
+    def test_covered_follow_up_does_not_search(self, mock_gather, mock_generate):
+        corpus = SessionCorpus()
+        pipeline.answer_question("Why do volcanoes erupt?", include_youtube=False, corpus=corpus)
+        follow_up = pipeline.answer_question("How fluid is the lava from magma?", include_youtube=False, corpus=corpus)
+
+        assert mock_gather.call_count == 1
+        # The volcano page only mentions magma, so it is not reused
+        assert [source["url"] for source in follow_up.web_sources] == ["https://example.com/1"]
+        assert follow_up.search_reports["corpus"] == {"coverage": 1.0, "searched": False, "reused": 1}
+        assert 'href="https://example.com/1"' in follow_up.processed_answer
+
+    @patch('modules.pipeline.llm.generate_answer', return_value="Glaciers [1] and magma [2].")
+    def test_partly_covered_follow_up_fetches_only_the_missing_slots(self, mock_generate):
+        corpus = SessionCorpus()
+        corpus.add("web", page(0, VOLCANO))
+        glacier = page(5, "Glaciers form where snow compacts into ice over many winters.")
+        with patch('modules.pipeline.gather.gather_sources', return_value=gathered(glacier)) as mock_gather:
+            result = pipeline.answer_question("Do glaciers melt when magma rises?", include_youtube=False,
+                                              max_web_results=3, corpus=corpus)
+
+        assert mock_gather.call_args.kwargs["max_web_results"] == 2
+        # New sources first, then the reused ones; citations follow that numbering
+        assert [source["url"] for source in result.web_sources] == ["https://example.com/5", "https://example.com/0"]
+        assert 'href="https://example.com/0"' in result.processed_answer
+        assert result.search_reports["corpus"]["searched"] and len(corpus) == 2
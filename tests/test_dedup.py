@@ -0,0 +1,72 @@
+import random
+from unittest.mock import patch
+from modules import gather
+from modules.dedup import NearDuplicateIndex, fingerprint, similarity
+
+
+def article(seed, words=300):
+    rng = random.Random(seed)
+    vocabulary = [f"word{i}" for i in range(2000)]
+    return " ".join(rng.choice(vocabulary) for _ in range(words))
+
+
+ARTICLE = article(1)
+# A syndicated copy: same body, different site chrome around it
+MIRROR = "Home | News | Subscribe now. " + ARTICLE + " Copyright 2024 Mirror Site. All rights reserved."
+
+
+class TestFingerprint:
+
+    def test_mirrored_copy_is_similar_and_other_article_is_not(self):
+        assert similarity(fingerprint(ARTICLE), fingerprint(MIRROR)) > 0.9
+        assert similarity(fingerprint(ARTICLE), fingerprint(article(2))) < 0.1
+
+    def test_short_texts_are_not_fingerprinted(self):
+        assert fingerprint("Error extracting content from https://example.com: 403 Forbidden") is None
+
+    def test_reupload_with_shifted_timestamps_is_a_duplicate(self):
+        lines = ARTICLE.split()
+        original = "".join(f"[{i // 60:02d}:{i % 60:02d}] {' '.join(lines[i:i + 10])}\n" for i in range(0, 300, 10))
+        reupload = "".join(f"[{(i + 7) // 60:02d}:{(i + 7) % 60:02d}] {' '.join(lines[i:i + 10])}\n" for i in range(0, 300, 10))
+        index = NearDuplicateIndex()
+
+        assert index.add("original", original) is None
+        assert index.add("reupload", reupload) == "original"
+
+
+CONTENT = {
+    "https://example.com/0": ARTICLE,
+    "https://example.com/1": MIRROR,
+    "https://example.com/2": article(2),
+    "https://example.com/3": article(3),
+}
+
+
+def fake_web_hits(query, max_results=5, report=None):
+    for i in range(min(max_results, 4)):
+        yield {"title": f"Page {i}", "url": f"https://example.com/{i}", "snippet": ""}
+
+
+class TestGatherDedup:
+
+    @patch('modules.gather.scraper.extract_web_content', side_effect=CONTENT.get)
+    @patch('modules.gather.search.iter_web_results', side_effect=fake_web_hits)
+    def test_duplicate_slot_goes_to_next_hit(self, mock_search, mock_extract):
+        gathered = gather.gather_sources("question", include_youtube=False, max_web_results=2)
+
+        # Citation numbers follow web_sources, so [2] is the next distinct page, not the mirror
+        assert [source["url"] for source in gathered["web_sources"]] == ["https://example.com/0", "https://example.com/2"]
+        assert gathered["dropped_sources"] == [{"type": "web", "title": "Page 1", "url": "https://example.com/1",
+                                                "reason": "near-duplicate of https://example.com/0"}]
+        assert [result["url"] for result in gathered["web_results"]] == [f"https://example.com/{i}" for i in range(3)]
+        # The last spare is never downloaded
+        assert sorted(call.args[0] for call in mock_extract.call_args_list) == [f"https://example.com/{i}" for i in range(3)]
+
+    @patch('modules.gather.scraper.extract_web_content', side_effect=CONTENT.get)
+    @patch('modules.gather.search.iter_web_results', side_effect=fake_web_hits)
+    def test_spares_are_not_fetched_without_duplicates(self, mock_search, mock_extract):
+        with patch('modules.gather.dedup.NearDuplicateIndex', lambda: NearDuplicateIndex(threshold=1.1)):
+            gathered = gather.gather_sources("question", include_youtube=False, max_web_results=2)
+
+        assert [source["url"] for source in gathered["web_sources"]] == ["https://example.com/0", "https://example.com/1"]
+        assert mock_extract.call_count == 2
@@ -0,0 +1,67 @@
+from unittest.mock import patch
+from modules import scraper
+from modules.scraper import decode_html, download_document, extract_web_content, sniff_document_kind
+from tests.test_content_cache import make_response
+
+
+class TestSniffing:
+
+    def test_document_kinds(self):
+        assert sniff_document_kind("text/html; charset=utf-8", b"<!doctype html>") == "html"
+        assert sniff_document_kind("", b"<html>") == "html"
+        assert sniff_document_kind("application/octet-stream", b"%PDF-1.7\n") == "pdf"
+        assert sniff_document_kind("application/pdf", b"<html>not really a pdf") is None
+        assert sniff_document_kind("image/png", b"\x89PNG\r\n") is None
+        assert sniff_document_kind("text/html", b"PK\x03\x04\x00\x00") is None
+
+    def test_decode_uses_header_then_meta_charset(self):
+        body = '<meta charset="iso-8859-1"><p>café</p>'.encode("iso-8859-1")
+
+        assert "café" in decode_html(body, "text/html")
+        assert "café" in decode_html("café".encode("utf-8"), "text/html; charset=UTF-8")
+
+
+class TestBoundedDownload:
+
+    def test_html_is_cut_at_byte_cap(self, monkeypatch):
+        monkeypatch.setattr(scraper, "MAX_HTML_BYTES", 2500)
+        response = make_response(text="<p>" + "x" * 10000 + "</p>")
+
+        kind, body, truncated = download_document(response)
+
+        assert (kind, len(body), truncated) == ("html", 2500, True)
+
+    def test_binary_is_rejected_after_first_chunk(self):
+        response = make_response(headers={"Content-Type": "video/mp4"}, body=b"\x00" * 5000)
+
+        with patch('modules.scraper.http.get_session') as mock_session:
+            mock_session.return_value.get.return_value = response
+            text = extract_web_content("https://example.com/video.mp4")
+
+        assert text == "Error extracting content from https://example.com/video.mp4: unsupported content type video/mp4"
+        assert response.iter_content.return_value.__length_hint__() == 4
+
+    def test_pdf_is_rejected_after_first_chunk_without_pypdf(self, monkeypatch):
+        monkeypatch.setattr(scraper, "PDF_SUPPORTED", False)
+        response = make_response(headers={"Content-Type": "application/pdf"}, body=b"%PDF-1.7\n" + b"0" * 5000)
+
+        with patch('modules.scraper.http.get_session') as mock_session:
+            mock_session.return_value.get.return_value = response
+            text = extract_web_content("https://example.com/paper.pdf")
+
+        assert text.endswith("PDF extraction requires the optional pypdf package")
+        assert response.iter_content.return_value.__length_hint__() == 5
+
+    def test_pdf_goes_to_pdf_extractor(self, monkeypatch):
+        monkeypatch.setattr(scraper, "PDF_SUPPORTED", True)
+        response = make_response(headers={"Content-Type": "application/pdf"}, body=b"%PDF-1.7\n" + b"0" * 3000)
+
+        with patch('modules.scraper.http.get_session') as mock_session, \
+                patch('modules.scraper.extract_pdf_text', return_value="Paper text") as mock_pdf, \
+                patch('modules.scraper.extract_article_text') as mock_article:
+            mock_session.return_value.get.return_value = response
+            text = extract_web_content("https://example.com/paper.pdf")
+
+        assert text == "Paper text"
+        assert mock_pdf.call_args.args[0].startswith(b"%PDF-1.7")
+        mock_article.assert_not_called()
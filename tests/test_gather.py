@@ -0,0 +1,142 @@
+import time
+from unittest.mock import patch
+from modules import gather
+from tests.test_content_cache import ARTICLE_HTML, make_response
+
+
+def slow_extract(url):
+    # Earlier hits finish last, so ordering cannot come from completion order
+    time.sleep(0.3 if url.endswith("/0") else 0.1)
+    return f"content of {url}"
+
+
+def fake_web_hits(query, max_results=5, report=None):
+    for i in range(max_results):
+        yield {"title": f"Page {i}", "url": f"https://example.com/{i}", "snippet": ""}
+
+
+class TestGatherSources:
+
+    @patch('modules.gather.scraper.extract_web_content', side_effect=slow_extract)
+    @patch('modules.gather.search.iter_web_results', side_effect=fake_web_hits)
+    def test_web_sources_keep_search_order(self, mock_search, mock_extract):
+        start = time.monotonic()
+        gathered = gather.gather_sources("question", include_youtube=False, max_web_results=4)
+        elapsed = time.monotonic() - start
+
+        urls = [source["url"] for source in gathered["web_sources"]]
+        assert urls == [f"https://example.com/{i}" for i in range(4)]
+        assert gathered["web_sources"][2]["content"] == "content of https://example.com/2"
+        # Fetches overlap: the total is close to the slowest fetch, not the sum
+        assert elapsed < 0.55
+
+    @patch('modules.gather.scraper.extract_web_content', side_effect=lambda url: time.sleep(1) or "late")
+    @patch('modules.gather.search.iter_web_results', side_effect=fake_web_hits)
+    def test_timed_out_fetch_is_dropped(self, mock_search, mock_extract):
+        gathered = gather.gather_sources("question", include_youtube=False, max_web_results=1, fetch_timeout=0.1)
+
+        assert gathered["web_sources"] == []
+        assert gathered["dropped_sources"] == [
+            {"type": "web", "title": "Page 0", "url": "https://example.com/0", "reason": "timed out after 0.1s"}
+        ]
+
+    @patch('modules.gather.scraper.extract_web_content', side_effect=slow_extract)
+    @patch('modules.gather.search.iter_web_results', side_effect=fake_web_hits)
+    def test_question_deadline_returns_partial_results(self, mock_search, mock_extract):
+        start = time.monotonic()
+        gathered = gather.gather_sources("question", include_youtube=False, max_web_results=3, deadline=0.2)
+        elapsed = time.monotonic() - start
+
+        assert [source["url"] for source in gathered["web_sources"]] == ["https://example.com/1", "https://example.com/2"]
+        assert gathered["dropped_sources"][0]["url"] == "https://example.com/0"
+        assert gathered["dropped_sources"][0]["reason"] == "question deadline reached"
+        assert elapsed < 0.3
+
+    @patch('modules.gather.search.iter_web_results', side_effect=fake_web_hits)
+    def test_hedged_fetch_uses_first_copy_to_finish(self, mock_search):
+        # Patched below the single-flight layer, so the hedge must start a download of its own
+        delays = iter([1.0, 0.05])
+
+        def slow_get(url, **kwargs):
+            time.sleep(next(delays))
+            return make_response(text=ARTICLE_HTML)
+
+        with patch('modules.scraper.http.get_session') as get_session:
+            get_session.return_value.get.side_effect = slow_get
+            start = time.monotonic()
+            gathered = gather.gather_sources("question", include_youtube=False, max_web_results=1, hedge_after=0.1)
+            elapsed = time.monotonic() - start
+
+        assert "Cached paragraph text." in gathered["web_sources"][0]["content"]
+        assert get_session.return_value.get.call_count == 2
+        assert elapsed < 0.5
+
+    @patch('modules.gather.scraper.get_video_transcript')
+    @patch('modules.gather.search.search_youtube')
+    def test_youtube_sources_include_formatted_transcript(self, mock_search, mock_transcript):
+        mock_search.return_value = [{"id": "abc", "title": "Video", "url": "https://www.youtube.com/watch?v=abc"}]
+        mock_transcript.return_value = [{"text": "Hello", "start": 1.0, "timestamp": "00:01", "timestamp_seconds": 1.0}]
+
+        gathered = gather.gather_sources("question", include_web=False)
+
+        assert gathered["youtube_sources"][0]["transcript_text"] == "[00:01] Hello\n"
+
+
+def topical_web_hits(query, max_results=5, report=None):
+    titles = ["Celebrity news", "Cheap flights", "Magma chambers explained", "How volcanoes erupt",
+              "Sports results", "Weather today"]
+    for i, title in enumerate(titles[:max_results]):
+        yield {"title": title, "url": f"https://example.com/{i}", "snippet": ""}
+
+
+class TestRankedFetching:
+
+    @patch('modules.gather.scraper.extract_web_content', side_effect=lambda url: f"content of {url}")
+    @patch('modules.gather.search.iter_web_results', side_effect=topical_web_hits)
+    def test_best_snippets_are_fetched_first(self, mock_search, mock_extract):
+        gathered = gather.gather_sources("Why do volcanoes erupt magma?", include_youtube=False, max_web_results=2)
+
+        assert mock_search.call_args.kwargs["max_results"] == 2 * gather.CANDIDATE_FACTOR + gather.SPARE_RESULTS
+        assert [source["url"] for source in gathered["web_sources"]] == ["https://example.com/3", "https://example.com/2"]
+        assert sorted(call.args[0] for call in mock_extract.call_args_list) == ["https://example.com/2",
+                                                                               "https://example.com/3"]
+
+    @patch('modules.gather.scraper.extract_web_content', side_effect=lambda url: f"{url} page " * 900)
+    @patch('modules.gather.search.iter_web_results', side_effect=fake_web_hits)
+    def test_fetching_stops_once_the_budget_is_met(self, mock_search, mock_extract, monkeypatch):
+        # Each page is about 6000 tokens; two are expected to fill the budget
+        monkeypatch.setattr(gather, "FETCH_TOKEN_BUDGET", 10000)
+        monkeypatch.setattr(gather, "EXPECTED_SOURCE_TOKENS", 6000)
+        gathered = gather.gather_sources("question", include_youtube=False, max_web_results=5)
+
+        assert len(gathered["web_sources"]) == 2
+        assert len(gathered["web_results"]) == 2
+        assert mock_extract.call_count == 2
+
+
+class TestSourceSelection:
+
+    def test_failed_source_is_replaced_by_the_next_hit(self):
+        hits = [{"title": f"Page {i}", "url": f"https://example.com/{i}"} for i in range(4)]
+        results = {0: "Error extracting content from https://example.com/0: 404 Client Error",
+                   1: "Pages about one thing.", 2: "Pages about something else entirely."}
+        dropped = []
+        selection = gather.SourceSelection("web", 2, dropped)
+        started = [selection.prefetch(hit) for hit in hits]
+        assert started == [True, True, False, False]
+
+        steps = selection.run(hits, started)
+        actions = []
+        reply = None
+        try:
+            while True:
+                action, i = steps.send(reply)
+                actions.append((action, i))
+                reply = (True, results[i]) if action == gather.WAIT else None
+        except StopIteration as done:
+            kept, used = done.value
+
+        assert actions == [("wait", 0), ("start", 2), ("wait", 1), ("wait", 2)]
+        assert [hit["url"] for hit, _ in kept] == ["https://example.com/1", "https://example.com/2"] and used == 3
+        assert dropped == [{"type": "web", "title": "Page 0", "url": "https://example.com/0",
+                            "reason": "failed: 404 Client Error"}]
@@ -0,0 +1,68 @@
+import random
+from unittest.mock import patch
+import pytest
+from benchmarks import loadtest, standins
+from benchmarks.standins import ServiceProfile, StandIns
+
+FAST = {name: ServiceProfile(median_ms=1, p99_ms=5, size=profile.size)
+        for name, profile in standins.DEFAULT_PROFILES.items()}
+FAST["web"] = ServiceProfile(median_ms=1, p99_ms=5, size=3000)
+FAST["transcript"] = ServiceProfile(median_ms=1, p99_ms=5, size=20)
+
+
+class TestStandIns:
+
+    def test_latency_follows_the_profile(self):
+        profile = ServiceProfile(median_ms=100, p99_ms=1000)
+        rng = random.Random(1)
+        samples = sorted(profile.sample_seconds(rng) for _ in range(5000))
+
+        assert 0.09 < samples[2500] < 0.11
+        assert 0.8 < samples[4950] < 1.25
+
+    def test_settings_override_one_field(self):
+        profiles = standins.parse_profile_setting("gemini.median_ms=800", {})
+        profiles = standins.parse_profile_setting("gemini.error_rate=0.5", profiles)
+
+        assert profiles["gemini"] == ServiceProfile(median_ms=800, p99_ms=9000, error_rate=0.5, size=1500)
+        with pytest.raises(ValueError):
+            standins.parse_profile_setting("bing.median_ms=1", {})
+
+    def test_pages_are_stable_and_sized(self):
+        stand_ins = StandIns(FAST)
+
+        assert stand_ins.page("https://a.example/1") == stand_ins.page("https://a.example/1")
+        assert stand_ins.page("https://a.example/1") != stand_ins.page("https://a.example/2")
+        assert 3000 <= len(stand_ins.page("https://a.example/1")) < 4000
+
+
+class TestLoadTest:
+
+    def test_users_answer_every_question_offline(self):
+        stand_ins = StandIns(FAST)
+        questions = loadtest.make_questions(6, distinct=3)
+        with patch('requests.Session.request', side_effect=AssertionError("network used")):
+            report = loadtest.run_load(3, questions, stand_ins, stream=True)
+
+        assert report["ok"] == 6 and report["failed"] == 0
+        assert report["latency"]["total"]["count"] == 6
+        assert report["stages"]["gather"]["count"] == 6
+        # Repeated questions are answered from the caches
+        assert stand_ins.calls["gemini"] == 3
+        assert stand_ins.calls["web"] > 0 and stand_ins.calls["transcript"] > 0
+        assert "throughput" in loadtest.format_report(report, baseline=report)
+
+    def test_memory_is_attributed_to_pipeline_modules(self):
+        report = loadtest.run_load(2, loadtest.make_questions(2, distinct=2), StandIns(FAST), measure_memory=True)
+
+        assert report["memory"]["peak_traced_mb"] > 0
+        assert set(report["memory"]["by_module_mb"]) & {"scraper", "transcripts", "cache", "llm"}
+
+    def test_failing_services_are_counted_not_fatal(self):
+        profiles = dict(FAST, web=ServiceProfile(median_ms=1, p99_ms=5, error_rate=1.0, size=3000))
+        stand_ins = StandIns(profiles)
+        report = loadtest.run_load(2, loadtest.make_questions(2, distinct=2), stand_ins,
+                                   options={"include_youtube": False})
+
+        assert report["questions"] == 2
+        assert report["services"]["web"]["errors"] == report["services"]["web"]["calls"] > 0
@@ -0,0 +1,80 @@
+import time
+from unittest.mock import patch
+from modules import citations, llm
+from tests.fake_gemini import FakeGeminiModel
+
+
+def web_sources(count):
+    return [{"title": f"Page {i}", "url": f"https://example.com/{i}",
+             "content": f"Fact number {i} about the topic.\nMore detail on page {i}."}
+            for i in range(1, count + 1)]
+
+
+YOUTUBE_SOURCES = [{"id": "vid", "title": "Video", "url": "https://www.youtube.com/watch?v=vid",
+                    "transcript_text": "[01:45] The video fact.\n[02:00] More.\n"}]
+
+
+@patch.dict('os.environ', {'GEMINI_API_KEY': 'test-key'})
+class TestMapReduce:
+
+    def test_thirty_sources_are_mapped_in_parallel_then_reduced_once(self):
+        model = FakeGeminiModel(delay=0.05)
+        sources = web_sources(30)
+        with patch('modules.llm.clients.gemini_model', return_value=model):
+            start = time.monotonic()
+            answer = llm.generate_answer("What are the facts?", sources, YOUTUBE_SOURCES)
+            elapsed = time.monotonic() - start
+
+        assert len(model.map_prompts()) == 31
+        assert len(model.reduce_prompts()) == 1
+        assert model.max_active <= llm.MAP_CONCURRENCY
+        # Four rounds of eight map calls plus the reduce call, not 32 calls in a row
+        assert elapsed < 0.6
+        assert "Fact number 30 about the topic. [30]" in answer
+        assert "The video fact. [31][01:45]" in answer
+
+    def test_reduce_keeps_numbers_and_skips_sources_without_facts(self):
+        model = FakeGeminiModel()
+        sources = web_sources(3)
+        sources[1]["content"] = "An unrelated page."
+        with patch('modules.llm.clients.gemini_model', return_value=model):
+            answer = llm.generate_answer("What are the facts?", sources, YOUTUBE_SOURCES, map_reduce=True)
+
+        reduce_prompt = model.reduce_prompts()[0]
+        assert "SOURCE 2 (WEB)" not in reduce_prompt
+        assert "SOURCE 3 (WEB): https://example.com/3" in reduce_prompt
+        assert "INSTRUCTIONS:" in reduce_prompt
+        processed, _, earliest = citations.process_citations(answer, sources, YOUTUBE_SOURCES)
+        assert '<a href="https://example.com/3" target="_blank">[3]</a>' in processed
+        assert earliest[4]["timestamp"] == "01:45"
+
+    def test_few_sources_use_a_single_prompt(self):
+        model = FakeGeminiModel()
+        with patch('modules.llm.clients.gemini_model', return_value=model):
+            llm.generate_answer("What are the facts?", web_sources(2), [])
+
+        assert model.map_prompts() == []
+        assert len(model.reduce_prompts()) == 1
+
+    def test_reduce_call_streams(self):
+        model = FakeGeminiModel()
+        with patch('modules.llm.clients.gemini_model', return_value=model):
+            chunks = list(llm.stream_answer("What are the facts?", web_sources(2), [], map_reduce=True))
+
+        assert len(chunks) == 2
+        assert "".join(chunks).startswith("Fact number 1 about the topic. [1] Fact number 2")
+
+    def test_failed_map_calls_leave_the_source_out(self):
+        model = FakeGeminiModel()
+        generate = model.generate_content
+
+        def flaky(contents, **kwargs):
+            if "SOURCE 1 (WEB)" in contents[0]["parts"][0]["text"] and "Extract the facts" in contents[0]["parts"][0]["text"]:
+                raise RuntimeError("model overloaded")
+            return generate(contents, **kwargs)
+
+        with patch('modules.llm.clients.gemini_model', return_value=model), \
+                patch.object(model, "generate_content", side_effect=flaky):
+            answer = llm.generate_answer("What are the facts?", web_sources(2), [], map_reduce=True)
+
+        assert answer.startswith("Fact number 2 about the topic. [2]")
@@ -0,0 +1,91 @@
+import os
+import socket
+import time
+import pytest
+from modules import parsing, scraper
+from modules.parsing import ParseLimitExceeded
+
+
+ARTICLE_HTML = ("<html><head><title>Solar</title></head><body><article>"
+                + "<p>Solar panels turn sunlight into electricity using photovoltaic cells made of silicon.</p>" * 20
+                + "</article></body></html>").encode("utf-8")
+
+
+def worker_pid():
+    return os.getpid()
+
+
+def spin():
+    while True:
+        pass
+
+
+def allocate(megabytes):
+    return len(bytearray(megabytes * 1024 * 1024))
+
+
+def crash():
+    os._exit(1)
+
+
+class TestParseDocument:
+
+    def test_parsing_makes_no_network_calls(self, monkeypatch):
+        def no_network(*args, **kwargs):
+            raise AssertionError("network call while parsing")
+
+        monkeypatch.setattr(socket, "getaddrinfo", no_network)
+        monkeypatch.setattr(socket, "create_connection", no_network)
+        html = ARTICLE_HTML.replace(b"<article>", b'<article><img src="https://images.example/a.jpg" width="800">'
+                                                 b'<img src="https://cdn.example/b.png">')
+
+        text = scraper.parse_document("https://example.com/solar", "html", html, "text/html")
+
+        assert "photovoltaic cells" in text
+
+
+class TestParsingWorkers:
+
+    @pytest.fixture(autouse=True)
+    def workers(self, monkeypatch):
+        monkeypatch.setattr(parsing, "PARSE_WORKERS", 2)
+        monkeypatch.setattr(parsing, "PARSE_CPU_SECONDS", 0.5)
+        monkeypatch.setattr(parsing, "_pool", None)
+        yield
+        parsing.shutdown()
+
+    def test_documents_are_parsed_in_another_process(self):
+        text = parsing.run(scraper.parse_document, "https://example.com/solar", "html", ARTICLE_HTML, "text/html")
+
+        assert "photovoltaic cells" in text
+        assert text == scraper.parse_document("https://example.com/solar", "html", ARTICLE_HTML, "text/html")
+        assert parsing.run(worker_pid) != os.getpid()
+
+    def test_cpu_limit_stops_a_runaway_parse(self):
+        start = time.monotonic()
+        with pytest.raises(ParseLimitExceeded, match="0.5s of CPU time"):
+            parsing.run(spin)
+
+        assert time.monotonic() - start < 5
+        assert parsing.run(worker_pid) != os.getpid()
+
+    def test_memory_limit_raises_memory_error(self, monkeypatch):
+        monkeypatch.setattr(parsing, "_pool", parsing.create_pool(1, memory_mb=512))
+
+        with pytest.raises(MemoryError):
+            parsing.run(allocate, 1024)
+        assert parsing.run(allocate, 16) == 16 * 1024 * 1024
+
+    def test_workers_are_recycled(self, monkeypatch):
+        monkeypatch.setattr(parsing, "_pool", parsing.create_pool(1, tasks_per_worker=2))
+
+        pids = [parsing.run(worker_pid) for _ in range(4)]
+
+        assert pids[0] == pids[1]
+        assert pids[2] != pids[0]
+
+    def test_crashed_worker_is_replaced(self):
+        with pytest.raises(ParseLimitExceeded, match="worker was killed"):
+            parsing.run(crash)
+
+        assert isinstance(parsing.run(worker_pid), int)
@@ -0,0 +1,129 @@
+import json
+from unittest.mock import MagicMock, patch
+from modules import batch, pipeline, ratelimit
+from modules.ratelimit import RateLimiter
+
+
+GATHERED = {
+    "web_results": [{"title": "Web Article", "url": "https://example.com", "snippet": ""}],
+    "web_sources": [{"title": "Web Article", "url": "https://example.com", "content": "Fact."}],
+    "youtube_results": [{"id": "abcd1234", "title": "Video", "url": "https://youtube.com/watch?v=abcd1234"}],
+    "youtube_sources": [{"id": "abcd1234", "title": "Video", "url": "https://youtube.com/watch?v=abcd1234",
+                         "transcript": "", "transcript_text": "[01:00] Fact.\n"}],
+    "search_reports": {"web": {"provider": "duckduckgo", "cached": False, "stale": False}},
+}
+ANSWER = "First fact [1]. Second fact [2][01:45].\n\nSOURCES:\n1. Web Article\n2. Video"
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestAnswerQuestion:
+
+    @patch('modules.pipeline.llm.generate_answer', return_value=ANSWER)
+    @patch('modules.pipeline.gather.gather_sources', return_value=GATHERED)
+    def test_result_has_linked_answer_and_timestamps(self, mock_gather, mock_generate):
+        result = pipeline.answer_question("question")
+
+        assert '<a href="https://youtube.com/watch?v=abcd1234&t=105s" target="_blank">[2][01:45]</a>' in result.processed_answer
+        assert result.earliest_timestamps[2]["seconds"] == 105
+        assert result.error is None
+        assert set(result.timings) == {"gather", "time_to_first_token", "generation", "total"}
+
+        record = json.loads(json.dumps(result.to_dict()))
+        assert [source["number"] for source in record["sources"]] == [1, 2]
+        assert record["sources"][1]["earliest_timestamp"] == "01:45"
+        assert record["trace_id"] == result.trace.id
+
+    @patch('modules.pipeline.llm.stream_answer', return_value=iter(["First fact [", "1]. Second", " fact."]))
+    @patch('modules.pipeline.gather.gather_sources', return_value=GATHERED)
+    def test_streaming_calls_on_chunk_with_linked_sentences(self, mock_gather, mock_stream):
+        chunks = []
+        result = pipeline.answer_question("question", on_chunk=chunks.append)
+
+        assert "".join(chunks) == result.processed_answer
+        assert chunks[1].endswith("</a>. ")
+        assert result.answer == "First fact [1]. Second fact."
+
+    @patch('modules.pipeline.llm.generate_answer', return_value="Error: Gemini API Key not configured")
+    @patch('modules.pipeline.gather.gather_sources', return_value=GATHERED)
+    def test_generation_error_is_reported(self, mock_gather, mock_generate):
+        assert pipeline.answer_question("question").error == "Error: Gemini API Key not configured"
+
+    @patch.dict('os.environ', {'GEMINI_API_KEY': 'test-key'})
+    @patch('modules.pipeline.gather.gather_sources', return_value=GATHERED)
+    def test_stream_failing_part_way_is_an_error(self, mock_gather):
+        def chunks():
+            yield MagicMock(text="First fact [1]. ")
+            raise RuntimeError("503 Service Unavailable")
+
+        model = MagicMock()
+        model.generate_content.return_value = chunks()
+        streamed = []
+        with patch('modules.llm.clients.gemini_model', return_value=model):
+            result = pipeline.answer_question("question", on_chunk=streamed.append)
+
+        assert result.answer == "First fact [1]. "
+        assert result.error == "Error generating answer: 503 Service Unavailable"
+        assert result.to_dict()["error"] == result.error
+        assert "Error" not in "".join(streamed)
+
+
+class TestBatch:
+
+    def write_questions(self, path, ids):
+        path.write_text("".join(json.dumps({"request_id": i, "title": f"Title {i}", "body": "Body"}) + "\n" for i in ids))
+
+    def fake_answer(self, question_id, question, options):
+        return {"id": question_id, "question": question, "status": "error" if "bad" in question_id else "ok"}
+
+    def test_resume_skips_answered_and_retries_failed(self, tmp_path):
+        questions, output = tmp_path / "questions.jsonl", tmp_path / "answers.jsonl"
+        self.write_questions(questions, ["q1", "bad-q2", "q3"])
+        output.write_text(json.dumps({"id": "q1", "status": "ok"}) + "\n" + json.dumps({"id": "bad-q2", "status": "error"}) + "\n{\"id\": \"q3\", \"st")
+
+        with patch('modules.batch.answer_one', side_effect=self.fake_answer) as mock_answer:
+            counts = batch.run_batch(str(questions), str(output), concurrency=2)
+
+        assert counts == {"skipped": 1, "ok": 1, "failed": 1}
+        assert sorted(call.args[0] for call in mock_answer.call_args_list) == ["bad-q2", "q3"]
+        assert mock_answer.call_args_list[0].args[1].startswith("Title ")
+        records = [json.loads(line) for line in output.read_text().splitlines()[3:]]
+        assert sorted(record["id"] for record in records) == ["bad-q2", "q3"]
+
+    @patch('modules.batch.pipeline.answer_question', side_effect=RuntimeError("boom"))
+    def test_exception_becomes_error_record(self, mock_answer):
+        record = batch.answer_one("q1", "question", {})
+
+        assert record == {"id": "q1", "question": "question", "status": "error", "error": "RuntimeError: boom"}
+
+
+class TestRateLimiter:
+
+    def test_calls_are_spaced_after_burst(self):
+        clock = FakeClock()
+        limiter = RateLimiter(rate=2, burst=2, clock=clock, sleep=clock.sleep)
+
+        waits = [limiter.acquire() for _ in range(4)]
+
+        assert waits == [0.0, 0.0, 0.5, 0.5]
+        assert clock.now == 1.0
+
+    def test_configure_and_env(self, monkeypatch):
+        monkeypatch.setattr(ratelimit, "_limiters", {})
+        monkeypatch.setenv("SERPAPI_RATE_LIMIT", "0.5")
+
+        ratelimit.configure({"gemini": 1.0})
+
+        assert ratelimit.get_limiter("gemini").rate == 1.0
+        assert ratelimit.get_limiter("serpapi").rate == 0.5
+        assert ratelimit.get_limiter("duckduckgo") is None
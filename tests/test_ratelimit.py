@@ -0,0 +1,180 @@
+import threading
+import time
+from unittest.mock import MagicMock, patch
+import pytest
+from modules import ratelimit
+from modules.ratelimit import BATCH, INTERACTIVE, QuotaExceeded, QuotaLedger, RateLimiter
+from modules.search import search_youtube
+from tests.fake_youtube import FakeYouTubeClient
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class SteppedClock(FakeClock):
+    """A simulated clock that only moves when the test advances it, so sleepers block."""
+
+    def sleep(self, seconds):
+        target = self.now + seconds
+        while self.now < target:
+            time.sleep(0.001)
+
+
+def wait_until(condition):
+    deadline = time.monotonic() + 2
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def rate_limited_error(retry_after=None):
+    error = Exception("429 Too Many Requests")
+    error.response = MagicMock(status_code=429, headers={"Retry-After": retry_after} if retry_after else {})
+    return error
+
+
+class TestRateLimiterScheduling:
+
+    def test_large_cost_waits_for_full_bucket_and_leaves_debt(self):
+        clock = FakeClock()
+        tokens = RateLimiter(rate=10, burst=100, clock=clock, sleep=clock.sleep)
+
+        assert tokens.acquire(150) == 0.0
+        # 50 tokens of debt plus the 10 requested refill at 10 per second
+        assert tokens.acquire(10) == 6.0
+
+    def test_interactive_callers_overtake_waiting_batch_callers(self):
+        clock = SteppedClock()
+        limiter = RateLimiter(rate=1, clock=clock, sleep=clock.sleep)
+        limiter.acquire()
+        order = []
+
+        def take(name, priority):
+            limiter.acquire(priority=priority)
+            order.append(name)
+
+        threads = [threading.Thread(target=take, args=("batch", BATCH)),
+                   threading.Thread(target=take, args=("interactive", INTERACTIVE))]
+        threads[0].start()
+        wait_until(lambda: len(limiter._waiting) == 1)
+        threads[1].start()
+        wait_until(lambda: len(limiter._waiting) == 2)
+        clock.now += 1
+        wait_until(lambda: order == ["interactive"])
+        clock.now += 1
+        for thread in threads:
+            thread.join(timeout=2)
+
+        assert order == ["interactive", "batch"]
+
+    def test_rejections_halve_the_rate_and_successes_restore_it(self):
+        limiter = RateLimiter(rate=8)
+
+        for _ in range(5):
+            limiter.slow_down()
+        assert limiter.rate == 1.0
+        for _ in range(30):
+            limiter.speed_up()
+        assert limiter.rate == 8
+
+
+class TestQuotaLedger:
+
+    def test_batch_callers_leave_a_share_for_interactive_ones(self):
+        ledger = QuotaLedger({"youtube": 1000}, clock=FakeClock())
+        for _ in range(8):
+            ledger.charge("youtube", 100, BATCH)
+
+        with pytest.raises(QuotaExceeded):
+            ledger.charge("youtube", 100, BATCH)
+        ledger.charge("youtube", 100, INTERACTIVE)
+        ledger.charge("youtube", 100, INTERACTIVE)
+        with pytest.raises(QuotaExceeded):
+            ledger.charge("youtube", 1, INTERACTIVE)
+        assert ledger.usage() == {"youtube": {"used": 1000, "limit": 1000}}
+
+    def test_quota_resets_at_midnight_of_its_time_zone(self):
+        clock = FakeClock()
+        clock.now = 86400 + 7 * 3600  # 23:00 Pacific
+        ledger = QuotaLedger({"youtube": 100}, clock=clock, utc_offset_hours=-8)
+        ledger.charge("youtube", 100)
+
+        clock.now += 3600
+        ledger.charge("youtube", 100)
+
+    def test_processes_share_a_stored_ledger(self, tmp_path):
+        clock = FakeClock()
+        path = str(tmp_path / "quota.sqlite3")
+        app, worker = (QuotaLedger({"youtube": 250}, clock=clock, path=path) for _ in range(2))
+        app.charge("youtube", 100)
+        worker.charge("youtube", 100)
+
+        with pytest.raises(QuotaExceeded, match="200 of 250"):
+            app.charge("youtube", 100)
+        # A restarted process starts from what was spent today
+        restarted = QuotaLedger({"youtube": 250}, clock=clock, path=path)
+        restarted.charge("youtube", 50)
+        assert worker.usage() == {"youtube": {"used": 250, "limit": 250}}
+        restarted.exhaust("youtube")
+        clock.now += 86400
+        assert app.usage() == {"youtube": {"used": 0, "limit": 250}}
+
+
+class TestCall:
+
+    def setup_method(self):
+        self.clock = FakeClock()
+
+    def test_429_is_retried_with_jittered_backoff(self, monkeypatch):
+        monkeypatch.setattr(ratelimit, "_sleep", self.clock.sleep)
+        monkeypatch.setattr(ratelimit, "_random", MagicMock(uniform=lambda low, high: high / 2))
+        fn = MagicMock(side_effect=[rate_limited_error(), rate_limited_error(), "ok"])
+
+        assert ratelimit.call("serpapi", "search", fn) == "ok"
+        assert self.clock.sleeps == [0.5, 1.0]
+
+    def test_retry_after_is_respected_and_rate_lowered(self, monkeypatch):
+        monkeypatch.setattr(ratelimit, "_sleep", self.clock.sleep)
+        ratelimit.configure({"gemini": 2.0})
+        fn = MagicMock(side_effect=[rate_limited_error("7"), "ok"])
+
+        assert ratelimit.call("gemini", "generate_content", fn) == "ok"
+        assert self.clock.sleeps == [7.0]
+        assert ratelimit.get_limiter("gemini").rate == 1.1
+
+    def test_gives_up_after_max_retries(self, monkeypatch):
+        monkeypatch.setattr(ratelimit, "_sleep", self.clock.sleep)
+        fn = MagicMock(side_effect=rate_limited_error())
+
+        with pytest.raises(Exception, match="429"):
+            ratelimit.call("serpapi", "search", fn)
+        assert fn.call_count == ratelimit.MAX_RETRIES + 1
+
+    def test_other_errors_are_not_retried(self):
+        fn = MagicMock(side_effect=ValueError("bad request"))
+
+        with pytest.raises(ValueError):
+            ratelimit.call("serpapi", "search", fn)
+        assert fn.call_count == 1
+
+    @patch.dict('os.environ', {'YOUTUBE_API_KEY': 'test-key', 'YOUTUBE_DAILY_QUOTA': '250'})
+    def test_youtube_search_charges_quota_and_degrades_to_no_videos(self):
+        client = FakeYouTubeClient([{"id": f"vid{i}", "title": f"Video {i}"} for i in range(6)])
+        with patch('modules.search.clients.youtube', return_value=client), patch('modules.search.st'):
+            assert len(search_youtube("first query", max_results=3)) == 3
+            assert len(search_youtube("second query", max_results=3)) == 3
+            assert search_youtube("third query", max_results=3) == []
+
+        # Two searches at 100 units plus two videos.list calls at 1 unit
+        assert ratelimit.get_ledger().usage()["youtube"] == {"used": 202, "limit": 250}
@@ -0,0 +1,66 @@
+from modules.llm import build_prompt
+from modules.retrieval import BM25Index, chunk_text, estimate_tokens, rank_hits, select_passages
+from modules.transcripts import Transcript
+
+
+BOILERPLATE = "\n".join(f"Menu item {i}. Subscribe to our newsletter for weekly updates." for i in range(200))
+RELEVANT = "The mitochondria is the powerhouse of the cell and produces ATP through respiration."
+
+
+class TestRetrieval:
+
+    def test_chunks_keep_paragraphs_and_respect_size(self):
+        chunks = chunk_text(BOILERPLATE, chunk_chars=500)
+
+        assert all(len(chunk) <= 500 for chunk in chunks)
+        assert "\n".join(chunks) == BOILERPLATE
+
+    def test_bm25_ranks_matching_passage_first(self):
+        index = BM25Index(["cats and dogs", "mitochondria produce ATP", "the weather today"])
+        scores = index.score("What do mitochondria produce?")
+
+        assert scores.argmax() == 1
+        assert scores[0] == 0
+
+    def test_hits_are_ranked_by_snippet_then_engine_order(self):
+        texts = [
+            "Top 10 gadgets of the year",
+            "Mitochondria: how the cell makes ATP",
+            "Mitochondria explained",
+            "Best recipes",
+        ]
+
+        assert rank_hits("How do mitochondria make ATP?", texts) == [1, 2, 0, 3]
+        # Without a snippet match, the engine's order stands
+        assert rank_hits("unrelated question", texts) == [0, 1, 2, 3]
+        assert rank_hits("question", []) == []
+
+    def test_relevant_passage_survives_past_boilerplate(self):
+        page = BOILERPLATE + "\n" + RELEVANT
+        passages = select_passages("What produces ATP in the cell?", [page], token_budget=300)
+
+        assert RELEVANT in passages[0]
+        assert estimate_tokens(passages[0]) <= 300 + 10
+        # The old approach kept only the leading boilerplate
+        assert RELEVANT not in page[:8000]
+
+    def test_every_source_keeps_a_passage_and_transcript_timestamps(self):
+        transcript = Transcript.from_segments("vid", [
+            {"text": "welcome back", "start": 0.0},
+            {"text": "ATP is made by mitochondria", "start": 95.0},
+        ])
+        passages = select_passages("mitochondria ATP", [BOILERPLATE, "Unrelated page.", transcript], token_budget=50)
+
+        assert passages[1] == "Unrelated page."
+        assert "[01:35] ATP is made by mitochondria" in passages[2]
+
+    def test_prompt_numbering_is_unchanged(self):
+        prompt = build_prompt(
+            "What produces ATP?",
+            [{"url": "https://a.example", "content": BOILERPLATE}, {"url": "https://b.example", "content": RELEVANT}],
+            [{"url": "https://www.youtube.com/watch?v=vid", "transcript_text": "[00:05] ATP talk"}]
+        )
+
+        assert "SOURCE 1 (WEB): https://a.example" in prompt
+        assert "SOURCE 2 (WEB): https://b.example\n" + RELEVANT in prompt
+        assert "SOURCE 3 (YOUTUBE): https://www.youtube.com/watch?v=vid\n[00:05] ATP talk" in prompt
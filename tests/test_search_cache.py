@@ -0,0 +1,75 @@
+import time
+from unittest.mock import patch
+from modules import clients, search
+from modules.cache import MemoryCache
+from modules.search import normalize_query, search_web
+
+
+def fake_stream(query, max_results, answered):
+    answered["provider"] = "duckduckgo"
+    for i in range(max_results):
+        yield {"title": f"{query} {i}", "url": f"https://example.com/{i}", "snippet": ""}
+
+
+class FakeClock:
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestSearchCache:
+
+    def test_normalize_query(self):
+        assert normalize_query("  What is  Python?? ") == "what is python"
+        assert normalize_query("what-is python") == normalize_query("What is Python")
+
+    @patch('modules.search._stream_web_results', side_effect=fake_stream)
+    def test_equivalent_queries_share_cached_results(self, mock_stream):
+        first_report, second_report = {}, {}
+        first = search_web("What is Python?", max_results=3, report=first_report)
+        second = search_web("what is python", max_results=3, report=second_report)
+
+        assert second == first
+        assert mock_stream.call_count == 1
+        assert first_report == {"provider": "duckduckgo", "cached": False, "stale": False}
+        assert second_report == {"provider": "duckduckgo", "cached": True, "stale": False}
+
+        search_web("what is python", max_results=5)
+        assert mock_stream.call_count == 2
+
+    @patch('modules.search._stream_web_results', side_effect=fake_stream)
+    def test_stale_results_are_served_while_refreshing(self, mock_stream, monkeypatch):
+        clock = FakeClock()
+        monkeypatch.setattr(search, "_search_cache", MemoryCache(clock=clock))
+        search_web("python", max_results=2)
+        clock.now += search.SEARCH_CACHE_TTL_SECONDS["duckduckgo"] + 1
+
+        report = {}
+        results = search_web("python", max_results=2, report=report)
+
+        assert len(results) == 2
+        assert report == {"provider": "duckduckgo", "cached": True, "stale": True}
+        deadline = time.monotonic() + 2
+        while mock_stream.call_count < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert mock_stream.call_count == 2
+        while search._refreshing and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert search._search_cache.get(("web", "python", 2)).fresh
+
+    def test_refreshes_reuse_their_threads_youtube_client(self):
+        built = []
+        done = []
+        with patch('googleapiclient.discovery.build', side_effect=lambda *args, **kwargs: built.append(1) or object()):
+            for i in range(3):
+                search._refresh_in_background(("youtube", f"query {i}"), lambda: clients.youtube("refresh-test-key"))
+                deadline = time.monotonic() + 2
+                while search._refreshing and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                done.append(not search._refreshing)
+
+        assert all(done)
+        assert len(built) == 1
@@ -0,0 +1,124 @@
+import asyncio
+import time
+from unittest.mock import patch
+from starlette.testclient import TestClient
+from modules import service
+from modules.service import ServiceState
+
+
+def fake_search_web(query, max_results=5, report=None):
+    time.sleep(0.05)
+    report.update({"provider": "duckduckgo", "cached": False, "stale": False})
+    return [{"title": f"Page {i}", "url": f"https://example.com/{i}", "snippet": ""} for i in range(max_results)]
+
+
+def fake_extract(url):
+    time.sleep(0.1)
+    return f"content of {url}"
+
+
+def fake_generate(question, web_sources, youtube_sources):
+    time.sleep(0.05)
+    return f"Answer to {question} [1].\n\nSOURCES:\n1. Page 0"
+
+
+class TestService:
+
+    def setup_method(self):
+        self.patches = [
+            patch('modules.service.search.search_web', side_effect=fake_search_web),
+            patch('modules.service.scraper.extract_web_content', side_effect=fake_extract),
+            patch('modules.service.llm.generate_answer', side_effect=fake_generate),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def teardown_method(self):
+        for p in self.patches:
+            p.stop()
+
+    def test_answer_endpoint(self):
+        client = TestClient(service.create_app(ServiceState()))
+
+        response = client.post("/answer", json={"question": "What is it?", "sources": "web", "max_web_results": 2})
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["answer"].startswith("Answer to What is it?")
+        assert '<a href="https://example.com/0" target="_blank">[1]</a>' in data["processed_answer"]
+        assert [source["url"] for source in data["sources"]] == ["https://example.com/0", "https://example.com/1"]
+        assert data["search_reports"] == {"web": {"provider": "duckduckgo", "cached": False, "stale": False}}
+        assert client.get("/stats").json()["service"]["answered"] == 1
+
+    def test_full_queue_is_rejected_with_429(self):
+        state = ServiceState(max_in_flight=1, max_queued=0)
+        state.pending = 1  # one question already being answered
+        client = TestClient(service.create_app(state))
+
+        response = client.post("/answer", json={"question": "What is it?"})
+
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "1"
+        assert state.counters["rejected"] == 1
+
+    def test_bad_request(self):
+        client = TestClient(service.create_app(ServiceState()))
+
+        assert client.post("/answer", json={}).status_code == 400
+        assert client.post("/answer", content=b"not json").status_code == 400
+        for options in ({"max_web_results": "many"}, {"max_youtube_results": 0}, {"deadline": -1},
+                        {"deadline": "NaN"}, {"max_web_results": True}):
+            response = client.post("/answer", json={"question": "What is it?", **options})
+            assert response.status_code == 400 and "positive number" in response.json()["error"]
+
+    def test_large_options_are_lowered_to_the_limits(self):
+        client = TestClient(service.create_app(ServiceState()))
+        with patch('modules.service.answer_question', wraps=service.answer_question) as answer:
+            response = client.post("/answer", json={"question": "What is it?", "sources": "web",
+                                                    "max_web_results": 10 ** 6, "deadline": 1e9})
+
+        assert response.status_code == 200
+        assert answer.call_args.kwargs["max_web_results"] == service.SERVICE_MAX_WEB_RESULTS
+        assert answer.call_args.kwargs["deadline"] == service.SERVICE_MAX_DEADLINE_SECONDS
+
+    def test_questions_run_concurrently_within_backend_limits(self):
+        state = ServiceState(backend_concurrency={"scrape": 10})
+
+        async def run_many():
+            return await asyncio.gather(*(
+                service.answer_question(state, f"question {i}", include_youtube=False, max_web_results=5)
+                for i in range(4)
+            ))
+
+        start = time.monotonic()
+        results = asyncio.run(run_many())
+        elapsed = time.monotonic() - start
+
+        assert [result.question for result in results] == [f"question {i}" for i in range(4)]
+        # 20 fetches of 0.1s with 10 at a time take two rounds, not twenty
+        assert elapsed < 0.6
+        assert all(len(result.web_sources) == 5 for result in results)
+
+    def test_abandoned_call_keeps_its_backend_slot(self):
+        state = ServiceState(backend_concurrency={"scrape": 1})
+
+        async def run():
+            finished, _ = await service._within(state.call("scrape", time.sleep, 0.3), 0.05)
+            assert not finished
+            start = time.monotonic()
+            await state.call("scrape", lambda: None)
+            return time.monotonic() - start
+
+        # The second call waits for the first one's thread, not only for its caller
+        assert asyncio.run(run()) > 0.2
+
+    def test_replacement_fetch_gets_its_own_timeout(self):
+        def extract(url):
+            time.sleep(0.25 if url.endswith("/0") else 0.1)
+            return f"Error extracting content from {url}: 500 Server Error" if url.endswith("/0") else f"content of {url}"
+
+        with patch('modules.service.scraper.extract_web_content', side_effect=extract):
+            gathered = asyncio.run(service.gather_sources(ServiceState(), "question", include_youtube=False,
+                                                          max_web_results=1, fetch_timeout=0.3))
+
+        assert [source["url"] for source in gathered["web_sources"]] == ["https://example.com/1"]
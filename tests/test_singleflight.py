@@ -0,0 +1,239 @@
+import json
+import os
+import threading
+import time
+from multiprocessing import get_context
+from unittest.mock import patch
+import pytest
+import requests
+from modules import cache, llm, scraper, search, singleflight
+from modules.singleflight import SingleFlight
+from tests.fake_gemini import FakeGeminiModel
+from tests.test_content_cache import ARTICLE_HTML, make_response
+
+
+def run_together(count, target):
+    results = [None] * count
+
+    def run(i):
+        try:
+            results[i] = target()
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def search_in_process(cache_dir, log_path, ready_dir, name):
+    # Runs in a spawned process: both processes ask the same question
+    cache.CACHE_DIR = cache_dir
+    singleflight.ACROSS_PROCESSES = True
+    open(os.path.join(ready_dir, name), "w").close()
+
+    def slow_search():
+        with open(log_path, "a") as log:
+            log.write(f"{name}\n")
+        while len(os.listdir(ready_dir)) < 2:
+            time.sleep(0.01)
+        time.sleep(0.3)  # the other process is now waiting on the lock
+        return ["result"]
+
+    return SingleFlight("test", processes="result").do("query", slow_search)
+
+
+class TestSingleFlight:
+
+    def test_concurrent_calls_share_one_run(self):
+        group = SingleFlight("test")
+        calls = []
+
+        def slow():
+            calls.append(1)
+            time.sleep(0.2)
+            return ["result"]
+
+        results = run_together(8, lambda: group.do("key", slow))
+
+        assert calls == [1]
+        assert results == [["result"]] * 8
+        assert group.stats() == {"leaders": 1, "followers": 7, "in_flight": 0}
+
+    def test_error_reaches_every_caller_and_is_not_kept(self):
+        group = SingleFlight("test")
+
+        def failing():
+            time.sleep(0.2)
+            raise RuntimeError("provider down")
+
+        results = run_together(4, lambda: group.do("key", failing))
+
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert group.do("key", lambda: "recovered") == "recovered"
+
+    def test_followers_receive_streamed_items_as_they_are_produced(self):
+        group = SingleFlight("test")
+        release = threading.Event()
+
+        def produce():
+            yield "first"
+            release.wait()
+            yield "second"
+
+        leader = group.stream("key", produce)
+        assert next(leader) == "first"
+        follower = group.stream("key", lambda: iter(["not run"]))
+        assert next(follower) == "first"
+        release.set()
+
+        assert list(leader) == ["second"]
+        assert list(follower) == ["second"]
+
+    def test_leader_stopping_early_fails_followers_instead_of_truncating(self):
+        group = SingleFlight("test")
+        leader = group.stream("key", lambda: iter(["a", "b", "c"]))
+        assert next(leader) == "a"
+        follower = group.stream("key", lambda: iter(["not run"]))
+        assert next(follower) == "a"
+        waiting = group.stream("key", lambda: iter(["own run"]))
+        leader.close()
+
+        with pytest.raises(singleflight.FlightAbandoned):
+            list(follower)
+        # A follower that had received nothing runs the call itself
+        assert list(waiting) == ["own run"]
+        assert list(group.stream("key", lambda: iter(["x"]))) == ["x"]
+
+    def test_follower_of_a_stuck_leader_runs_the_call_itself(self, monkeypatch):
+        monkeypatch.setattr(singleflight, "WAIT_TIMEOUT_SECONDS", 0.1)
+        group = SingleFlight("test")
+        release = threading.Event()
+        calls = []
+
+        def call():
+            calls.append(1)
+            if len(calls) == 1:
+                release.wait(2)
+            return "result"
+
+        leader = threading.Thread(target=lambda: group.do("key", call))
+        leader.start()
+        time.sleep(0.05)
+        start = time.monotonic()
+        assert group.do("key", call) == "result"
+        assert time.monotonic() - start < 1
+        release.set()
+        leader.join()
+
+        assert len(calls) == 2
+
+    @pytest.mark.skipif(os.name != "posix", reason="needs fcntl")
+    def test_lock_held_by_a_stuck_process_is_not_waited_on_forever(self, monkeypatch):
+        import fcntl
+        monkeypatch.setattr(singleflight, "ACROSS_PROCESSES", True)
+        monkeypatch.setattr(singleflight, "WAIT_TIMEOUT_SECONDS", 0.2)
+        group = SingleFlight("test", processes="lock")
+        path = group._path("key") + ".lock"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a+b") as held:
+            fcntl.flock(held, fcntl.LOCK_EX)
+            start = time.monotonic()
+            assert group.do("key", lambda: "result") == "result"
+            assert time.monotonic() - start < 1
+
+    def test_results_are_not_published_unless_configured(self):
+        SingleFlight("test", processes="result").do("key", lambda: ["result"])
+
+        assert not os.path.exists(os.path.join(cache.CACHE_DIR, "flights"))
+
+    @pytest.mark.skipif(os.name != "posix", reason="needs fcntl")
+    def test_results_are_published_as_json(self, monkeypatch):
+        monkeypatch.setattr(singleflight, "ACROSS_PROCESSES", True)
+        group = SingleFlight("test", processes="result")
+        group.do("key", lambda: [{"title": "Hit", "url": "https://example.com"}])
+
+        with open(group._path("key") + ".result", encoding="utf-8") as f:
+            assert json.load(f) == [{"title": "Hit", "url": "https://example.com"}]
+
+    @pytest.mark.skipif(os.name != "posix", reason="needs fcntl")
+    def test_sweep_keeps_lock_files_that_are_held(self, tmp_path):
+        import fcntl
+        old = time.time() - 100 * singleflight.RESULT_TTL_SECONDS
+        for name in ("held.lock", "free.lock", "free.result"):
+            (tmp_path / name).touch()
+            os.utime(tmp_path / name, (old, old))
+        with open(tmp_path / "held.lock", "a+b") as held:
+            fcntl.flock(held, fcntl.LOCK_EX)
+            singleflight._sweep(str(tmp_path))
+
+        assert sorted(os.listdir(tmp_path)) == ["held.lock"]
+
+    @pytest.mark.skipif(os.name != "posix", reason="needs fcntl")
+    def test_processes_share_a_published_result(self, tmp_path):
+        log_path = str(tmp_path / "calls.log")
+        ready_dir = tmp_path / "ready"
+        ready_dir.mkdir()
+        context = get_context("spawn")
+        with context.Pool(2) as pool:
+            pending = [pool.apply_async(search_in_process, (str(tmp_path), log_path, str(ready_dir), name))
+                       for name in ("a", "b")]
+            results = [result.get(timeout=30) for result in pending]
+
+        assert results == [["result"], ["result"]]
+        with open(log_path) as log:
+            assert len(log.read().split()) == 1
+
+
+class TestCoalescedCalls:
+
+    def test_concurrent_fetches_of_a_page_download_once(self):
+        def slow_get(*args, **kwargs):
+            time.sleep(0.2)
+            return make_response(text=ARTICLE_HTML)
+
+        with patch('modules.scraper.http.get_session') as get_session:
+            get_session.return_value.get.side_effect = slow_get
+            texts = run_together(6, lambda: scraper.extract_web_content("https://example.com/page"))
+
+        assert get_session.return_value.get.call_count == 1
+        assert len(set(texts)) == 1 and "Cached paragraph text." in texts[0]
+
+    def test_coalesced_failure_names_each_callers_url(self):
+        def failing_get(*args, **kwargs):
+            time.sleep(0.2)
+            raise requests.HTTPError("403 Client Error: Forbidden")
+
+        urls = ["https://example.com/a/", "https://example.com/a?utm_source=x"]
+        with patch('modules.scraper.http.get_session') as get_session:
+            get_session.return_value.get.side_effect = failing_get
+            texts = run_together(2, lambda: scraper.extract_web_content(urls.pop()))
+
+        assert get_session.return_value.get.call_count == 1
+        assert sorted(texts) == [f"Error extracting content from {url}: 403 Client Error: Forbidden"
+                                 for url in ["https://example.com/a/", "https://example.com/a?utm_source=x"]]
+
+    def test_concurrent_identical_searches_call_the_provider_once(self):
+        def slow_stream(query, max_results, answered):
+            time.sleep(0.2)
+            answered["provider"] = "duckduckgo"
+            yield {"title": "Hit", "url": "https://example.com", "snippet": "..."}
+
+        with patch('modules.search._stream_web_results', side_effect=slow_stream) as provider:
+            results = run_together(5, lambda: search.search_web("Same question?"))
+
+        assert provider.call_count == 1
+        assert results == [[{"title": "Hit", "url": "https://example.com", "snippet": "..."}]] * 5
+
+    @patch.dict('os.environ', {'GEMINI_API_KEY': 'test-key'})
+    def test_identical_prompts_make_one_model_call(self):
+        model = FakeGeminiModel(delay=0.2)
+        sources = [{"title": "Page", "url": "https://example.com/1", "content": "A fact.\nMore."}]
+        with patch('modules.llm.clients.gemini_model', return_value=model):
+            answers = run_together(6, lambda: llm.generate_answer("What is it?", sources, []))
+
+        assert len(model.prompts) == 1
+        assert len(set(answers)) == 1 and not answers[0].startswith("Error")
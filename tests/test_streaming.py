@@ -0,0 +1,63 @@
+from unittest.mock import MagicMock, patch
+from modules.citations import CitationStream, process_citations
+from modules.llm import stream_answer
+
+
+WEB_SOURCES = [{"title": "Web Article", "url": "https://example.com", "content": "Fact."}]
+YOUTUBE_SOURCES = [{"id": "abcd1234", "title": "YouTube Video", "url": "https://youtube.com/watch?v=abcd1234", "transcript_text": ""}]
+ANSWER = ("First fact [1]. Second fact from a video [2][01:45].\nThird fact [1],[2][00:30]!\n\n"
+          "SOURCES:\n1. Web Article\n2. YouTube Video [2][00:30]")
+
+
+def stream_in_pieces(text, size):
+    stream = CitationStream(WEB_SOURCES, YOUTUBE_SOURCES)
+    releases = [stream.feed(text[i:i + size]) for i in range(0, len(text), size)]
+    releases.append(stream.flush())
+    return stream, releases
+
+
+class TestCitationStream:
+
+    def test_streamed_links_match_batch_processing(self):
+        expected, sources_section, timestamps = process_citations(ANSWER, WEB_SOURCES, YOUTUBE_SOURCES)
+        for size in (1, 3, 7, len(ANSWER)):
+            stream, releases = stream_in_pieces(ANSWER, size)
+
+            assert "".join(releases).strip() == expected
+            assert stream.sources_section == sources_section
+            assert stream.earliest_timestamps == timestamps
+            assert stream.text == ANSWER
+
+    def test_only_complete_sentences_are_released(self):
+        stream = CitationStream(WEB_SOURCES, YOUTUBE_SOURCES)
+
+        assert stream.feed("A claim [") == ""
+        assert stream.feed("1") == ""
+        released = stream.feed("]. Next")
+        assert released == 'A claim <a href="https://example.com" target="_blank">[1]</a>. '
+        assert stream.flush() == "Next"
+
+    def test_sources_trailer_split_across_chunks(self):
+        stream = CitationStream(WEB_SOURCES, YOUTUBE_SOURCES)
+        released = stream.feed("Done [1].\n\nSOUR") + stream.feed("CES:\n1. Web Article [1]")
+
+        assert "SOUR" not in released
+        assert stream.in_sources
+        assert stream.sources_section == "SOURCES:\n1. Web Article [1]"
+        assert stream.flush() == ""
+
+
+class TestStreamAnswer:
+
+    @patch.dict('os.environ', {'GEMINI_API_KEY': 'test-key'})
+    def test_chunks_are_yielded_and_cached(self):
+        model = MagicMock()
+        model.generate_content.return_value = iter([MagicMock(text="Hello "), MagicMock(text="world [1].")])
+        with patch('modules.llm.clients.gemini_model', return_value=model):
+            chunks = list(stream_answer("q", WEB_SOURCES, []))
+            cached = list(stream_answer("q", WEB_SOURCES, []))
+
+        assert chunks == ["Hello ", "world [1]."]
+        assert model.generate_content.call_args.kwargs["stream"] is True
+        assert cached == ["Hello world [1]."]
+        assert model.generate_content.call_count == 1
@@ -0,0 +1,66 @@
+import json
+import pytest
+from unittest.mock import patch
+from modules import gather, tracing
+from modules.tracing import LatencyHistogram
+
+
+def fake_web_hits(query, max_results=5, report=None):
+    for i in range(max_results):
+        yield {"title": f"Page {i}", "url": f"https://example.com/{i}", "snippet": ""}
+
+
+def traced_extract(url):
+    with tracing.span("scrape.page", url=url):
+        return f"content of {url}"
+
+
+class TestLatencyHistogram:
+
+    def test_percentiles_within_bucket_width(self):
+        histogram = LatencyHistogram()
+        for ms in range(1, 101):
+            histogram.record(ms / 1000)
+
+        assert histogram.percentile(0.50) == pytest.approx(0.050, rel=0.11)
+        assert histogram.percentile(0.99) == pytest.approx(0.099, rel=0.11)
+        assert histogram.percentile(1.0) == pytest.approx(0.100)
+        assert histogram.summary()["count"] == 100
+
+    def test_empty_histogram(self):
+        assert LatencyHistogram().percentile(0.95) == 0.0
+
+
+class TestTrace:
+
+    @patch('modules.gather.scraper.extract_web_content', side_effect=traced_extract)
+    @patch('modules.gather.search.iter_web_results', side_effect=fake_web_hits)
+    def test_spans_from_fetch_threads_join_the_trace(self, mock_search, mock_extract):
+        with tracing.trace("question") as trace:
+            gather.gather_sources("question", include_youtube=False, max_web_results=3)
+
+        spans = trace.to_dict()["spans"]
+        pages = [span for span in spans if span["name"] == "scrape.page"]
+        assert sorted(span["attributes"]["url"] for span in pages) == [f"https://example.com/{i}" for i in range(3)]
+        assert all(span["parent"] == "question" for span in pages)
+        assert {"question", "search.web"} <= {span["name"] for span in spans}
+
+    def test_failed_span_and_log_line(self):
+        with pytest.raises(ValueError):
+            with tracing.trace("broken question"):
+                with tracing.span("llm.generate"):
+                    raise ValueError("quota exceeded")
+
+        with open(tracing.TRACE_LOG_PATH, encoding="utf-8") as log:
+            records = [json.loads(line) for line in log]
+        trace = next(record for record in records if record["type"] == "trace")
+        failed = next(span for span in trace["spans"] if span["name"] == "llm.generate")
+        assert failed["status"] == "error" and failed["error"] == "quota exceeded"
+        assert "llm.generate" in next(record for record in records if record["type"] == "histograms")["stages"]
+
+    def test_waterfall_escapes_attributes(self):
+        with tracing.trace("question") as trace:
+            with tracing.span("scrape.page", url="https://example.com/?a=<b>"):
+                pass
+
+        assert "&lt;b&gt;" in tracing.render_waterfall(trace)
@@ -0,0 +1,79 @@
+from unittest.mock import patch
+from modules.citations import process_citations
+from modules.scraper import get_video_transcript, format_transcript_text
+from modules.transcripts import Transcript, TranscriptStore
+from tests.test_content_cache import FakeClock
+
+
+SEGMENTS = [
+    {'text': 'Intro', 'start': 0.0, 'duration': 4.0},
+    {'text': 'Main point', 'start': 62.4, 'duration': 5.0},
+    {'text': 'Details', 'start': 135.7, 'duration': 3.0},
+]
+
+
+class TestTranscript:
+
+    def test_segments_index_like_dicts(self):
+        transcript = Transcript.from_segments("vid", SEGMENTS)
+
+        assert len(transcript) == 3
+        assert transcript[1] == {'text': 'Main point', 'start': 62.4, 'timestamp': '01:02', 'timestamp_seconds': 62.4}
+        assert transcript[-1]['text'] == 'Details'
+        assert [segment['timestamp'] for segment in transcript] == ['00:00', '01:02', '02:15']
+
+    def test_formatted_text_cuts_at_segment_boundary(self):
+        transcript = Transcript.from_segments("vid", SEGMENTS)
+
+        assert format_transcript_text(transcript) == "[00:00] Intro\n[01:02] Main point\n[02:15] Details\n"
+        assert transcript.formatted(max_chars=35) == "[00:00] Intro\n[01:02] Main point\n..."
+
+    def test_snap_to_nearest_segment_start(self):
+        transcript = Transcript.from_segments("vid", SEGMENTS)
+
+        assert transcript.snap(135) == 135
+        assert transcript.snap(70) == 62
+        assert transcript.snap(120) == 135
+        assert transcript.snap(5000) == 135
+
+    def test_bytes_round_trip(self):
+        transcript = Transcript.from_segments("vid", SEGMENTS + [{'text': 'Ünïcode ✓', 'start': 200.0}])
+        restored = Transcript.from_bytes("vid", transcript.to_bytes())
+
+        assert list(restored) == list(transcript)
+        assert restored.durations.tolist() == [4.0, 5.0, 3.0, 0.0]
+
+    @patch('youtube_transcript_api.YouTubeTranscriptApi.get_transcript', return_value=SEGMENTS)
+    def test_transcript_is_fetched_once(self, mock_get_transcript):
+        first = get_video_transcript('vid')
+        second = get_video_transcript('vid')
+
+        assert mock_get_transcript.call_count == 1
+        assert list(second) == list(first)
+
+    def test_store_evicts_least_recently_used_and_expired_transcripts(self, tmp_path):
+        clock = FakeClock()
+        store = TranscriptStore(str(tmp_path / "transcripts.sqlite3"), ttl=60, max_entries=2, clock=clock)
+        for video_id in ("a", "b"):
+            store.put(Transcript.from_segments(video_id, SEGMENTS))
+            clock.now += 1
+        store.get("a")
+        clock.now += 1
+        store.put(Transcript.from_segments("c", SEGMENTS))
+
+        assert store.get("b") is None
+        assert list(store.get("a")) == list(Transcript.from_segments("a", SEGMENTS))
+        clock.now += 61
+        assert store.get("c") is None
+
+    def test_cited_timestamp_snaps_to_segment(self):
+        youtube_sources = [{
+            "id": "vid", "title": "Video", "url": "https://www.youtube.com/watch?v=vid",
+            "transcript": Transcript.from_segments("vid", SEGMENTS)
+        }]
+
+        processed_answer, _, timestamps = process_citations("A claim [1][01:05].", [], youtube_sources)
+
+        assert 'href="https://www.youtube.com/watch?v=vid&t=62s"' in processed_answer
+        assert '[1][01:02]</a>' in processed_answer
+        assert timestamps[1] == {"timestamp": "01:02", "seconds": 62}
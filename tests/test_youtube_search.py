@@ -0,0 +1,55 @@
+import time
+from unittest.mock import patch
+from modules.search import search_youtube
+from tests.fake_youtube import FakeYouTubeClient
+
+
+def make_videos(captions):
+    return [{"id": f"vid{i}", "title": f"Video {i}", "caption": caption} for i, caption in enumerate(captions)]
+
+
+class TestYouTubeSearch:
+
+    @patch.dict('os.environ', {'YOUTUBE_API_KEY': 'test-key'})
+    def test_caption_check_is_one_batched_call(self):
+        client = FakeYouTubeClient(make_videos(["true"] * 6))
+        with patch('modules.search.clients.youtube', return_value=client):
+            videos = search_youtube("query", max_results=3)
+
+        assert [video["id"] for video in videos] == ["vid0", "vid1", "vid2"]
+        assert client.calls_to("captions") == []
+        assert len(client.calls_to("videos")) == 1
+        assert client.calls_to("videos")[0]["id"] == "vid0,vid1,vid2,vid3,vid4,vid5"
+        assert client.calls_to("videos")[0]["part"] == "contentDetails"
+
+    @patch.dict('os.environ', {'YOUTUBE_API_KEY': 'test-key'})
+    def test_uncaptioned_videos_are_skipped_in_rank_order(self):
+        client = FakeYouTubeClient(make_videos(["false", "true", "false", "true", "true", "true"]))
+        with patch('modules.search.clients.youtube', return_value=client):
+            videos = search_youtube("query", max_results=3, probe_transcripts=False)
+
+        assert [video["id"] for video in videos] == ["vid1", "vid3", "vid4"]
+        assert videos[0]["url"] == "https://www.youtube.com/watch?v=vid1"
+
+    @patch.dict('os.environ', {'YOUTUBE_API_KEY': 'test-key'})
+    def test_transcript_probe_fills_missing_slots(self):
+        client = FakeYouTubeClient(make_videos(["false", "true", "false", "false", "false", "false"]))
+        with patch('modules.search.clients.youtube', return_value=client), \
+                patch('modules.search.has_transcript', side_effect=lambda video_id: video_id == "vid2") as probe:
+            videos = search_youtube("query", max_results=3)
+
+        assert [video["id"] for video in videos] == ["vid1", "vid2"]
+        assert probe.call_count == 5
+
+    @patch.dict('os.environ', {'YOUTUBE_API_KEY': 'test-key'})
+    def test_transcript_probes_run_concurrently(self):
+        client = FakeYouTubeClient(make_videos(["false"] * 6))
+        with patch('modules.search.clients.youtube', return_value=client), \
+                patch('modules.search.has_transcript', side_effect=lambda video_id: time.sleep(0.2) or True) as probe:
+            start = time.monotonic()
+            videos = search_youtube("query", max_results=3)
+            elapsed = time.monotonic() - start
+
+        assert [video["id"] for video in videos] == ["vid0", "vid1", "vid2"]
+        assert probe.call_count == 3
+        assert elapsed < 0.5